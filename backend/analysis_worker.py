@@ -0,0 +1,571 @@
+"""
+Worker side of the analysis process pool.
+
+Generated analysis code runs here instead of inside the API process, so a
+runaway loop or a huge groupby can be killed without taking the server down.
+This module is kept free of FastAPI/database setup so worker processes start
+quickly and only carry the data-science stack.
+"""
+import os
+import sys
+import io
+import gc
+import time
+import hashlib
+import traceback
+from collections import OrderedDict
+from contextlib import contextmanager, redirect_stdout
+from multiprocessing import shared_memory
+
+import warnings
+warnings.filterwarnings('ignore')
+
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import matplotlib
+matplotlib.use('Agg')  # Use non-interactive backend
+import matplotlib.pyplot as plt
+from matplotlib.collections import PathCollection
+import seaborn as sns
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
+from sklearn.linear_model import LinearRegression
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import r2_score, mean_squared_error
+from scipy import stats
+from sqlalchemy import create_engine
+
+try:
+    import resource  # POSIX only
+except ImportError:
+    resource = None
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+# execute_sql results per worker, bounded by their in-memory size (counts against the worker memory limit)
+SQL_CACHE_MAX_BYTES = int(os.getenv("WORKER_SQL_CACHE_MAX_MB", "256")) * 1024 * 1024
+SQL_CACHE_TTL = int(os.getenv("SQL_RESULT_CACHE_TTL", "600"))
+ATTACHED_DATASETS_MAX = 4
+
+# Per-process state: recently attached datasets, the analysis engine and SQL results
+_dataset_cache = OrderedDict()  # (Arrow path, version) -> DataFrame
+_detached_blocks = []
+_engines = {}
+_sql_cache = OrderedDict()  # (normalized query, table version) -> (DataFrame, nbytes, expires_at)
+_sql_cache_bytes = 0
+_sql_cache_counts = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+_shown_figures = []
+_thread_limits = None
+
+@contextmanager
+def capture_plotly_show():
+    """fig.show() would try to open a browser; while a job runs it records the figure for the response instead"""
+    original = go.Figure.show
+    go.Figure.show = lambda fig, *args, **kwargs: _shown_figures.append(fig)
+    try:
+        yield
+    finally:
+        go.Figure.show = original
+
+def apply_memory_limit(memory_limit_mb):
+    """Cap the worker's heap so a runaway job fails with MemoryError instead of swapping the host.
+
+    RLIMIT_DATA rather than RLIMIT_AS: shared memory blocks and memory-mapped
+    Arrow files are shared file mappings and must not count toward the cap.
+    """
+    limit_kind = getattr(resource, 'RLIMIT_DATA', None)
+    if limit_kind is None or not memory_limit_mb:
+        return
+    limit = int(memory_limit_mb) * 1024 * 1024
+    try:
+        resource.setrlimit(limit_kind, (limit, limit))
+    except (ValueError, OSError) as e:
+        print(f"⚠️  [Worker] Could not apply memory limit: {e}", file=sys.stderr)
+
+def attach_shared_memory(name):
+    try:
+        # The API process owns the block; the worker must never unlink it on exit
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13 has no track flag
+        return shared_memory.SharedMemory(name=name)
+
+def load_dataset(dataset):
+    """Resolve a dataset reference from the API process into a read-only DataFrame.
+
+    Arrow files are memory-mapped rather than read, so numeric columns without
+    nulls point straight at the page cache the API process shares. Recently
+    used files stay mapped across jobs; a file replaced by a new upload gets a
+    new version and is mapped afresh. Shared memory blocks (frames with no
+    Arrow file) are attached for a single job and closed afterwards, so the
+    worker never pins a block the API process has already unlinked.
+    """
+    if 'frame' in dataset:
+        return dataset['frame']
+    if dataset.get('shm_name'):
+        block = attach_shared_memory(dataset['shm_name'])
+        _detached_blocks.append(block)  # Closed by release_detached_blocks once the job is done
+        return pa.ipc.open_file(pa.py_buffer(block.buf)).read_all().to_pandas(split_blocks=True)
+
+    key = (dataset['columnar_path'], dataset.get('version'))
+    cached = _dataset_cache.get(key)
+    if cached is not None:
+        _dataset_cache.move_to_end(key)
+        return cached
+    source = pa.memory_map(dataset['columnar_path'], 'r')
+    df = pa.ipc.open_file(source).read_all().to_pandas(split_blocks=True)
+    _dataset_cache[key] = df
+    while len(_dataset_cache) > ATTACHED_DATASETS_MAX:
+        _dataset_cache.popitem(last=False)
+    return df
+
+def release_detached_blocks():
+    """Close attached shared memory blocks once no frame still points into them"""
+    if _detached_blocks:
+        gc.collect()  # Frames from the finished job may linger in reference cycles
+    for block in list(_detached_blocks):
+        try:
+            block.close()
+            _detached_blocks.remove(block)
+        except BufferError:
+            pass
+
+def get_engine(db_path):
+    engine = _engines.get(db_path)
+    if engine is None:
+        engine = create_engine(f"sqlite:///file:{db_path}?mode=ro&uri=true", connect_args={"check_same_thread": False})
+        _engines[db_path] = engine
+    return engine
+
+def sql_cache_get(key):
+    global _sql_cache_bytes
+    entry = _sql_cache.get(key)
+    if entry is not None and entry[2] < time.time():
+        del _sql_cache[key]
+        _sql_cache_bytes -= entry[1]
+        _sql_cache_counts['expirations'] += 1
+        entry = None
+    if entry is None:
+        _sql_cache_counts['misses'] += 1
+        return None
+    _sql_cache.move_to_end(key)
+    _sql_cache_counts['hits'] += 1
+    return entry[0]
+
+def sql_cache_put(key, df):
+    """Keep a result, evicting the least recently used ones to stay within SQL_CACHE_MAX_BYTES"""
+    global _sql_cache_bytes
+    nbytes = int(df.memory_usage(deep=True).sum())
+    if nbytes > SQL_CACHE_MAX_BYTES:
+        return
+    _sql_cache[key] = (df, nbytes, time.time() + SQL_CACHE_TTL)
+    _sql_cache_bytes += nbytes
+    while _sql_cache_bytes > SQL_CACHE_MAX_BYTES:
+        _, (_, evicted_bytes, _) = _sql_cache.popitem(last=False)
+        _sql_cache_bytes -= evicted_bytes
+        _sql_cache_counts['evictions'] += 1
+
+def sql_cache_report():
+    """Counters since the last report, plus current size; sent back with each job result"""
+    report = {**_sql_cache_counts, 'pid': os.getpid(), 'entries': len(_sql_cache), 'bytes': _sql_cache_bytes}
+    for name in _sql_cache_counts:
+        _sql_cache_counts[name] = 0
+    return report
+
+def execute_sql_query(query, engine, table_version=None):
+    """Execute SQL query, print results, and return DataFrame"""
+    try:
+        cache_key = (" ".join(query.split()), table_version)
+        df = sql_cache_get(cache_key)
+        if df is None:
+            df = pd.read_sql_query(query, engine)
+            sql_cache_put(cache_key, df)
+        # Callers may modify the frame, keep the cached one pristine (a shallow copy is enough under copy-on-write)
+        df = df.copy(deep=not pd.options.mode.copy_on_write)
+        # Print a readable summary of the results
+        print("SQL Query Results:")
+        print(df.head(20).to_string(index=False))
+        return df
+    except Exception as e:
+        print(f"SQL Query Error: {str(e)}")
+        raise Exception(f"SQL Query Error: {str(e)}")
+
+CHART_MEDIA_TYPES = {'png': 'image/png', 'webp': 'image/webp', 'svg': 'image/svg+xml'}
+
+def render_chart(fig, options):
+    """Render a figure and store it under a content-hash file name.
+
+    options carries format, dpi, max_width/max_height (inches), max_points,
+    density_grid and chart_dir. Series above max_points are downsampled first.
+    Identical charts map to the same file, so repeated questions reuse it.
+    """
+    fmt = options.get('format', 'png')
+    original, rendered, methods = downsample_matplotlib(fig, options.get('max_points', 2000), options.get('density_grid', 100))
+    width, height = fig.get_size_inches()
+    scale = min(1.0, options.get('max_width', width) / width, options.get('max_height', height) / height)
+    if scale < 1.0:
+        fig.set_size_inches(width * scale, height * scale)
+
+    save_kwargs = {'format': fmt, 'dpi': options.get('dpi', 100), 'bbox_inches': 'tight'}
+    if fmt == 'svg':
+        save_kwargs['metadata'] = {'Date': None}  # Keep the output deterministic for hashing
+    elif fmt == 'webp':
+        save_kwargs['pil_kwargs'] = {'quality': 85, 'method': 4}
+    buffer = io.BytesIO()
+    fig.savefig(buffer, **save_kwargs)
+    data = buffer.getvalue()
+
+    name = f"{hashlib.sha256(data).hexdigest()[:32]}.{fmt}"
+    file_path = os.path.join(options['chart_dir'], name)
+    try:
+        # Already stored: refresh its mtime, which is what the chart store prunes by
+        os.utime(file_path)
+    except FileNotFoundError:
+        tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, file_path)
+    return {
+        'name': name,
+        'format': fmt,
+        'media_type': CHART_MEDIA_TYPES[fmt],
+        'bytes': len(data),
+        'reduction': reduction_summary(original, rendered, methods)
+    }
+
+def find_plotly_figure(exec_globals):
+    """The figure the code showed last, else a figure left in a variable (preferring `fig`)"""
+    if _shown_figures:
+        return _shown_figures[-1]
+    if isinstance(exec_globals.get('fig'), go.Figure):
+        return exec_globals['fig']
+    figures = [value for value in exec_globals.values() if isinstance(value, go.Figure)]
+    return figures[-1] if figures else None
+
+def take_points(trace, keep, n):
+    """Subset every per-point array of a trace (including marker/line styling) to the kept indices"""
+    for key, value in list(trace.items()):
+        if isinstance(value, dict) and key in ('marker', 'line', 'error_x', 'error_y'):
+            take_points(value, keep, n)
+        elif isinstance(value, (np.ndarray, list, tuple)) and len(value) == n:
+            trace[key] = np.asarray(value)[keep]
+
+def lttb_indices(x, y, n_out):
+    """Largest-Triangle-Three-Buckets: indices of n_out points that best preserve a line's shape"""
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    y = np.where(np.isnan(y), np.nanmean(y) if not np.isnan(y).all() else 0.0, y)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)  # n_out - 2 buckets between the fixed end points
+    keep = np.empty(n_out, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        # Pick the point forming the largest triangle with the last kept point and the next bucket's average
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+def density_bins(x, y, grid, weights=None):
+    """Bin points on a grid; returns the centers of occupied cells, their counts and mean weights"""
+    valid = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[valid], y[valid]
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=grid)
+    ix, iy = np.nonzero(counts)
+    centers_x = ((x_edges[:-1] + x_edges[1:]) / 2)[ix]
+    centers_y = ((y_edges[:-1] + y_edges[1:]) / 2)[iy]
+    means = None
+    if weights is not None:
+        sums, _, _ = np.histogram2d(x, y, bins=[x_edges, y_edges], weights=np.asarray(weights, dtype=float)[valid])
+        means = sums[ix, iy] / counts[ix, iy]
+    return centers_x, centers_y, counts[ix, iy], means
+
+def density_marker_sizes(counts, smallest, largest):
+    scale = np.log1p(counts) / np.log1p(counts.max())
+    return smallest + (largest - smallest) * scale
+
+def numeric_axis(values):
+    """Float positions for LTTB: numbers as-is, datetimes as epoch ns, anything else by position"""
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.number):
+        return values.astype(float)
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype('datetime64[ns]').astype('int64').astype(float)
+    try:
+        return pd.to_datetime(values).values.astype('int64').astype(float)
+    except (ValueError, TypeError):
+        return np.arange(len(values), dtype=float)
+
+def downsample_matplotlib(fig, max_points, density_grid):
+    """Downsample every artist in the figure above max_points in place before rendering.
+
+    Lines get LTTB; scatter collections are density binned into one marker per
+    occupied cell, sized by count and colored by the mean of any mapped values.
+    Returns (original points, rendered points, methods used).
+    """
+    original = rendered = 0
+    methods = set()
+    for ax in fig.get_axes():
+        for line in ax.get_lines():
+            xy = line.get_xydata()
+            original += len(xy)
+            if len(xy) > max_points:
+                keep = lttb_indices(xy[:, 0], xy[:, 1], max_points)
+                line.set_data(xy[keep, 0], xy[keep, 1])
+                methods.add('lttb')
+                rendered += len(keep)
+            else:
+                rendered += len(xy)
+        for collection in ax.collections:
+            if not isinstance(collection, PathCollection):
+                continue
+            offsets = np.asarray(collection.get_offsets(), dtype=float)
+            original += len(offsets)
+            if len(offsets) <= max_points:
+                rendered += len(offsets)
+                continue
+            mapped = collection.get_array()
+            mapped = mapped if mapped is not None and len(mapped) == len(offsets) else None
+            centers_x, centers_y, counts, means = density_bins(offsets[:, 0], offsets[:, 1], density_grid, mapped)
+            collection.set_offsets(np.column_stack([centers_x, centers_y]))
+            base_size = float(np.median(collection.get_sizes())) if len(collection.get_sizes()) else 20.0
+            collection.set_sizes(density_marker_sizes(counts, base_size, base_size * 4))
+            if means is not None:
+                collection.set_array(means)
+            methods.add('density')
+            rendered += len(counts)
+    return original, rendered, sorted(methods)
+
+def decimate_trace(trace, max_points, density_grid=100):
+    """Reduce one Plotly trace to about max_points points in place; returns (original, sent, method)"""
+    trace_type = trace.get('type', 'scatter')
+
+    if trace_type in ('ohlc', 'candlestick') and trace.get('open') is not None:
+        n = len(trace['open'])
+        if n <= max_points:
+            return n, n, None
+        # Merge consecutive bars: first open, highest high, lowest low, last close
+        starts = np.linspace(0, n, max_points + 1).astype(int)[:-1]
+        starts = np.unique(starts)
+        ends = np.append(starts[1:], n) - 1
+        bars = {
+            'open': np.asarray(trace['open'], dtype=float)[starts],
+            'high': np.maximum.reduceat(np.asarray(trace['high'], dtype=float), starts),
+            'low': np.minimum.reduceat(np.asarray(trace['low'], dtype=float), starts),
+            'close': np.asarray(trace['close'], dtype=float)[ends],
+        }
+        take_points(trace, starts, n)
+        trace.update(bars)
+        return n, len(starts), 'ohlc'
+
+    if trace_type == 'histogram':
+        values = trace.get('x') if trace.get('x') is not None else trace.get('y')
+        if values is None or len(values) <= max_points:
+            n = len(values) if values is not None else 0
+            return n, n, None
+        values = np.asarray(values)
+        if not np.issubdtype(values.dtype, np.number):
+            return len(values), len(values), None
+        # Bin on the server and send the bars instead of every sample
+        nbins = trace.get('nbinsx') or trace.get('nbinsy') or 'auto'
+        counts, edges = np.histogram(values[~np.isnan(values)], bins=nbins)
+        horizontal = trace.get('x') is None
+        centers = (edges[:-1] + edges[1:]) / 2
+        for key in ('x', 'y', 'nbinsx', 'nbinsy', 'xbins', 'ybins', 'histfunc', 'histnorm', 'bingroup', 'cumulative', 'autobinx', 'autobiny'):
+            trace.pop(key, None)
+        trace.update({
+            'type': 'bar',
+            'x': counts if horizontal else centers,
+            'y': centers if horizontal else counts,
+            'width': np.diff(edges),
+            'orientation': 'h' if horizontal else 'v',
+        })
+        return len(values), len(counts), 'binned'
+
+    if trace.get('y') is None:
+        n = len(trace['x']) if trace.get('x') is not None else 0
+        return n, n, None
+    y = np.asarray(trace['y'])
+    n = len(y)
+    if n <= max_points or not np.issubdtype(y.dtype, np.number):
+        return n, n, None
+    y = y.astype(float)
+    x_numeric = trace.get('x') is None or np.issubdtype(np.asarray(trace['x']).dtype, np.number)
+    x = numeric_axis(trace['x']) if trace.get('x') is not None else np.arange(n, dtype=float)
+
+    # Marker-only scatters become density bins; lines (and scatters over dates or categories) get LTTB
+    if trace_type in ('scatter', 'scattergl') and trace.get('mode') == 'markers' and x_numeric:
+        centers_x, centers_y, counts, _ = density_bins(x, y, density_grid)
+        for key in [k for k, v in trace.items() if isinstance(v, (np.ndarray, list, tuple)) and len(v) == n]:
+            trace.pop(key)
+        marker = trace.setdefault('marker', {})
+        for key in [k for k, v in marker.items() if isinstance(v, (np.ndarray, list, tuple)) and len(v) == n]:
+            marker.pop(key)
+        marker['size'] = density_marker_sizes(counts, 4, 16)
+        trace.update({'x': centers_x, 'y': centers_y, 'customdata': counts, 'hovertemplate': '%{x}, %{y}<br>%{customdata} points<extra></extra>'})
+        return n, len(counts), 'density'
+
+    keep = lttb_indices(x, y, max_points)
+    take_points(trace, keep, n)
+    return n, len(keep), 'lttb'
+
+def reduction_summary(original, rendered, methods):
+    """Reduction details for the stream, or None when nothing was downsampled"""
+    if not methods:
+        return None
+    return {
+        'original_points': int(original),
+        'rendered_points': int(rendered),
+        'ratio': round(original / rendered, 2) if rendered else None,
+        'methods': sorted(methods)
+    }
+
+def plotly_chart_spec(fig, max_points, density_grid=100):
+    """JSON spec of a Plotly figure with each trace decimated to at most about max_points points"""
+    spec = fig.to_dict()
+    original = sent = 0
+    methods = set()
+    for trace in spec.get('data', []):
+        before, after, method = decimate_trace(trace, max_points, density_grid)
+        original += before
+        sent += after
+        if method:
+            methods.add(method)
+    return pio.to_json(spec, validate=False), reduction_summary(original, sent, methods)
+
+def run_job(job):
+    """Execute generated code against the job's dataset and capture its output and chart"""
+    try:
+        # Workers run with copy-on-write, so a shallow copy gives the job its own frame
+        # without duplicating the shared columns; in-process runs need a real copy
+        df = load_dataset(job['dataset']).copy(deep=not pd.options.mode.copy_on_write)
+    except Exception as e:
+        return {
+            'success': False,
+            'error': f"Could not load dataset: {str(e)}",
+            'traceback': traceback.format_exc()
+        }
+
+    table_name = job.get('table_name')
+    engine = get_engine(job['db_path']) if table_name else None
+    table_version = job.get('table_version')
+
+    # Prepare execution environment with the actual dataframe
+    exec_globals = {
+        'df': df,
+        'pd': pd,
+        'np': np,
+        'plt': plt,
+        'sns': sns,
+        'px': px,
+        'go': go,
+        'stats': stats,
+        'LinearRegression': LinearRegression,
+        'train_test_split': train_test_split,
+        'r2_score': r2_score,
+        'mean_squared_error': mean_squared_error,
+        'execute_sql': lambda query: execute_sql_query(query, engine, table_version) if engine else None,
+        'table_name': table_name,
+        'profile': job.get('profile') or {},
+    }
+
+    # Clean the code - remove any file loading attempts
+    code = job['code']
+    cleaned_code = code.replace("pd.read_csv('path_to_your_dataset.csv')", "df")
+    cleaned_code = cleaned_code.replace("pd.read_csv(", "# pd.read_csv(")
+    cleaned_code = cleaned_code.replace("df = pd.read_csv", "# df = pd.read_csv")
+
+    # Capture output
+    output = io.StringIO()
+    chart_data = None
+    chart_spec = None
+    chart_reduction = None
+    _shown_figures.clear()
+
+    try:
+        with redirect_stdout(output), capture_plotly_show():
+            exec(cleaned_code, exec_globals)
+
+        # Get printed output
+        printed_output = output.getvalue()
+
+        # Check if a plot was created and render it to the chart store
+        if plt.get_fignums() and job.get('chart'):
+            chart_data = render_chart(plt.gcf(), job['chart'])
+
+        # Plotly figures go back as JSON specs for interactive rendering
+        plotly_fig = find_plotly_figure(exec_globals)
+        if plotly_fig is not None:
+            options = job.get('chart') or {}
+            chart_spec, chart_reduction = plotly_chart_spec(plotly_fig, options.get('max_points', 2000), options.get('density_grid', 100))
+
+        return {
+            'success': True,
+            'output': printed_output,
+            'chart': chart_data,
+            'chart_spec': chart_spec,
+            'chart_spec_reduction': chart_reduction
+        }
+
+    except MemoryError:
+        return {
+            'success': False,
+            'error': "Analysis exceeded the worker memory limit",
+            'traceback': traceback.format_exc()
+        }
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e),
+            'traceback': traceback.format_exc()
+        }
+    finally:
+        plt.close('all')  # Never leak figures into the next job
+        _shown_figures.clear()
+
+def worker_main(conn, memory_limit_mb):
+    """Serve jobs from the pool over a pipe until told to stop (None) or the pipe closes"""
+    global _thread_limits
+    # Process-wide settings that must not leak into the API process, which imports this module
+    # One BLAS thread per worker; parallelism comes from running several workers
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ.setdefault(var, "1")
+    if threadpool_limits is not None:
+        _thread_limits = threadpool_limits(limits=1)  # BLAS pools already started by the numpy import
+    # Datasets are attached read-only; copy-on-write lets generated code assign to df freely,
+    # copying only the columns it actually modifies
+    pd.options.mode.copy_on_write = True
+    apply_memory_limit(memory_limit_mb)
+    conn.send({'ready': True, 'pid': os.getpid()})
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+        cpu_start = time.process_time()
+        wall_start = time.time()
+        try:
+            result = run_job(job)
+        except MemoryError:
+            plt.close('all')
+            result = {'success': False, 'error': "Analysis exceeded the worker memory limit", 'traceback': ''}
+        result['cpu_seconds'] = time.process_time() - cpu_start
+        result['wall_seconds'] = time.time() - wall_start
+        result['sql_cache'] = sql_cache_report()
+        release_detached_blocks()
+        try:
+            conn.send(result)
+        except (EOFError, OSError):
+            break
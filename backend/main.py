@@ -2,11 +2,23 @@ import subprocess
 import os
 import sys
 import time
+import multiprocessing
+
+if __name__ == "__main__":
+    # Frozen builds re-launch this executable for analysis worker processes; hand those off before any setup runs
+    multiprocessing.freeze_support()
+
+# Spawned analysis workers re-import this script as __mp_main__; they must not start Ollama or pull models
+IS_WORKER_PROCESS = __name__ == "__mp_main__"
+
 import requests
+import httpx
+import asyncio
 import json
 import urllib.parse
 import pandas as pd
 import numpy as np
+import pyarrow as pa
 import matplotlib
 
 # Fix Windows console encoding for emoji support
@@ -21,8 +33,17 @@ import seaborn as sns
 import plotly.express as px
 import plotly.graph_objects as go
 import sqlite3
+import csv
+import re
 import io
 import base64
+import hashlib
+import itertools
+import functools
+import threading
+from multiprocessing import shared_memory
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import redirect_stdout
 import traceback
 from sklearn.linear_model import LinearRegression
@@ -31,7 +52,8 @@ from sklearn.metrics import r2_score, mean_squared_error
 from scipy import stats
 import warnings
 from fastapi import Query, Depends
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import create_engine, inspect, event
+from sqlalchemy.pool import QueuePool
 
 # Suppress warnings including bcrypt version warnings
 warnings.filterwarnings('ignore')
@@ -49,11 +71,11 @@ def is_ollama_running():
     except Exception:
         return False
 
-if not is_ollama_running():
+if not IS_WORKER_PROCESS and not is_ollama_running():
     # Start Ollama server in the background
     subprocess.Popen(['ollama', 'serve'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Query, Depends, status, Security
+from fastapi import FastAPI, HTTPException, UploadFile, File, Query, Depends, status, Security, BackgroundTasks
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 import requests
@@ -64,17 +86,18 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # For file processing
-from typing import List
+from typing import List, Optional
 from PIL import Image
 import pytesseract
 import PyPDF2
 import docx
 from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 import json
 from fastapi.responses import FileResponse
 
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Text, DateTime
+from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Text, DateTime, func
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
 import bcrypt
 from jose import JWTError, jwt
@@ -97,6 +120,18 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 CSV_UPLOAD_DIR = os.path.join(DATA_BASE_DIR, 'csv_uploads')
 os.makedirs(CSV_UPLOAD_DIR, exist_ok=True)
 
+# Typed columnar copies (Arrow IPC) of uploaded CSVs
+COLUMNAR_DIR = os.path.join(DATA_BASE_DIR, 'columnar')
+os.makedirs(COLUMNAR_DIR, exist_ok=True)
+
+# Rendered analysis charts, stored under content-hash names
+CHART_DIR = os.path.join(DATA_BASE_DIR, 'charts')
+os.makedirs(CHART_DIR, exist_ok=True)
+
+# Chunk embeddings of uploaded documents, one .npz per document
+DOC_INDEX_DIR = os.path.join(DATA_BASE_DIR, 'doc_index')
+os.makedirs(DOC_INDEX_DIR, exist_ok=True)
+
 # --- User Auth & RBAC Setup ---
 DATABASE_URL = "sqlite:///./users.db"
 Base = declarative_base()
@@ -129,6 +164,7 @@ class UploadedDocument(Base):
     session_id = Column(String, nullable=False, index=True)
     filename = Column(String, nullable=False)
     extracted_text = Column(Text, nullable=True)
+    index_path = Column(String, nullable=True)  # Chunk embeddings used for retrieval in /ask
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
     user = relationship("User", backref="user_uploaded_documents")
 
@@ -142,9 +178,26 @@ class UploadedCSV(Base):
     file_path = Column(String, nullable=False)
     columns_info = Column(Text, nullable=True)  # JSON string of column info
     table_name = Column(String, nullable=True)  # Name of the table where data is stored
+    columnar_path = Column(String, nullable=True)  # Arrow IPC copy of the parsed data
+    csv_dialect = Column(Text, nullable=True)  # JSON of the sniffed encoding/delimiter/header/number format
+    profile = Column(Text, nullable=True)  # JSON dataset profile computed at upload (see compute_dataset_profile)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
     user = relationship("User", backref="user_uploaded_csvs")
 
+# LLM-generated analysis code, reused for the same question about an identical schema
+class GeneratedCodeCache(Base):
+    __tablename__ = "generated_code_cache"
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String, unique=True, index=True, nullable=False)  # sha256 of model, prompt and schema
+    model = Column(String, nullable=False)
+    prompt = Column(Text, nullable=False)  # Normalized question
+    schema_signature = Column(String, nullable=False)
+    code = Column(Text, nullable=False)
+    size_bytes = Column(Integer, nullable=False)
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
 # Drop all tables and recreate them
 def recreate_database():
     Base.metadata.drop_all(bind=engine)
@@ -160,6 +213,24 @@ def ensure_database_schema():
     except Exception as e:
         print(f"Database schema outdated, recreating tables: {e}")
         recreate_database()
+    add_missing_columns()
+
+# Add nullable columns introduced after a database was created, keeping existing rows
+def add_missing_columns():
+    from sqlalchemy import text
+    inspector = inspect(engine)
+    existing_tables = inspector.get_table_names()
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                print(f"Adding column {table.name}.{column.name} ({column_type})")
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
 
 # Create tables and ensure schema is up to date
 Base.metadata.create_all(bind=engine)
@@ -309,6 +380,10 @@ class DataAnalysisRequest(BaseModel):
     prompt: str
     session_id: str
     model: str = "deepseek-coder-v2:latest"
+    chart_format: Optional[str] = None  # png, webp or svg; defaults to CHART_FORMAT
+    chart_dpi: Optional[int] = None
+    use_cache: bool = True  # Set False to regenerate the code and re-run it
+    fast_path: bool = True  # Answer simple questions directly from the dataset profile
 
 class CSVUploadResponse(BaseModel):
     filename: str
@@ -353,6 +428,208 @@ app.add_middleware(
 
 BASE_URL = "https://openrouter.ai/api/v1/chat/completions"
 
+# ============================================================================
+# IN-PROCESS CACHES
+# ============================================================================
+
+class BoundedLRUCache:
+    """Thread-safe LRU cache bounded by the total size of its entries in bytes.
+
+    With ttl_seconds set, entries older than the TTL are treated as misses.
+    on_evict(key, value) is called whenever an entry leaves the cache or is
+    refused by put(), for values that hold resources beyond their memory.
+    """
+
+    def __init__(self, max_bytes, sizeof, ttl_seconds=None, on_evict=None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._sizeof = sizeof
+        self._on_evict = on_evict
+        self._entries = OrderedDict()  # key -> (value, size, tag, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[3] is not None and entry[3] < time.time():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, tag=None):
+        size = self._sizeof(value)
+        expires_at = time.time() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                if self._on_evict:
+                    self._on_evict(key, value)
+                return False  # Never let one entry flush the whole cache
+            self._entries[key] = (value, size, tag, expires_at)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+            return True
+
+    def invalidate(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def __contains__(self, key):
+        """Presence check that leaves hit/miss counters and LRU order alone (expired entries still count)"""
+        with self._lock:
+            return key in self._entries
+
+    def invalidate_tag(self, tag):
+        """Drop every entry stored with the given tag"""
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if entry[2] == tag]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+            if self._on_evict:
+                self._on_evict(key, entry[0])
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+class CoalescingTTLCache:
+    """Entry-bounded TTL cache that computes each missing key once, however many callers ask at the same time.
+
+    Entries are fresh for ttl_seconds. For stale_seconds after that they are
+    still served while a single background refresh replaces them. Failed
+    fetches are never cached; concurrent callers waiting on them get the error,
+    or TimeoutError if the fetch outlasts their timeout.
+    """
+
+    def __init__(self, max_entries, ttl_seconds, stale_seconds=0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self._entries = OrderedDict()  # key -> (value, fetched_at)
+        self._inflight = {}  # key -> Future shared by everyone waiting on the fetch
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.errors = 0
+        self.evictions = 0
+
+    def get_or_fetch(self, key, fetch, timeout=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, fetched_at = entry
+                age = time.time() - fetched_at
+                if age < self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                if age < self.ttl_seconds + self.stale_seconds:
+                    self.stale_hits += 1
+                    if key not in self._inflight:
+                        self.refreshes += 1
+                        future = self._inflight[key] = Future()
+                        threading.Thread(target=self._refresh, args=(key, fetch, future), daemon=True).start()
+                    return value
+                del self._entries[key]
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result(timeout=timeout)
+        return self._fetch(key, fetch, future)
+
+    def _fetch(self, key, fetch, future):
+        # BaseException too: a cancelled or interrupted fetch must not leave
+        # its key in flight, or every later caller would wait on it forever
+        try:
+            value = fetch()
+            with self._lock:
+                self._entries[key] = (value, time.time())
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        except BaseException as e:
+            with self._lock:
+                self.errors += 1
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        future.set_result(value)
+        return value
+
+    def _refresh(self, key, fetch, future):
+        try:
+            self._fetch(key, fetch, future)
+        except Exception as e:
+            print(f"⚠️ [Cache] Background refresh failed, keeping stale entry: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses + self.coalesced
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "refreshes": self.refreshes,
+                "errors": self.errors,
+                "evictions": self.evictions,
+                "in_flight": len(self._inflight),
+                "hit_ratio": round((self.hits + self.stale_hits + self.coalesced) / lookups, 4) if lookups else 0.0
+            }
+
+def dataframe_nbytes(df):
+    return int(df.memory_usage(deep=True).sum())
+
 # ============================================================================
 # DATA ANALYSIS FUNCTIONS (Converted from Streamlit)
 # ============================================================================
@@ -364,78 +641,193 @@ DATA_ANALYSIS_MODEL = "deepseek-coder-v2:latest"
 MAX_RETRIES = 3
 REQUEST_TIMEOUT = 300
 
-def query_ollama_data_analysis(prompt, model=DATA_ANALYSIS_MODEL, timeout=REQUEST_TIMEOUT, retries=MAX_RETRIES):
-    """Query Ollama API for data analysis with better error handling"""
-    url = f"{OLLAMA_BASE_URL}/api/generate"
-    headers = {"Content-Type": "application/json"}
-    data = {
+# Shared Ollama client pool settings (override via environment)
+OLLAMA_POOL_MAX_CONNECTIONS = int(os.getenv("OLLAMA_POOL_MAX_CONNECTIONS", "200"))
+OLLAMA_POOL_MAX_KEEPALIVE = int(os.getenv("OLLAMA_POOL_MAX_KEEPALIVE", "50"))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY", "60"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "10"))
+OLLAMA_STREAM_TIMEOUT = float(os.getenv("OLLAMA_STREAM_TIMEOUT", "600"))
+
+_ollama_client = None
+
+def get_ollama_client():
+    """Return the process-wide async Ollama client, creating it on first use.
+
+    The client keeps connections alive between requests so streaming endpoints
+    don't pay a TCP handshake per call or hold a threadpool worker while tokens arrive.
+    """
+    global _ollama_client
+    if _ollama_client is None or _ollama_client.is_closed:
+        _ollama_client = httpx.AsyncClient(
+            base_url=OLLAMA_BASE_URL,
+            limits=httpx.Limits(
+                max_connections=OLLAMA_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=OLLAMA_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY
+            ),
+            timeout=ollama_timeout(REQUEST_TIMEOUT)
+        )
+    return _ollama_client
+
+def ollama_timeout(read_timeout):
+    """Per-request timeout: fail fast on connect, allow long gaps between tokens"""
+    return httpx.Timeout(read_timeout, connect=OLLAMA_CONNECT_TIMEOUT)
+
+@app.on_event("shutdown")
+async def close_ollama_client():
+    global _ollama_client
+    if _ollama_client is not None and not _ollama_client.is_closed:
+        await _ollama_client.aclose()
+    _ollama_client = None
+
+async def stream_ollama_generate(payload, timeout=OLLAMA_STREAM_TIMEOUT):
+    """Stream /api/generate and yield each parsed JSON chunk until Ollama reports done"""
+    client = get_ollama_client()
+    async with client.stream("POST", "/api/generate", json=payload, timeout=ollama_timeout(timeout)) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            try:
+                chunk = json.loads(line)
+            except Exception:
+                continue
+            yield chunk
+            if chunk.get("done", False):
+                break
+
+async def is_ollama_available(timeout=5):
+    try:
+        response = await get_ollama_client().get("/api/version", timeout=ollama_timeout(timeout))
+        return response.status_code == 200
+    except Exception:
+        return False
+
+CODE_FENCE_OPEN_RE = re.compile(r'```[ \t]*(?:python|py)?[ \t]*\r?\n', re.IGNORECASE)
+
+class StreamedCodeBlock:
+    """Tracks the first fenced code block in a streamed model reply as tokens arrive.
+
+    A reply with no fence at all is taken as bare code, but only once the
+    stream has ended: until then any amount of prose may still be followed
+    by a fence, so nothing is handed out before one opens.
+    """
+    def __init__(self):
+        self.text = ""
+        self.start = None  # offset where the code begins
+        self.end = None  # offset of the closing fence
+        self.sent = 0  # chars of code already handed out as deltas
+
+    @property
+    def complete(self):
+        return self.end is not None
+
+    @property
+    def code(self):
+        if self.start is None:
+            return self.text.strip()
+        return self.text[self.start:self.end].strip()
+
+    def feed(self, token):
+        """Add a token and return the new code text that is safe to show"""
+        self.text += token
+        if self.start is None:
+            match = CODE_FENCE_OPEN_RE.search(self.text)
+            if not match:
+                return ""
+            self.start = match.end()
+        if self.end is None:
+            close = self.text.find('```', self.start)
+            if close != -1:
+                self.end = close
+        # Hold back trailing backticks, they may be the start of the closing fence
+        limit = self.end if self.end is not None else len(self.text.rstrip('`'))
+        delta = self.text[self.start + self.sent:limit]
+        self.sent += len(delta)
+        return delta
+
+async def stream_analysis_code(prompt, model=DATA_ANALYSIS_MODEL, timeout=REQUEST_TIMEOUT, retries=MAX_RETRIES):
+    """Stream generated analysis code, stopping the model as soon as the code block closes.
+
+    Yields ("delta", text) while code arrives, then ("code", full_code) or ("error", message).
+    """
+    payload = {
         "model": model,
         "prompt": prompt,
-        "stream": False,
+        "stream": True,
         "options": {
             "temperature": 0.1,
             "top_p": 0.9,
             "num_ctx": 4096
         }
     }
-    
+    error = "Error: no response from model"
+
     for attempt in range(retries):
+        block = StreamedCodeBlock()
+        chunks = stream_ollama_generate(payload, timeout)
         try:
-            response = requests.post(
-                url,
-                headers=headers,
-                json=data,
-                timeout=timeout
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if 'response' in result:
-                    return result['response']
-                else:
-                    return "Error: Unexpected response format from Ollama"
-            else:
-                error_msg = f"HTTP {response.status_code}"
-                try:
-                    error_data = response.json()
-                    if 'error' in error_data:
-                        error_msg = error_data['error']
-                except:
-                    error_msg = response.text or error_msg
-                
-                if attempt == retries - 1:  # Last attempt
-                    return f"API Error: {error_msg}"
-                
-        except requests.exceptions.Timeout:
-            if attempt == retries - 1:  # Last attempt
-                return "TIMEOUT_ERROR"
-                
+            async for chunk in chunks:
+                if 'error' in chunk:
+                    raise RuntimeError(chunk['error'])
+                delta = block.feed(chunk.get('response', ''))
+                if delta:
+                    yield ("delta", delta)
+                if block.complete:
+                    break
+            if block.code:
+                yield ("code", block.code)
+                return
+            error = "Error: empty response from model"
+        except httpx.TimeoutException:
+            error = "TIMEOUT_ERROR"
+        except httpx.HTTPStatusError as e:
+            error = f"API Error: HTTP {e.response.status_code}"
         except Exception as e:
-            if attempt == retries - 1:  # Last attempt
-                return f"Connection Error: {str(e)}"
-        
-        # Exponential backoff before retry
+            error = f"Connection Error: {str(e)}"
+        finally:
+            # Closing the stream drops the connection, which makes Ollama stop generating
+            await chunks.aclose()
+
+        # Code already reached the client, so a silent retry would show two different answers
+        if block.sent:
+            break
         if attempt < retries - 1:
-            wait_time = (2 ** attempt) * 2  # 2, 4, 8 seconds
-            time.sleep(wait_time)
-    
-    return "Failed after multiple attempts"
+            await asyncio.sleep(2 ** attempt)
+
+    print(f"⚠️ Code generation failed: {error}")
+    yield ("error", error)
 
-def generate_fallback_code(question, df):
+def generate_fallback_code(question, df, profile=None):
     """
     Intelligent fallback code generator.
     Detects question intent (statistics, correlation, bar chart, histogram, scatter plot, etc.)
     and generates suitable Python code automatically.
+    With the upload's profile, stats, histograms and correlations are read from
+    the precomputed `profile` instead of being recomputed over the data.
     """
     import re
     question_lower = question.lower()
     numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
+    profiled = (profile or {}).get('columns', {})
+    matcher = column_matcher(tuple(df.columns))
+    mentioned_numeric = [col for col in matcher.find(question) if col in numeric_cols]
 
     # --- 1️⃣ Detect if user asks for summary stats ---
     if any(k in question_lower for k in ["average", "mean", "minimum", "maximum", "max", "min", "median", "summary", "describe"]):
-        for col in numeric_cols:
-            if col.lower() in question_lower:
+        if mentioned_numeric:
+            col = mentioned_numeric[0]
+            if profiled.get(col, {}).get('mean') is not None:
                 return f"""
+# Summary stats for {col} (precomputed at upload)
+summary = profile["columns"]["{col}"]
+print("Column: {col}")
+print(f"Average (Mean): {{summary['mean']:.2f}}")
+print(f"Median: {{summary['median']:.2f}}")
+print(f"Minimum: {{summary['min']}}")
+print(f"Maximum: {{summary['max']}}")
+"""
+            return f"""
 # Summary stats for {col}
 avg = df["{col}"].mean()
 min_val = df["{col}"].min()
@@ -448,6 +840,12 @@ print(f"Minimum: {{min_val}}")
 print(f"Maximum: {{max_val}}")
 """
         # If no specific column found
+        if profiled:
+            return """
+print("Summary Statistics for Numeric Columns:")
+summary = pd.DataFrame({col: col_profile for col, col_profile in profile["columns"].items() if col_profile["kind"] == "numeric"})
+print(summary.loc[["non_null", "mean", "std", "min", "p25", "median", "p75", "max"]] if not summary.empty else "No numeric columns")
+"""
         return """
 print("Summary Statistics for Numeric Columns:")
 print(df.describe())
@@ -455,7 +853,21 @@ print(df.describe())
 
     # --- 2️⃣ Detect histogram/distribution questions ---
     if any(k in question_lower for k in ["distribution", "histogram", "frequency", "spread"]):
-        target_col = next((col for col in numeric_cols if col.lower() in question_lower), numeric_cols[0])
+        target_col = next(iter(mentioned_numeric), numeric_cols[0])
+        if profiled.get(target_col, {}).get('histogram'):
+            return f"""
+# Histogram for {target_col} (bins precomputed at upload)
+import matplotlib.pyplot as plt
+hist = profile["columns"]["{target_col}"]["histogram"]
+edges = np.array(hist["edges"])
+plt.figure(figsize=(8,5))
+plt.bar(edges[:-1], hist["counts"], width=np.diff(edges), align='edge', color='skyblue', edgecolor='black')
+plt.title("Distribution of {target_col}")
+plt.xlabel("{target_col}")
+plt.ylabel("Frequency")
+plt.tight_layout()
+plt.show()
+"""
         return f"""
 # Histogram for {target_col}
 import matplotlib.pyplot as plt
@@ -470,6 +882,19 @@ plt.show()
 
     # --- 3️⃣ Detect correlation or "relationship" type questions ---
     if any(k in question_lower for k in ["correlation", "relationship", "compare", "association"]):
+        if ("heatmap" in question_lower or "matrix" in question_lower) and (profile or {}).get('correlation'):
+            return """
+# Correlation heatmap (matrix precomputed at upload)
+import matplotlib.pyplot as plt
+import seaborn as sns
+corr = pd.DataFrame(profile["correlation"]["matrix"], index=profile["correlation"]["columns"], columns=profile["correlation"]["columns"])
+plt.figure(figsize=(10,8))
+sns.heatmap(corr, annot=True, cmap='coolwarm', fmt='.2f')
+plt.title('Correlation Heatmap')
+plt.tight_layout()
+plt.show()
+print(corr)
+"""
         if "heatmap" in question_lower or "matrix" in question_lower:
             return """
 # Correlation heatmap
@@ -485,10 +910,8 @@ print(numeric_df.corr())
 """
         # Otherwise, scatter plot for "A vs B"
         matches = re.findall(r"([a-z_]+)\s*(?:vs|against|and)\s*([a-z_]+)", question_lower)
-        if matches:
-            col1, col2 = matches[0]
-            col1 = next((c for c in df.columns if col1 in c.lower()), numeric_cols[0])
-            col2 = next((c for c in df.columns if col2 in c.lower()), numeric_cols[1])
+        if len(mentioned_numeric) >= 2 or matches:
+            col1, col2 = mentioned_numeric[:2] if len(mentioned_numeric) >= 2 else (numeric_cols[0], numeric_cols[1])
             return f"""
 # Scatter plot between {col1} and {col2}
 import matplotlib.pyplot as plt
@@ -503,12 +926,10 @@ plt.show()
 
     # --- 4️⃣ Detect "by" or grouped average (bar chart) ---
     if "by" in question_lower or "group" in question_lower or "range" in question_lower:
-        target_col = next((col for col in numeric_cols if col.lower() in question_lower and "by" not in col.lower()), "median_income")
-        group_col = None
-        for col in df.columns:
-            if col.lower() in question_lower.split("by")[-1]:
-                group_col = col
-                break
+        by_index = question_lower.rfind(" by ")
+        before_by, after_by = (question[:by_index], question[by_index + 4:]) if by_index != -1 else (question, "")
+        target_col = next((col for col in matcher.find(before_by) if col in numeric_cols), numeric_cols[0])
+        group_col = next(iter(matcher.find(after_by)), None)
         if not group_col:
             group_col = numeric_cols[1] if len(numeric_cols) > 1 else df.columns[0]
 
@@ -532,7 +953,24 @@ print(avg_data)
 
     # --- 5️⃣ Detect trend / time-based questions ---
     if any(k in question_lower for k in ["trend", "over time", "year", "month", "timeline", "progression"]):
-        target_col = next((col for col in numeric_cols if col.lower() in question_lower), numeric_cols[0])
+        target_col = next(iter(mentioned_numeric), numeric_cols[0])
+        datetime_cols = (profile or {}).get('datetime_columns') or []
+        if datetime_cols:
+            time_col = next((col for col in datetime_cols if col.lower() in question_lower), datetime_cols[0])
+            return f"""
+# Line chart showing trend of {target_col} over {time_col}
+import matplotlib.pyplot as plt
+series = df[["{time_col}", "{target_col}"]].copy()
+series["{time_col}"] = pd.to_datetime(series["{time_col}"], errors='coerce', format='mixed')
+series = series.dropna().sort_values("{time_col}")
+plt.figure(figsize=(8,5))
+plt.plot(series["{time_col}"], series["{target_col}"], color='orange')
+plt.title("Trend of {target_col} over {time_col}")
+plt.xlabel("{time_col}")
+plt.ylabel("{target_col}")
+plt.tight_layout()
+plt.show()
+"""
         return f"""
 # Line chart showing trend of {target_col} over index
 import matplotlib.pyplot as plt
@@ -546,6 +984,18 @@ plt.show()
 """
 
     # --- Default generic analysis ---
+    if profiled:
+        return """
+print("Dataset Shape:", (profile["rows"], profile["column_count"]))
+overview = pd.DataFrame(profile["columns"]).T
+print("\\nColumn Info:")
+print(overview[["dtype", "kind", "unique"]])
+print("\\nBasic Statistics:")
+numeric = pd.DataFrame({col: stats for col, stats in profile["columns"].items() if stats["kind"] == "numeric"})
+print(numeric.loc[["non_null", "mean", "std", "min", "p25", "median", "p75", "max"]] if not numeric.empty else "No numeric columns")
+print("\\nMissing Values:")
+print(overview["nulls"])
+"""
     return """
 print("Dataset Shape:", df.shape)
 print("\\nColumn Info:")
@@ -557,219 +1007,2068 @@ print(df.isnull().sum())
 """
 
 
-def execute_data_analysis_code(code, df, table_name=None, globals_dict=None):
-    """Safely execute Python code with dataframe context and SQL support"""
-    if globals_dict is None:
-        globals_dict = {}
-    
-    # Create SQLite engine if table_name is provided
-    engine = None
-    if table_name:
-        engine = create_engine(f'sqlite:///databases/analysis.db')
-    
-    # Prepare execution environment with the actual dataframe
-    exec_globals = {
-        'df': df,
-        'pd': pd,
-        'np': np,
-        'plt': plt,
-        'sns': sns,
-        'px': px,
-        'go': go,
-        'stats': stats,
-        'LinearRegression': LinearRegression,
-        'train_test_split': train_test_split,
-        'r2_score': r2_score,
-        'mean_squared_error': mean_squared_error,
-        'execute_sql': lambda query: execute_sql_query(query, engine) if engine else None,
-        'table_name': table_name,
-        **globals_dict
-    }
-    
-    # Clean the code - remove any file loading attempts
-    cleaned_code = code.replace("pd.read_csv('path_to_your_dataset.csv')", "df")
-    cleaned_code = cleaned_code.replace("pd.read_csv(", "# pd.read_csv(")
-    cleaned_code = cleaned_code.replace("df = pd.read_csv", "# df = pd.read_csv")
-    
-    # Capture output
-    output = io.StringIO()
-    chart_data = None
-    
-    try:
-        with redirect_stdout(output):
-            exec(cleaned_code, exec_globals)
-        
-        # Get printed output
-        printed_output = output.getvalue()
-        
-        # Check if a plot was created and save it as base64
-        if plt.get_fignums():
-            # Get the current figure
-            fig = plt.gcf()
-            
-            # Save plot to base64 string
-            buffer = io.BytesIO()
-            fig.savefig(buffer, format='png', dpi=300, bbox_inches='tight')
-            buffer.seek(0)
-            plot_data = buffer.getvalue()
-            buffer.close()
-            
-            # Convert to base64
-            chart_data = base64.b64encode(plot_data).decode('utf-8')
-            
-            # Clear the figure
-            plt.clf()
-            plt.close('all')
-        
-        return {
-            'success': True,
-            'output': printed_output,
-            'chart': chart_data,
-            'globals': exec_globals
+# ============================================================================
+# FAST-PATH ANSWERS
+# ============================================================================
+
+FAST_PATH_MIN_CONFIDENCE = float(os.getenv("FAST_PATH_MIN_CONFIDENCE", "0.8"))
+FAST_PATH_MAX_GROUPS = 50
+
+def normalize_label(text):
+    return re.sub(r'[\s_\-]+', ' ', str(text)).strip().lower()
+
+class ColumnMatcher:
+    """Finds the dataset columns mentioned in a question with one precompiled regex.
+
+    Names match on word boundaries (so "average" does not hit an "age" column),
+    longest name first, and spaces, underscores and dashes are interchangeable.
+    """
+
+    def __init__(self, columns):
+        self._by_label = {}
+        for col in columns:
+            self._by_label.setdefault(normalize_label(col), col)
+        labels = sorted((label for label in self._by_label if label), key=len, reverse=True)
+        alternatives = '|'.join(re.escape(label).replace(r'\ ', r'[\s_\-]+') for label in labels)
+        self._regex = re.compile(rf'(?<![a-z0-9])(?:{alternatives})(?![a-z0-9])') if labels else None
+
+    def strip(self, text):
+        """Lowercased text with every column mention blanked out"""
+        text = text.lower()
+        return self._regex.sub(' ', text) if self._regex is not None else text
+
+    def find(self, text):
+        """Mentioned columns in order of first appearance"""
+        if self._regex is None:
+            return []
+        found = []
+        for match in self._regex.finditer(text.lower()):
+            col = self._by_label[normalize_label(match.group(0))]
+            if col not in found:
+                found.append(col)
+        return found
+
+@functools.lru_cache(maxsize=64)
+def column_matcher(columns):
+    """Matcher for a column tuple, built once per schema"""
+    return ColumnMatcher(columns)
+
+STAT_PATTERNS = {
+    'mean': re.compile(r'\b(mean|average|avg)\b'),
+    'median': re.compile(r'\bmedian\b'),
+    'min': re.compile(r'\b(min|minimum|lowest|smallest)\b'),
+    'max': re.compile(r'\b(max|maximum|highest|largest|biggest)\b'),
+    'std': re.compile(r'\b(std|stdev|standard deviation)\b'),
+    'sum': re.compile(r'\b(sum|total)\b'),
+    'nulls': re.compile(r'\b(missing|nulls?|nan)\b'),
+    'unique': re.compile(r'\b(unique|distinct)\b'),
+}
+STAT_LABELS = {
+    'mean': "Average (Mean)", 'median': "Median", 'min': "Minimum", 'max': "Maximum",
+    'std': "Standard Deviation", 'sum': "Sum", 'nulls': "Missing Values", 'unique': "Unique Values"
+}
+ROW_COUNT_RE = re.compile(r'\bhow many (rows|records|entries|observations)\b|\b(number|count) of (rows|records|entries)\b')
+SUMMARY_RE = re.compile(r'\b(summary|summarize|summarise|describe|overview)\b')
+DISTRIBUTION_RE = re.compile(r'\b(distribution|histogram|spread)\b')
+CORRELATION_RE = re.compile(r'\b(correlation|correlated|corr)\b')
+TOP_VALUES_RE = re.compile(r'\b(most common|most frequent|top \d+|top values|value counts)\b')
+GROUP_BY_RE = re.compile(r'\b(?:per|by|for each)\b')
+# Conditions, modelling and time series need real code; never answer them from the fast path
+COMPLEX_RE = re.compile(r'\b(where|filter|if|when|only|excluding|except|predict|forecast|regression|model|trend|over time|why|ratio|percent|percentage|growth|change|rolling|cumulative|plot|chart|graph|vs|versus|against)\b')
+
+# Words that carry no condition; anything else left after removing columns and intent words
+# (a category value like "married", a year, "clients", ...) may narrow the question to a subset
+FAST_PATH_FILLER = frozenset("""
+what whats is are was were the a an of for in on to me show tell give find get compute calculate list
+display print please can could you i want need know would like column columns field fields value values
+dataset data table this our my all and how much overall there do does s it its between
+""".split())
+WORD_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# "what's", "they're", ...; n't is kept, since a negation is a condition
+CONTRACTION_RE = re.compile(r"['’](?:s|re|ve|d|ll|m)\b", re.IGNORECASE)
+
+def leftover_tokens(question, df):
+    """Words of the question that are neither columns, intent keywords nor filler"""
+    text = column_matcher(tuple(df.columns)).strip(CONTRACTION_RE.sub('', question))
+    for pattern in (*STAT_PATTERNS.values(), ROW_COUNT_RE, SUMMARY_RE, DISTRIBUTION_RE, CORRELATION_RE, TOP_VALUES_RE, GROUP_BY_RE):
+        text = pattern.sub(' ', text)
+    return [token for token in WORD_TOKEN_RE.findall(text) if token not in FAST_PATH_FILLER]
+
+def route_question(question, df, profile):
+    """Classify a question into a fast-path intent with a confidence score.
+
+    Returns a dict with intent, columns, stats and confidence; confidence is
+    low for anything the deterministic answers do not fully cover.
+    """
+    text = question.lower()
+    columns = column_matcher(tuple(df.columns)).find(question)
+    profiled = profile['columns']
+    numeric = [col for col in columns if profiled.get(col, {}).get('kind') == 'numeric']
+    stats = [name for name, pattern in STAT_PATTERNS.items() if pattern.search(text)]
+    penalty = 0.4 * len(COMPLEX_RE.findall(text))
+    leftover = leftover_tokens(question, df)
+    if leftover:
+        penalty += 0.4  # Possibly a filter the deterministic answers would ignore
+    route = {'intent': None, 'columns': columns, 'stats': stats, 'leftover': leftover, 'confidence': 0.0}
+
+    def scored(intent, confidence, **extra):
+        return {**route, 'intent': intent, 'confidence': round(max(confidence - penalty, 0.0), 2), **extra}
+
+    if ROW_COUNT_RE.search(text) and not columns:
+        return scored('row_count', 0.95)
+
+    group_match = GROUP_BY_RE.search(text)
+    if stats and group_match and len(stats) == 1 and stats[0] in ('mean', 'median', 'min', 'max', 'sum', 'std'):
+        targets = [col for col in column_matcher(tuple(df.columns)).find(question[:group_match.start()]) if col in numeric]
+        groups = column_matcher(tuple(df.columns)).find(question[group_match.end():])
+        if len(targets) == 1 and len(groups) == 1 and profiled.get(groups[0], {}).get('unique', FAST_PATH_MAX_GROUPS + 1) <= FAST_PATH_MAX_GROUPS:
+            return scored('group_by', 0.9, target=targets[0], group=groups[0])
+        return scored('group_by', 0.3)
+
+    if CORRELATION_RE.search(text):
+        if len(numeric) == 2 and len(columns) == 2:
+            return scored('correlation_pair', 0.95)
+        if not columns:
+            return scored('correlation_matrix', 0.85)
+        return scored('correlation_pair', 0.3)
+
+    if DISTRIBUTION_RE.search(text) and len(columns) == 1:
+        return scored('distribution', 0.9)
+
+    if TOP_VALUES_RE.search(text) and len(columns) == 1 and profiled.get(columns[0], {}).get('top_values'):
+        return scored('top_values', 0.9)
+
+    if stats and columns and len(columns) <= 3:
+        numeric_stats = [stat for stat in stats if stat not in ('nulls', 'unique')]
+        if numeric_stats and len(numeric) != len(columns):
+            return scored('column_stats', 0.3)  # e.g. the mean of a text column
+        return scored('column_stats', 0.95 if len(columns) == 1 else 0.85)
+
+    if SUMMARY_RE.search(text) and not stats:
+        return scored('summary', 0.9 if len(columns) <= 3 else 0.5)
+
+    return route
+
+def format_stat(value):
+    if isinstance(value, float):
+        return f"{value:,.4f}".rstrip('0').rstrip('.')
+    return f"{value:,}" if isinstance(value, int) else str(value)
+
+def fast_path_columns(route, profile):
+    """The columns fast_path_answer reads from the frame for a route; everything else comes from the profile"""
+    intent = route['intent']
+    if intent == 'column_stats' and 'sum' in route['stats']:
+        return route['columns']
+    if intent == 'correlation_pair':
+        names = (profile.get('correlation') or {}).get('columns', [])
+        return [] if all(col in names for col in route['columns']) else route['columns']
+    if intent == 'group_by':
+        return list(dict.fromkeys([route['target'], route['group']]))
+    return []
+
+def fast_path_projection(csv_record, question, profile):
+    """(route, frame) for a question that takes the fast path, reading only the columns it needs from the Arrow file.
+
+    Routing only looks at column names, so it runs on the Arrow schema
+    without reading any data. Returns None if the question needs code.
+    """
+    if not profile or not csv_record.columnar_path or not os.path.exists(csv_record.columnar_path):
+        return None
+    names = pd.DataFrame(columns=read_columnar_schema(csv_record.columnar_path)['columns'])
+    route = route_question(question, names, profile)
+    if route['intent'] is None or route['confidence'] < FAST_PATH_MIN_CONFIDENCE:
+        return None
+    columns = fast_path_columns(route, profile)
+    return route, read_columnar_file(csv_record.columnar_path, columns=columns) if columns else names
+
+def fast_path_answer(question, df, profile, route=None):
+    """Answer a high-confidence question directly from the profile or vectorized pandas.
+
+    Returns {'intent', 'confidence', 'output', 'chart_spec'} or None when the
+    question should go through code generation instead. With a route from
+    fast_path_projection, df only needs the columns that route reads.
+    """
+    if not profile:
+        return None
+    route = route or route_question(question, df, profile)
+    if route['intent'] is None or route['confidence'] < FAST_PATH_MIN_CONFIDENCE:
+        return None
+    profiled = profile['columns']
+    intent = route['intent']
+    lines = []
+    chart_spec = None
+
+    if intent == 'row_count':
+        lines.append(f"The dataset has {profile['rows']:,} rows and {profile['column_count']} columns.")
+
+    elif intent == 'column_stats':
+        for col in route['columns']:
+            stats = profiled[col]
+            lines.append(f"Column: {col}")
+            for stat in route['stats']:
+                if stat == 'sum':
+                    value = json_number(df[col].sum())
+                else:
+                    value = stats.get(stat)
+                lines.append(f"{STAT_LABELS[stat]}: {format_stat(value)}")
+            lines.append("")
+
+    elif intent == 'summary':
+        columns = route['columns'] or list(profiled)
+        table = pd.DataFrame({col: profiled[col] for col in columns}).T
+        keep = [key for key in ('dtype', 'kind', 'non_null', 'nulls', 'unique', 'mean', 'std', 'min', 'median', 'max') if key in table.columns]
+        lines.append(f"Dataset: {profile['rows']:,} rows, {profile['column_count']} columns")
+        lines.append(table[keep].to_string())
+
+    elif intent == 'distribution':
+        col = route['columns'][0]
+        stats = profiled[col]
+        if stats.get('histogram'):
+            hist = stats['histogram']
+            edges = np.array(hist['edges'], dtype=float)
+            lines.append(f"Distribution of {col}: min {format_stat(stats['min'])}, 25% {format_stat(stats['p25'])}, "
+                         f"median {format_stat(stats['median'])}, 75% {format_stat(stats['p75'])}, max {format_stat(stats['max'])}")
+            chart_spec = {
+                'data': [{'type': 'bar', 'x': ((edges[:-1] + edges[1:]) / 2).tolist(), 'y': hist['counts'],
+                          'width': np.diff(edges).tolist(), 'name': col}],
+                'layout': {'title': {'text': f"Distribution of {col}"}, 'xaxis': {'title': {'text': col}},
+                           'yaxis': {'title': {'text': "Frequency"}}, 'bargap': 0}
+            }
+        elif stats.get('top_values'):
+            intent = 'top_values'
+        else:
+            return None
+
+    if intent == 'top_values':
+        col = route['columns'][0]
+        top = profiled[col]['top_values']
+        lines.append(f"Most common values of {col} ({profiled[col]['unique']:,} distinct):")
+        lines.extend(f"  {value}: {count:,}" for value, count in top)
+        chart_spec = {
+            'data': [{'type': 'bar', 'x': [value for value, _ in top], 'y': [count for _, count in top], 'name': col}],
+            'layout': {'title': {'text': f"Most common values of {col}"}, 'yaxis': {'title': {'text': "Count"}}}
         }
-    
-    except Exception as e:
-        plt.close('all')  # Clean up any plots
-        return {
-            'success': False,
-            'error': str(e),
-            'traceback': traceback.format_exc()
+
+    elif intent == 'correlation_pair':
+        col1, col2 = route['columns']
+        correlation = profile.get('correlation') or {}
+        names = correlation.get('columns', [])
+        if col1 in names and col2 in names:
+            r = correlation['matrix'][names.index(col1)][names.index(col2)]
+        else:
+            r = json_number(df[col1].astype(float).corr(df[col2].astype(float)))
+        if r is None:
+            return None
+        strength = "strong" if abs(r) >= 0.7 else "moderate" if abs(r) >= 0.4 else "weak"
+        lines.append(f"Correlation between {col1} and {col2}: {r:+.4f} ({strength} {'positive' if r >= 0 else 'negative'})")
+
+    elif intent == 'correlation_matrix':
+        correlation = profile.get('correlation')
+        if not correlation:
+            return None
+        matrix = pd.DataFrame(correlation['matrix'], index=correlation['columns'], columns=correlation['columns'])
+        lines.append("Correlation matrix:")
+        lines.append(matrix.round(2).to_string())
+        chart_spec = {
+            'data': [{'type': 'heatmap', 'z': correlation['matrix'], 'x': correlation['columns'], 'y': correlation['columns'],
+                      'zmin': -1, 'zmax': 1, 'colorscale': 'RdBu', 'reversescale': True}],
+            'layout': {'title': {'text': "Correlation Heatmap"}}
         }
 
-def save_to_sql_database(df, table_name, db_path="databases/analysis.db"):
-    """Save DataFrame to SQLite database"""
-    os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    
-    # Create SQLite connection
-    engine = create_engine(f'sqlite:///{db_path}')
-    
-    # Save DataFrame to SQL
-    df.to_sql(table_name, engine, if_exists='replace', index=False)
-    return engine
+    elif intent == 'group_by':
+        stat, target, group = route['stats'][0], route['target'], route['group']
+        result = df.groupby(group, observed=True, sort=True)[target].agg(stat)
+        lines.append(f"{STAT_LABELS[stat]} of {target} by {group}:")
+        lines.append(result.to_string())
+        chart_spec = {
+            'data': [{'type': 'bar', 'x': [str(key) for key in result.index], 'y': [json_number(v) for v in result.to_numpy()], 'name': target}],
+            'layout': {'title': {'text': f"{STAT_LABELS[stat]} of {target} by {group}"},
+                       'xaxis': {'title': {'text': group}}, 'yaxis': {'title': {'text': target}}}
+        }
 
-def execute_sql_query(query, engine):
-    """Execute SQL query, print results, and return DataFrame"""
+    return {
+        'intent': intent,
+        'confidence': route['confidence'],
+        'output': "\n".join(lines).rstrip() + "\n",
+        'chart_spec': chart_spec
+    }
+
+# ============================================================================
+# CODE GENERATION CACHE
+# ============================================================================
+
+CODEGEN_CACHE_MAX_AGE_DAYS = float(os.getenv("CODEGEN_CACHE_MAX_AGE_DAYS", "30"))
+CODEGEN_CACHE_MAX_BYTES = int(os.getenv("CODEGEN_CACHE_MAX_MB", "32")) * 1024 * 1024
+
+def normalize_prompt(prompt):
+    """Case, whitespace and trailing punctuation do not change what code the model should write"""
+    return re.sub(r'\s+', ' ', prompt).strip().lower().rstrip('?.! ')
+
+def schema_signature(df):
+    """Hash of the column names, order and dtypes, which is all generated code depends on"""
+    schema = [[str(col), str(dtype)] for col, dtype in df.dtypes.items()]
+    return hashlib.sha256(json.dumps(schema).encode()).hexdigest()
+
+def codegen_cache_key(model, prompt, signature):
+    return hashlib.sha256(json.dumps([model, normalize_prompt(prompt), signature]).encode()).hexdigest()
+
+def lookup_generated_code(cache_key):
+    """Cached code for the key, or None when missing or older than the max age"""
+    db = SessionLocal()
     try:
-        df = pd.read_sql_query(query, engine)
-        # Print a readable summary of the results
-        print("SQL Query Results:")
-        print(df.head(20).to_string(index=False))
-        return df
-    except Exception as e:
-        print(f"SQL Query Error: {str(e)}")
-        raise Exception(f"SQL Query Error: {str(e)}")
-    
-def get_database_engine():
-    db_path = "databases/analysis.db"
-    return create_engine(f"sqlite:///{db_path}")
+        entry = db.query(GeneratedCodeCache).filter(GeneratedCodeCache.cache_key == cache_key).first()
+        if entry is None:
+            return None
+        max_age = datetime.timedelta(days=CODEGEN_CACHE_MAX_AGE_DAYS)
+        if entry.created_at < datetime.datetime.utcnow() - max_age:
+            db.delete(entry)
+            db.commit()
+            return None
+        entry.hits = (entry.hits or 0) + 1
+        entry.last_used_at = datetime.datetime.utcnow()
+        db.commit()
+        return entry.code
+    finally:
+        db.close()
+
+def store_generated_code(cache_key, model, prompt, signature, code):
+    db = SessionLocal()
+    try:
+        entry = db.query(GeneratedCodeCache).filter(GeneratedCodeCache.cache_key == cache_key).first()
+        if entry is None:
+            entry = GeneratedCodeCache(cache_key=cache_key)
+            db.add(entry)
+        entry.model = model
+        entry.prompt = normalize_prompt(prompt)
+        entry.schema_signature = signature
+        entry.code = code
+        entry.size_bytes = len(code.encode('utf-8'))
+        entry.created_at = entry.last_used_at = datetime.datetime.utcnow()
+        db.commit()
+        prune_generated_code(db)
+    finally:
+        db.close()
+
+def forget_generated_code(cache_key):
+    db = SessionLocal()
+    try:
+        db.query(GeneratedCodeCache).filter(GeneratedCodeCache.cache_key == cache_key).delete()
+        db.commit()
+    finally:
+        db.close()
+
+def prune_generated_code(db):
+    """Drop entries past the max age, then least recently used ones until under the size budget"""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=CODEGEN_CACHE_MAX_AGE_DAYS)
+    expired = db.query(GeneratedCodeCache).filter(GeneratedCodeCache.created_at < cutoff).delete()
+    total = db.query(func.coalesce(func.sum(GeneratedCodeCache.size_bytes), 0)).scalar()
+    evicted = 0
+    if total > CODEGEN_CACHE_MAX_BYTES:
+        for entry in db.query(GeneratedCodeCache).order_by(GeneratedCodeCache.last_used_at):
+            if total <= CODEGEN_CACHE_MAX_BYTES:
+                break
+            total -= entry.size_bytes
+            db.delete(entry)
+            evicted += 1
+    db.commit()
+    if expired or evicted:
+        print(f"🧹 [Codegen Cache] Removed {expired} expired and {evicted} least recently used entries")
+
+# ============================================================================
+# ANALYSIS RESULT CACHE
+# ============================================================================
+
+ANALYSIS_RESULT_CACHE_MAX_BYTES = int(os.getenv("ANALYSIS_RESULT_CACHE_MAX_MB", "64")) * 1024 * 1024
+
+def analysis_result_nbytes(result):
+    # Charts live on disk under /charts; only their metadata is held here
+    return len(result.get('output') or '') + len(result.get('chart_spec') or '') + 512
+
+def analysis_result_key(code, csv_record, chart_options):
+    """Same code, same upload, same table contents and same chart settings give the same result"""
+    options = {k: v for k, v in chart_options.items() if k != 'chart_dir'}
+    version = table_version(csv_record.table_name) if csv_record.table_name else 0
+    payload = json.dumps([code, csv_record.id, version, options], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+# Successful run results (stdout, chart metadata, Plotly spec) keyed by analysis_result_key
+analysis_result_cache = BoundedLRUCache(ANALYSIS_RESULT_CACHE_MAX_BYTES, sizeof=analysis_result_nbytes)
+
+# ============================================================================
+# ANALYSIS WORKER POOL
+# ============================================================================
+
+import analysis_worker
+
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", str(min(4, os.cpu_count() or 1))))
+ANALYSIS_JOB_TIMEOUT = float(os.getenv("ANALYSIS_JOB_TIMEOUT", "120"))
+ANALYSIS_WORKER_MEMORY_MB = int(os.getenv("ANALYSIS_WORKER_MEMORY_MB", "4096"))
+ANALYSIS_WORKER_MAX_JOBS = int(os.getenv("ANALYSIS_WORKER_MAX_JOBS", "50"))
+ANALYSIS_WORKER_START_TIMEOUT = 120  # Seconds a fresh worker may take to import its libraries
+
+class AnalysisWorkerPool:
+    """Pre-started worker processes that execute generated analysis code.
+
+    Each job gets a wall-clock timeout; a worker that overruns it, dies, or has
+    served max_jobs jobs is replaced by a fresh process. Jobs from concurrent
+    requests run in parallel on different workers and queue when all are busy.
+    """
+
+    def __init__(self, size, max_jobs, timeout, memory_limit_mb):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self._idle = None
+        self._closed = False
+        self._workers = []
+        self._lock = threading.RLock()
+        self._stats = {"jobs": 0, "failures": 0, "timeouts": 0, "crashes": 0, "recycled": 0,
+                       "cpu_seconds": 0.0, "wall_seconds": 0.0}
+
+    def _context(self):
+        # forkserver forks workers from a clean process that has already imported the worker module
+        if (sys.platform != 'win32' and not getattr(sys, 'frozen', False)
+                and 'forkserver' in multiprocessing.get_all_start_methods()):
+            ctx = multiprocessing.get_context('forkserver')
+            ctx.set_forkserver_preload(['analysis_worker'])
+            return ctx
+        return multiprocessing.get_context('spawn')
+
+    def start(self):
+        with self._lock:
+            if self._idle is not None and not self._closed:
+                return
+            import queue
+            self._ctx = self._context()
+            self._idle = queue.Queue()
+            self._closed = False
+            for _ in range(self.size):
+                self._idle.put(self._spawn())
+        print(f"⚙️  [Workers] Started {self.size} analysis workers")
+
+    def _spawn(self):
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=analysis_worker.worker_main,
+            args=(child_conn, self.memory_limit_mb),
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        worker = {"process": process, "conn": parent_conn, "jobs": 0, "ready": False}
+        with self._lock:
+            self._workers.append(worker)
+        return worker
+
+    def _retire(self, worker, kill=False):
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+        try:
+            if kill:
+                worker["process"].kill()
+            else:
+                worker["conn"].send(None)
+        except Exception:
+            pass
+        worker["process"].join(timeout=5)
+        worker["conn"].close()
+
+    def _record(self, key, result=None):
+        with self._lock:
+            self._stats["jobs"] += 1
+            if key:
+                self._stats[key] += 1
+            if result:
+                self._stats["cpu_seconds"] += result.get("cpu_seconds", 0.0)
+                self._stats["wall_seconds"] += result.get("wall_seconds", 0.0)
+
+    def _release(self, idle, worker, replace=False):
+        """Return a worker (or a fresh one replacing it) to the queue it came from.
+
+        Workers of a pool that was shut down meanwhile are retired instead.
+        """
+        if replace:
+            worker = self._spawn()
+        with self._lock:
+            if idle is self._idle and not self._closed:
+                idle.put(worker)
+                return
+        self._retire(worker)
+
+    def run(self, job, timeout=None):
+        """Run one job on the next free worker and return its result dict"""
+        if self._idle is None:
+            self.start()
+        with self._lock:
+            idle = self._idle
+            closed = self._closed
+        if not closed:
+            worker = idle.get()
+        if closed or worker is None:
+            if not closed:
+                idle.put(None)  # Pass the shutdown signal on to the next waiting request
+            return {'success': False, 'error': "Analysis workers are shutting down", 'traceback': ''}
+        timeout = timeout or self.timeout
+        replace = False
+        try:
+            if not worker["ready"]:
+                if not worker["conn"].poll(ANALYSIS_WORKER_START_TIMEOUT):
+                    raise EOFError("worker did not start")
+                worker["conn"].recv()
+                worker["ready"] = True
+            worker["conn"].send(job)
+            if not worker["conn"].poll(timeout):
+                replace = True
+                self._retire(worker, kill=True)
+                self._record("timeouts")
+                return {'success': False, 'error': f"Analysis timed out after {int(timeout)} seconds", 'traceback': ''}
+            result = worker["conn"].recv()
+        except (EOFError, OSError):
+            # The worker died, most likely by hitting its memory limit
+            replace = True
+            self._retire(worker, kill=True)
+            self._record("crashes")
+            return {'success': False, 'error': f"Analysis worker crashed (exit code {worker['process'].exitcode})", 'traceback': ''}
+        finally:
+            if replace:
+                self._release(idle, None, replace=True)
+        
+        worker["jobs"] += 1
+        self._record(None if result.get('success') else "failures", result)
+        if worker["jobs"] >= self.max_jobs:
+            self._retire(worker)
+            with self._lock:
+                self._stats["recycled"] += 1
+            self._release(idle, None, replace=True)
+        else:
+            self._release(idle, worker)
+        return result
+
+    def shutdown(self):
+        """Retire idle workers now; busy ones are retired as their jobs finish"""
+        import queue
+        with self._lock:
+            self._closed = True
+            idle = self._idle
+        if idle is None:
+            return
+        while True:
+            try:
+                worker = idle.get_nowait()
+            except queue.Empty:
+                break
+            if worker is not None:
+                self._retire(worker)
+        idle.put(None)  # Wakes requests still waiting for a worker
+
+    def pids(self):
+        with self._lock:
+            return {worker["process"].pid for worker in self._workers}
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                "workers": len(self._workers),
+                "busy": len(self._workers) - (self._idle.qsize() if self._idle is not None and not self._closed else 0),
+                "started": self._idle is not None and not self._closed
+            }
+
+analysis_pool = AnalysisWorkerPool(ANALYSIS_WORKERS, ANALYSIS_WORKER_MAX_JOBS, ANALYSIS_JOB_TIMEOUT, ANALYSIS_WORKER_MEMORY_MB)
+
+@app.on_event("startup")
+async def start_analysis_pool():
+    if ANALYSIS_WORKERS > 0:
+        await run_in_threadpool(analysis_pool.start)
+
+@app.on_event("shutdown")
+def stop_analysis_pool():
+    analysis_pool.shutdown()
+
+# execute_sql result caches live in the workers; each job result carries their counters since the last job
+worker_sql_cache_counts = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+_worker_sql_cache_sizes = {}  # worker pid -> (entries, bytes) at its last report
+_worker_sql_cache_lock = threading.Lock()
+
+def record_worker_sql_cache(report):
+    if not report:
+        return
+    with _worker_sql_cache_lock:
+        for name in worker_sql_cache_counts:
+            worker_sql_cache_counts[name] += report.get(name, 0)
+        _worker_sql_cache_sizes[report['pid']] = (report['entries'], report['bytes'])
+
+def worker_sql_cache_stats():
+    # Sizes reported by workers that have since been retired no longer count
+    live = analysis_pool.pids() | {os.getpid()}
+    with _worker_sql_cache_lock:
+        for pid in [pid for pid in _worker_sql_cache_sizes if pid not in live]:
+            del _worker_sql_cache_sizes[pid]
+        lookups = worker_sql_cache_counts["hits"] + worker_sql_cache_counts["misses"]
+        return {
+            **worker_sql_cache_counts,
+            "workers": len(_worker_sql_cache_sizes),
+            "entries": sum(entries for entries, _ in _worker_sql_cache_sizes.values()),
+            "bytes": sum(nbytes for _, nbytes in _worker_sql_cache_sizes.values()),
+            "max_bytes_per_worker": analysis_worker.SQL_CACHE_MAX_BYTES,
+            "hit_ratio": round(worker_sql_cache_counts["hits"] / lookups, 4) if lookups else 0.0
+        }
+
+# ============================================================================
+# CHART RENDERING
+# ============================================================================
+
+CHART_FORMATS = tuple(analysis_worker.CHART_MEDIA_TYPES)
+CHART_FORMAT = os.getenv("CHART_FORMAT", "png").lower()
+CHART_DPI = int(os.getenv("CHART_DPI", "110"))
+CHART_MAX_DPI = 300
+CHART_MAX_WIDTH_IN = float(os.getenv("CHART_MAX_WIDTH_IN", "10"))
+CHART_MAX_HEIGHT_IN = float(os.getenv("CHART_MAX_HEIGHT_IN", "7"))
+CHART_CACHE_MAX_BYTES = int(os.getenv("CHART_CACHE_MAX_MB", "256")) * 1024 * 1024
+# Series above this many points are downsampled (LTTB for lines, density bins for scatters)
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "2000"))
+CHART_DENSITY_GRID = int(os.getenv("CHART_DENSITY_GRID", "100"))
+CHART_NAME_RE = re.compile(r'^[0-9a-f]{32}\.(png|webp|svg)$')
+
+def chart_render_options(chart_format=None, chart_dpi=None):
+    """Rendering options sent with each analysis job; the worker does the encoding"""
+    chart_format = (chart_format or CHART_FORMAT).lower()
+    if chart_format not in CHART_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported chart format '{chart_format}'. Use one of: {', '.join(CHART_FORMATS)}")
+    return {
+        'format': chart_format,
+        'dpi': max(50, min(chart_dpi or CHART_DPI, CHART_MAX_DPI)),
+        'max_width': CHART_MAX_WIDTH_IN,
+        'max_height': CHART_MAX_HEIGHT_IN,
+        'max_points': CHART_MAX_POINTS,
+        'density_grid': CHART_DENSITY_GRID,
+        'chart_dir': os.path.abspath(CHART_DIR)
+    }
+
+def describe_chart_reduction(reduction):
+    methods = {"lttb": "LTTB", "density": "density binning", "ohlc": "bar merging", "binned": "histogram binning"}
+    used = ", ".join(methods.get(m, m) for m in reduction['methods'])
+    return (f"Downsampled {reduction['original_points']:,} points to {reduction['rendered_points']:,} "
+            f"({reduction['ratio']}x) using {used}")
+
+# Running size of CHART_DIR: set by each prune scan, grown by record_chart_write
+_chart_store_bytes = None
+_chart_store_lock = threading.Lock()
+
+def prune_chart_cache(max_bytes=CHART_CACHE_MAX_BYTES):
+    """Delete the least recently used charts (by mtime) once the store exceeds its budget"""
+    global _chart_store_bytes
+    with _chart_store_lock:
+        _chart_store_bytes = _prune_chart_dir(max_bytes)
+
+def _prune_chart_dir(max_bytes):
+    entries = []
+    for name in os.listdir(CHART_DIR):
+        file_path = os.path.join(CHART_DIR, name)
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, file_path))
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, file_path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    if removed:
+        print(f"🧹 [Charts] Pruned {removed} old charts")
+    return total
+
+def touch_chart_file(name):
+    """Mark a stored chart as just used so pruning keeps it; False if it has already been pruned"""
+    try:
+        os.utime(os.path.join(CHART_DIR, name))
+        return True
+    except FileNotFoundError:
+        return False
+
+def record_chart_write(nbytes):
+    """Count a chart the worker stored; the directory is rescanned and pruned only once the count passes the budget"""
+    global _chart_store_bytes
+    with _chart_store_lock:
+        if _chart_store_bytes is not None:
+            # Re-rendering an existing chart is counted again; that only makes the next scan come sooner
+            _chart_store_bytes += nbytes
+            if _chart_store_bytes <= CHART_CACHE_MAX_BYTES:
+                return
+    prune_chart_cache(CHART_CACHE_MAX_BYTES)
+
+@app.on_event("startup")
+async def prune_charts_on_startup():
+    await run_in_threadpool(prune_chart_cache)
+
+def execute_data_analysis_code(code, dataset, table_name=None, chart=None, profile=None):
+    """Execute generated code against a dataset in a sandboxed worker process.
+
+    dataset is a reference from shared_dataset_ref (an Arrow file or, for frames
+    without one, a shared memory block the worker maps read-only) or {'frame': df}. With
+    ANALYSIS_WORKERS=0 the code runs in-process, without a timeout. chart holds
+    the rendering options from chart_render_options; profile is exposed to the
+    code as `profile`.
+    """
+    job = {
+        'code': code,
+        'dataset': dataset,
+        'chart': chart or chart_render_options(),
+        'profile': profile,
+        'table_name': table_name,
+        'table_version': table_version(table_name) if table_name else None,
+        'db_path': os.path.abspath(ANALYSIS_DB_PATH)
+    }
+    if ANALYSIS_WORKERS <= 0:
+        result = analysis_worker.run_job(job)
+        result['sql_cache'] = analysis_worker.sql_cache_report()
+    else:
+        result = analysis_pool.run(job)
+    record_worker_sql_cache(result.pop('sql_cache', None))
+    if result.get('chart'):
+        record_chart_write(result['chart']['bytes'])
+    return result
+
+# Process-wide engines for the analysis database
+ANALYSIS_DB_PATH = "databases/analysis.db"
+ANALYSIS_DB_POOL_SIZE = int(os.getenv("ANALYSIS_DB_POOL_SIZE", "5"))
+ANALYSIS_DB_MAX_OVERFLOW = int(os.getenv("ANALYSIS_DB_MAX_OVERFLOW", "10"))
+ANALYSIS_DB_MMAP_SIZE = 256 * 1024 * 1024
+ANALYSIS_DB_CACHE_KB = 64 * 1024
+ANALYSIS_DB_BUSY_TIMEOUT_MS = 5000
+
+_analysis_engines = {}
+_analysis_engines_lock = threading.RLock()
+
+def apply_analysis_pragmas(dbapi_connection, read_only):
+    cursor = dbapi_connection.cursor()
+    if not read_only:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA mmap_size={ANALYSIS_DB_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size=-{ANALYSIS_DB_CACHE_KB}")
+    cursor.execute(f"PRAGMA busy_timeout={ANALYSIS_DB_BUSY_TIMEOUT_MS}")
+    if read_only:
+        cursor.execute("PRAGMA query_only=1")
+    cursor.close()
+
+def get_analysis_engine(read_only=False):
+    """Return the shared pooled engine for databases/analysis.db.
+
+    The read-only engine opens connections with mode=ro and is what every
+    SELECT-only path (/execute-sql, /list-tables, generated code) should use.
+    """
+    engine = _analysis_engines.get(read_only)
+    if engine is not None:
+        return engine
+    with _analysis_engines_lock:
+        if read_only not in _analysis_engines:
+            os.makedirs(os.path.dirname(ANALYSIS_DB_PATH), exist_ok=True)
+            if read_only:
+                # mode=ro cannot create the file, so make sure it exists (in WAL mode) first
+                get_analysis_engine().connect().close()
+                url = f"sqlite:///file:{ANALYSIS_DB_PATH}?mode=ro&uri=true"
+            else:
+                url = f"sqlite:///{ANALYSIS_DB_PATH}"
+            engine = create_engine(
+                url,
+                poolclass=QueuePool,
+                pool_size=ANALYSIS_DB_POOL_SIZE,
+                max_overflow=ANALYSIS_DB_MAX_OVERFLOW,
+                connect_args={"check_same_thread": False}
+            )
+            event.listen(engine, "connect", lambda conn, record: apply_analysis_pragmas(conn, read_only))
+            _analysis_engines[read_only] = engine
+        return _analysis_engines[read_only]
+
+# Inspector metadata is cached until a load creates or replaces a table
+_table_metadata_cache = {"tables": None, "columns": {}}
+_table_metadata_lock = threading.Lock()
+
+def list_analysis_tables():
+    with _table_metadata_lock:
+        if _table_metadata_cache["tables"] is None:
+            _table_metadata_cache["tables"] = inspect(get_analysis_engine(read_only=True)).get_table_names()
+        return list(_table_metadata_cache["tables"])
+
+def get_analysis_table_columns(table_name):
+    """Column metadata for a table, or None if it does not exist"""
+    if table_name not in list_analysis_tables():
+        return None
+    with _table_metadata_lock:
+        columns = _table_metadata_cache["columns"].get(table_name)
+        if columns is None:
+            columns = inspect(get_analysis_engine(read_only=True)).get_columns(table_name)
+            _table_metadata_cache["columns"][table_name] = columns
+        return columns
+
+# Version stamps bumped whenever a table is (re)loaded; cached query results embed them in their keys
+_table_versions = {}
+
+def table_version(table_name):
+    return _table_versions.get(table_name, 0)
+
+def bump_table_version(table_name):
+    with _table_metadata_lock:
+        _table_versions[table_name] = _table_versions.get(table_name, 0) + 1
+
+def invalidate_table_metadata(table_name=None):
+    with _table_metadata_lock:
+        _table_metadata_cache["tables"] = None
+        if table_name is None:
+            _table_metadata_cache["columns"].clear()
+        else:
+            _table_metadata_cache["columns"].pop(table_name, None)
+
+SQLITE_BULK_BATCH_ROWS = 10000
+SQLITE_MAX_SECONDARY_INDEXES = 4
+
+def quote_identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+def sqlite_column_type(dtype):
+    """Explicit SQLite column type for an inferred pandas dtype"""
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "TIMESTAMP"
+    return "TEXT"
+
+def sqlite_index_columns(df):
+    """Low-cardinality columns are the usual WHERE / GROUP BY targets, so index those"""
+    columns = [col for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)]
+    return columns[:SQLITE_MAX_SECONDARY_INDEXES]
+
+class SQLiteBulkLoader:
+    """Load DataFrame chunks into a freshly created SQLite table in one transaction.
+
+    The table is created with explicit column types from the first chunk, rows
+    are inserted with executemany in batches while synchronous writes are
+    relaxed, and secondary indexes are built only after all rows are in.
+    """
+
+    def __init__(self, table_name, index_columns=None):
+        self.table_name = table_name
+        self.index_columns = index_columns
+        self.rows = 0
+        self.conn = None
+        self._insert_sql = None
+
+    def __enter__(self):
+        self._start = time.time()
+        # Borrow a pooled connection (WAL already enabled on connect) and manage the transaction by hand
+        self._pooled = get_analysis_engine().raw_connection()
+        self.conn = self._pooled.driver_connection
+        self._isolation_level = self.conn.isolation_level
+        self.conn.isolation_level = None
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        self.conn.execute("BEGIN")
+        return self
+
+    def append(self, chunk):
+        if self._insert_sql is None:
+            self._create_table(chunk)
+        columns = [chunk[col].astype(object).where(chunk[col].notna(), None).tolist() for col in chunk.columns]
+        rows = list(zip(*columns))
+        for start in range(0, len(rows), SQLITE_BULK_BATCH_ROWS):
+            self.conn.executemany(self._insert_sql, rows[start:start + SQLITE_BULK_BATCH_ROWS])
+        self.rows += len(rows)
+
+    def _create_table(self, chunk):
+        table = quote_identifier(self.table_name)
+        column_defs = ", ".join(f"{quote_identifier(col)} {sqlite_column_type(chunk[col].dtype)}" for col in chunk.columns)
+        self.conn.execute(f"DROP TABLE IF EXISTS {table}")
+        self.conn.execute(f"CREATE TABLE {table} ({column_defs})")
+        placeholders = ", ".join("?" for _ in chunk.columns)
+        self._insert_sql = f"INSERT INTO {table} VALUES ({placeholders})"
+        if self.index_columns is None:
+            self.index_columns = sqlite_index_columns(chunk)
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is not None:
+                self.conn.execute("ROLLBACK")
+                return False
+            table = quote_identifier(self.table_name)
+            for i, col in enumerate(self.index_columns or []):
+                index_name = quote_identifier(f"idx_{self.table_name}_{i}")
+                self.conn.execute(f"CREATE INDEX {index_name} ON {table} ({quote_identifier(col)})")
+            self.conn.execute("COMMIT")
+        finally:
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("PRAGMA temp_store=DEFAULT")
+            self.conn.isolation_level = self._isolation_level
+            self._pooled.close()  # Back to the pool
+            invalidate_table_metadata(self.table_name)
+            bump_table_version(self.table_name)
+        elapsed = max(time.time() - self._start, 1e-6)
+        self.rows_per_second = int(self.rows / elapsed)
+        print(f"🗃️  [SQLite] Loaded {self.rows} rows into {self.table_name} in {elapsed:.2f}s ({self.rows_per_second} rows/s)")
+        return False
+
+def get_database_engine():
+    return get_analysis_engine(read_only=True)
+
+@app.get("/list-tables")
+def list_uploaded_tables(current_user: User = Depends(get_current_user)):
+    tables = list_analysis_tables()
+    if not tables:
+        raise HTTPException(status_code=404, detail="No tables found in the database.")
+    return {"tables": tables}
+
+@app.get("/describe-table")
+def describe_table(
+    table_name: str = Query(..., description="Name of the table to describe"),
+    current_user: User = Depends(get_current_user)
+):
+    columns = get_analysis_table_columns(table_name)
+    if not columns:
+        raise HTTPException(status_code=404, detail=f"Table '{table_name}' not found.")
+    return {
+        "table": table_name,
+        "columns": [
+            {"name": col["name"], "type": str(col["type"]), "nullable": col["nullable"]}
+            for col in columns
+        ]
+    }
+# Result cache for SELECTs against analysis tables, keyed by normalized SQL plus table versions
+SQL_RESULT_CACHE_MAX_BYTES = int(os.getenv("SQL_RESULT_CACHE_MAX_MB", "128")) * 1024 * 1024
+SQL_RESULT_CACHE_TTL = int(os.getenv("SQL_RESULT_CACHE_TTL", "600"))
+SQL_LITERAL_RE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+
+def normalize_sql(query):
+    """Collapse whitespace and case outside of string literals and quoted identifiers"""
+    parts = SQL_LITERAL_RE.split(strip_sql(query))
+    return "".join(part if i % 2 else re.sub(r'\s+', ' ', part).lower() for i, part in enumerate(parts))
+
+def sql_result_nbytes(value):
+    if isinstance(value, pd.DataFrame):
+        return dataframe_nbytes(value)
+    return len(json.dumps(value, default=str))
+
+sql_result_cache = BoundedLRUCache(SQL_RESULT_CACHE_MAX_BYTES, sizeof=sql_result_nbytes, ttl_seconds=SQL_RESULT_CACHE_TTL)
+
+def sql_cache_key(kind, query, *params):
+    """Key on the normalized query and the versions of every analysis table it mentions"""
+    normalized = normalize_sql(query)
+    lowered = query.lower()
+    versions = tuple(sorted(
+        (table, table_version(table)) for table in list_analysis_tables() if table.lower() in lowered
+    ))
+    return (kind, normalized, params, versions)
+
+# Paging for /execute-sql: LIMIT is pushed into SQLite so only one page is ever materialized
+EXECUTE_SQL_DEFAULT_PAGE_SIZE = 50
+EXECUTE_SQL_MAX_PAGE_SIZE = 1000
+SIMPLE_SELECT_RE = re.compile(
+    r'^select\s+(?P<columns>.+?)\s+from\s+(?P<table>"(?:[^"]|"")+"|\w+)(?:\s+where\s+(?P<where>.+))?$',
+    re.IGNORECASE | re.DOTALL
+)
+KEYSET_BLOCKERS_RE = re.compile(
+    r'\b(order\s+by|group\s+by|having|limit|offset|union|intersect|except|join|distinct|over)\b',
+    re.IGNORECASE
+)
+AGGREGATE_RE = re.compile(r'\b(count|sum|avg|min|max|total|group_concat)\s*\(', re.IGNORECASE)
+
+def strip_sql(query):
+    return query.strip().rstrip(';').strip()
+
+def plan_sql_pages(query):
+    """Use rowid keyset paging for plain single-table SELECTs, OFFSET paging otherwise"""
+    match = SIMPLE_SELECT_RE.match(query)
+    if match and not KEYSET_BLOCKERS_RE.search(query) and not AGGREGATE_RE.search(match.group('columns')):
+        return {
+            'mode': 'keyset',
+            'table': match.group('table'),
+            'columns': match.group('columns'),
+            'where': match.group('where')
+        }
+    return {'mode': 'offset'}
+
+def sql_fingerprint(query):
+    return hashlib.sha1(normalize_sql(query).encode('utf-8')).hexdigest()[:16]
+
+def encode_sql_cursor(query, mode, value):
+    token = json.dumps({"m": mode, "v": value, "q": sql_fingerprint(query)})
+    return base64.urlsafe_b64encode(token.encode('utf-8')).decode('ascii')
+
+def decode_sql_cursor(token, query, mode):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        if data["q"] == sql_fingerprint(query) and data["m"] == mode:
+            return int(data["v"])
+    except Exception:
+        pass
+    raise HTTPException(status_code=400, detail="Invalid or stale cursor for this query.")
+
+def paged_sql(query, plan):
+    """SQL and parameter names for fetching one page (plus one look-ahead row)"""
+    if plan['mode'] == 'keyset':
+        where = f"({plan['where']}) AND " if plan['where'] else ""
+        return (f"SELECT rowid AS __rowid__, {plan['columns']} FROM {plan['table']} "
+                f"WHERE {where}rowid > :after ORDER BY rowid LIMIT :limit")
+    return f"SELECT * FROM ({query}) LIMIT :limit OFFSET :after"
+
+def fetch_sql_page(conn, query, plan, page_size, after):
+    """Fetch one page; returns (columns, rows, next cursor value or None)"""
+    from sqlalchemy import text
+    result = conn.execute(text(paged_sql(query, plan)), {"after": after, "limit": page_size + 1})
+    columns = list(result.keys())
+    rows = [list(row) for row in result.fetchmany(page_size + 1)]
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if plan['mode'] == 'keyset':
+        next_after = rows[-1][0] if has_more else None
+        columns = columns[1:]
+        rows = [row[1:] for row in rows]
+    else:
+        next_after = after + page_size if has_more else None
+    return columns, rows, next_after
+
+def count_sql_rows(conn, query, plan, count):
+    """Exact COUNT(*) over the query, or a cheap MAX(rowid) upper bound for single tables"""
+    from sqlalchemy import text
+    if count == "exact":
+        return conn.execute(text(f"SELECT COUNT(*) FROM ({query})")).scalar(), True
+    if count == "estimate" and plan['mode'] == 'keyset':
+        return conn.execute(text(f"SELECT MAX(rowid) FROM {plan['table']}")).scalar() or 0, False
+    return None, None
+
+@app.post("/execute-sql")
+def execute_sql(
+    query: str = Query(..., description="SQL query to execute (SELECT only)"),
+    page_size: int = Query(EXECUTE_SQL_DEFAULT_PAGE_SIZE, ge=1, le=EXECUTE_SQL_MAX_PAGE_SIZE, description="Rows per page"),
+    cursor: str | None = Query(None, description="next_cursor from a previous page"),
+    count: str = Query("exact", pattern="^(exact|estimate|none)$", description="Total row count mode"),
+    stream: bool = Query(False, description="Stream every page as JSONL instead of returning one page"),
+    current_user: User = Depends(get_current_user)
+):
+    if not query.strip().lower().startswith("select"):
+        raise HTTPException(status_code=400, detail="Only SELECT queries are allowed for safety.")
+
+    query = strip_sql(query)
+    plan = plan_sql_pages(query)
+    after = decode_sql_cursor(cursor, query, plan['mode']) if cursor else 0
+    engine = get_database_engine()
+    
+    if stream:
+        def stream_pages():
+            from sqlalchemy import text
+            sent = 0
+            # keyset statements carry the rowid as an extra first column
+            skip = 1 if plan['mode'] == 'keyset' else 0
+            try:
+                with engine.connect() as conn:
+                    # One statement for the whole stream (LIMIT -1 is unlimited in SQLite);
+                    # pages are consecutive fetchmany batches from its cursor
+                    result = conn.execute(text(paged_sql(query, plan)), {"after": after, "limit": -1})
+                    columns = list(result.keys())[skip:]
+                    while True:
+                        rows = [list(row)[skip:] for row in result.fetchmany(page_size)]
+                        if not rows and sent:
+                            break
+                        sent += len(rows)
+                        yield json.dumps({"type": "page", "columns": columns, "data": rows, "done": False}, default=str) + "\n"
+                        if len(rows) < page_size:
+                            break
+                yield json.dumps({"type": "complete", "row_count": sent, "done": True}) + "\n"
+            except Exception as e:
+                yield json.dumps({"type": "error", "error": f"SQL execution error: {str(e)}", "done": True}) + "\n"
+        return StreamingResponse(stream_pages(), media_type="application/jsonl")
+    
+    try:
+        cache_key = sql_cache_key("page", query, page_size, after, count)
+        page = sql_result_cache.get(cache_key)
+        if page is None:
+            with engine.connect() as conn:
+                page = fetch_sql_page(conn, query, plan, page_size, after) + count_sql_rows(conn, query, plan, count)
+            sql_result_cache.put(cache_key, page)
+        columns, rows, next_after, row_count, row_count_exact = page
+        return {
+            "success": True,
+            "row_count": row_count,
+            "row_count_exact": row_count_exact,
+            "columns": columns,
+            "data": [dict(zip(columns, row)) for row in rows],
+            "pagination": plan['mode'],
+            "next_cursor": encode_sql_cursor(query, plan['mode'], next_after) if next_after is not None else None
+        }
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"SQL execution error: {str(e)}")
+    
+
+def load_csv_file(file_path, dialect=None):
+    """Load a CSV file with a single C-engine parse.
+
+    The dialect is sniffed from a prefix of the file unless one recorded at
+    upload time is passed in. Only a decoding or tokenizing failure triggers
+    one relaxed retry; there is no cascade of alternative readers.
+    """
+    if dialect is None:
+        dialect = sniff_csv_dialect(file_path)
+    start = time.time()
+    try:
+        try:
+            record_csv_parse_attempt()
+            df = read_csv_with_dialect(file_path, dialect)
+        except (UnicodeDecodeError, pd.errors.ParserError) as e:
+            relax_csv_dialect(dialect, e)
+            record_csv_parse_attempt(relaxed=True)
+            df = read_csv_with_dialect(file_path, dialect)
+    except Exception as e:
+        print(f"Failed to read the CSV file with dialect {dialect}: {str(e)}")
+        record_csv_parse_result(False, time.time() - start)
+        return None
+    record_csv_parse_result(True, time.time() - start)
+    
+    if df.empty:
+        return None
+    print(f"Read CSV with dialect {dialect}, shape {df.shape}")
+    plan = {'dtypes': finalize_column_plan(update_column_stats(None, df, dialect))}
+    return apply_column_plan(df, plan, dialect)
+
+# ============================================================================
+# STREAMING CSV INGESTION
+# ============================================================================
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # Bytes read from the request body at a time
+CSV_SNIFF_BYTES = 64 * 1024  # Prefix used for dialect and encoding detection
+CSV_SNIFF_ROWS = 50  # Rows of the prefix inspected for header and number format
+CSV_CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", "50000"))
+
+csv_parse_stats = {
+    "sniffs": 0,
+    "sniff_seconds": 0.0,
+    "files_parsed": 0,
+    "parse_attempts": 0,
+    "relaxed_retries": 0,
+    "failures": 0,
+    "parse_seconds": 0.0
+}
+_csv_parse_stats_lock = threading.Lock()
+
+def record_csv_parse_attempt(relaxed=False):
+    with _csv_parse_stats_lock:
+        csv_parse_stats["parse_attempts"] += 1
+        if relaxed:
+            csv_parse_stats["relaxed_retries"] += 1
+
+def record_csv_parse_result(success, seconds):
+    with _csv_parse_stats_lock:
+        csv_parse_stats["files_parsed" if success else "failures"] += 1
+        csv_parse_stats["parse_seconds"] += seconds
+
+COMMA_DECIMAL_RE = re.compile(r'-?\d{1,3}(\.\d{3})+,\d+|-?\d+,\d{1,2}|-?\d+,\d{4,}')
+DOT_DECIMAL_RE = re.compile(r'-?\d{1,3}(,\d{3})+(\.\d+)?|-?\d+\.\d+')
+PLAIN_NUMBER_RE = re.compile(r'-?\d+([.,]\d+)*')
+
+def sniff_csv_dialect(file_path, sample_size=CSV_SNIFF_BYTES):
+    """Decide encoding, delimiter, quote char, header row and number format from a file prefix.
+
+    The result is a plain dict that can be stored on the UploadedCSV row and
+    passed back to the readers so reloads skip detection.
+    """
+    import chardet
+    start = time.time()
+    
+    with open(file_path, 'rb') as f:
+        sample = f.read(sample_size)
+    
+    try:
+        encoding = chardet.detect(sample)['encoding'] or 'utf-8'
+    except Exception as e:
+        print(f"Error detecting encoding: {str(e)}")
+        encoding = 'utf-8'
+    # A plain-ASCII prefix says nothing about the rest of the file
+    if encoding.lower() == 'ascii':
+        encoding = 'utf-8'
+    
+    text = sample.decode(encoding, errors='ignore')
+    if len(sample) == sample_size and '\n' in text:
+        # Drop the last, possibly truncated, line
+        text = text[:text.rfind('\n')]
+    
+    delimiter, quotechar = ',', '"'
+    try:
+        sniffed = csv.Sniffer().sniff(text, delimiters=',;\t|')
+        delimiter, quotechar = sniffed.delimiter, sniffed.quotechar or '"'
+    except Exception:
+        pass
+    
+    rows = []
+    for row in csv.reader(io.StringIO(text), delimiter=delimiter, quotechar=quotechar):
+        if row:
+            rows.append([field.strip() for field in row])
+        if len(rows) >= CSV_SNIFF_ROWS:
+            break
+    
+    # A header row is never made of numbers only
+    header = 0
+    if rows and all(field and PLAIN_NUMBER_RE.fullmatch(field) for field in rows[0]):
+        header = None
+    
+    comma_decimal = dot_decimal = 0
+    for row in rows[1:] if header == 0 else rows:
+        for field in row:
+            if DOT_DECIMAL_RE.fullmatch(field):
+                dot_decimal += 1
+            elif delimiter != ',' and COMMA_DECIMAL_RE.fullmatch(field):
+                comma_decimal += 1
+    decimal, thousands = (',', '.') if comma_decimal > dot_decimal else ('.', ',')
+    
+    dialect = {
+        'encoding': encoding,
+        'delimiter': delimiter,
+        'quotechar': quotechar,
+        'header': header,
+        'decimal': decimal,
+        'thousands': thousands
+    }
+    with _csv_parse_stats_lock:
+        csv_parse_stats["sniffs"] += 1
+        csv_parse_stats["sniff_seconds"] += time.time() - start
+    print(f"Sniffed CSV dialect: {dialect}")
+    return dialect
+
+def relax_csv_dialect(dialect, error):
+    """Adjust a dialect after a failed parse so that one retry can succeed"""
+    if isinstance(error, UnicodeDecodeError):
+        print(f"Encoding {dialect['encoding']} failed past the sniffed prefix, using latin1")
+        dialect['encoding'] = 'latin1'
+    else:
+        print(f"Strict parse failed ({error}), skipping bad lines")
+        dialect['on_bad_lines'] = 'skip'
+
+def read_csv_with_dialect(file_path, dialect, chunksize=None):
+    """Parse with the C engine as strings; typing is applied afterwards so every chunk agrees"""
+    result = pd.read_csv(
+        file_path,
+        sep=dialect['delimiter'],
+        quotechar=dialect.get('quotechar', '"'),
+        header=dialect.get('header', 0),
+        encoding=dialect['encoding'],
+        on_bad_lines=dialect.get('on_bad_lines', 'error'),
+        dtype=str,
+        engine='c',
+        chunksize=chunksize
+    )
+    if chunksize is None:
+        return name_csv_columns(result, dialect)
+    return result
+
+def name_csv_columns(df, dialect):
+    if dialect.get('header', 0) is None:
+        df.columns = [f"column_{i + 1}" for i in range(len(df.columns))]
+    else:
+        df.columns = df.columns.str.strip()
+    return df
+
+def iter_csv_chunks(file_path, dialect, chunksize=None):
+    with read_csv_with_dialect(file_path, dialect, chunksize=chunksize or CSV_CHUNK_ROWS) as reader:
+        for chunk in reader:
+            yield name_csv_columns(chunk, dialect)
+
+def numeric_values(series, dialect):
+    """Strip thousands separators and parse as numbers; unparseable values become NaN"""
+    values = series.str.replace(dialect.get('thousands', ','), '', regex=False)
+    if dialect.get('decimal', '.') != '.':
+        values = values.str.replace(dialect['decimal'], '.', regex=False)
+    return pd.to_numeric(values, errors='coerce')
+
+CATEGORY_MAX_UNIQUE = 1000  # Text columns with at most this many distinct values...
+CATEGORY_MAX_RATIO = 0.5  # ...and at most this share of unique values become 'category'
+# Narrower ints overflow silently in arithmetic written by generated code (e.g. int8 * 100)
+INT_DOWNCAST_FLOOR = np.int32
+
+def update_column_stats(stats, chunk, dialect):
+    """Fold one chunk into the running per-column statistics used to pick dtypes"""
+    if stats is None:
+        stats = {col: {'numeric': True, 'has_nan': False, 'integral': True, 'float32_exact': True,
+                       'min': None, 'max': None, 'count': 0, 'distinct': set()}
+                 for col in chunk.columns}
+    for col in chunk.columns:
+        st = stats[col]
+        values = chunk[col]
+        missing = values.isna()
+        st['has_nan'] = st['has_nan'] or bool(missing.any())
+        st['count'] += int((~missing).sum())
+        
+        # Tracked from the first chunk on: a column that turns out to be text
+        # later still needs the values of the chunks that parsed as numbers
+        if st['distinct'] is not None:
+            st['distinct'].update(values[~missing].unique())
+            if len(st['distinct']) > CATEGORY_MAX_UNIQUE:
+                st['distinct'] = None  # Too many values to ever be a category
+        
+        if st['numeric']:
+            nums = numeric_values(values, dialect)
+            if bool((nums.isna() & ~missing).any()):
+                st['numeric'] = False
+            else:
+                present = nums[~missing]
+                if len(present):
+                    st['integral'] = st['integral'] and bool((present % 1 == 0).all())
+                    st['float32_exact'] = st['float32_exact'] and bool(
+                        (present.astype(np.float32).astype(np.float64) == present).all())
+                    lo, hi = present.min(), present.max()
+                    st['min'] = lo if st['min'] is None else min(st['min'], lo)
+                    st['max'] = hi if st['max'] is None else max(st['max'], hi)
+    return stats
+
+def finalize_column_plan(stats):
+    """Turn accumulated statistics into a dtype per column (None keeps text as-is)"""
+    dtypes = {}
+    for col, st in stats.items():
+        if st['numeric']:
+            if st['integral'] and not st['has_nan'] and st['min'] is not None:
+                info = np.iinfo(INT_DOWNCAST_FLOOR)
+                fits = info.min <= st['min'] and st['max'] <= info.max
+                dtypes[col] = np.dtype(INT_DOWNCAST_FLOOR if fits else np.int64)
+            else:
+                dtypes[col] = np.dtype(np.float32 if st['float32_exact'] else np.float64)
+        elif st['distinct'] is not None and st['count'] and len(st['distinct']) <= CATEGORY_MAX_RATIO * st['count']:
+            dtypes[col] = pd.CategoricalDtype(sorted(st['distinct']))
+        else:
+            dtypes[col] = None
+    return dtypes
+
+def infer_column_plan(file_path, dialect):
+    """First pass over the file: pick the narrowest dtype every chunk agrees on.
+
+    A column is numeric only if every non-empty value in every chunk parses;
+    integers and exactly-representable floats are downcast, and low-cardinality
+    text becomes a category with a fixed set of categories.
+    """
+    stats = None
+    rows = 0
+    for chunk in iter_csv_chunks(file_path, dialect):
+        stats = update_column_stats(stats, chunk, dialect)
+        rows += len(chunk)
+    if stats is None:
+        return None
+    return {'rows': rows, 'dtypes': finalize_column_plan(stats)}
+
+def apply_column_plan(chunk, plan, dialect):
+    for col, dtype in plan['dtypes'].items():
+        if dtype is None:
+            continue
+        if isinstance(dtype, pd.CategoricalDtype):
+            chunk[col] = chunk[col].astype(dtype)
+        else:
+            chunk[col] = numeric_values(chunk[col], dialect).astype(dtype)
+    return chunk
+
+def resolve_csv_plan(file_path, dialect):
+    """Run the inference pass, relaxing the dialect once if the strict parse fails"""
+    start = time.time()
+    try:
+        try:
+            record_csv_parse_attempt()
+            plan = infer_column_plan(file_path, dialect)
+        except (UnicodeDecodeError, pd.errors.ParserError) as e:
+            relax_csv_dialect(dialect, e)
+            record_csv_parse_attempt(relaxed=True)
+            plan = infer_column_plan(file_path, dialect)
+    except Exception:
+        record_csv_parse_result(False, time.time() - start)
+        raise
+    record_csv_parse_result(True, time.time() - start)
+    return plan
+
+def ingest_csv_file(file_path, table_name):
+    """Parse a CSV in bounded chunks into the SQL table and the Arrow columnar copy.
+
+    The file is read twice: a first pass (resolve_csv_plan) settles every
+    column's dtype, and a second pass converts each chunk to that plan and
+    writes it out, so all chunks share one schema. Peak memory is
+    proportional to CSV_CHUNK_ROWS, not to the file size.
+    Returns a summary of the dataset, or None if the file has no rows.
+    """
+    dialect = sniff_csv_dialect(file_path)
+    plan = resolve_csv_plan(file_path, dialect)
+    if plan is None or plan['rows'] == 0:
+        return None
+    
+    columnar_path = columnar_path_for(table_name)
+    tmp_path = f"{columnar_path}.tmp"
+    sink = writer = schema = None
+    sample = None
+    rows = 0
+    try:
+        with SQLiteBulkLoader(table_name) as loader:
+            for chunk in iter_csv_chunks(file_path, dialect):
+                chunk = apply_column_plan(chunk, plan, dialect)
+                if sample is None:
+                    sample = chunk.head(5)
+                    # All-empty text columns would otherwise be typed as null by Arrow
+                    schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+                    for i, field in enumerate(schema):
+                        if pa.types.is_null(field.type):
+                            schema = schema.set(i, pa.field(field.name, pa.string()))
+                    sink = pa.OSFile(tmp_path, 'wb')
+                    writer = pa.ipc.new_file(sink, schema)
+                loader.append(chunk)
+                writer.write_batch(pa.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=False))
+                rows += len(chunk)
+        writer.close()
+        sink.close()
+        os.replace(tmp_path, columnar_path)
+    except Exception:
+        if sink is not None:
+            sink.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    
+    print(f"📥 [Ingest] Loaded {rows} rows into {table_name} and {columnar_path}")
+    profile = profile_columnar_file(columnar_path)
+    return {
+        'columns': sample.columns.tolist(),
+        'dtypes': sample.dtypes.astype(str).to_dict(),
+        'shape': (rows, len(sample.columns)),
+        'sample_data': sample.to_dict('records'),
+        'columnar_path': columnar_path,
+        'dialect': dialect,
+        'profile': profile
+    }
+
+# ============================================================================
+# COLUMNAR DATASET STORE
+# ============================================================================
+
+def columnar_path_for(table_name):
+    return os.path.join(COLUMNAR_DIR, f"{table_name}.arrow")
+
+def write_columnar_file(df, file_path):
+    """Write a DataFrame as an uncompressed Arrow IPC file so it can be memory-mapped later"""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    tmp_path = f"{file_path}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, file_path)
+    return file_path
+
+def read_columnar_file(file_path, columns=None):
+    """Open an Arrow IPC file memory-mapped, optionally projecting to a subset of columns.
+
+    Numeric columns without nulls are handed to pandas without copying, so the
+    resulting frame is backed by the page cache rather than private memory.
+    """
+    source = pa.memory_map(file_path, 'r')
+    table = pa.ipc.open_file(source).read_all()
+    if columns is not None:
+        table = table.select(list(columns))
+    return table.to_pandas(split_blocks=True)
+
+def read_columnar_schema(file_path):
+    """Read only the Arrow schema (column names and pandas dtypes) from the file footer"""
+    with pa.memory_map(file_path, 'r') as source:
+        schema = pa.ipc.open_file(source).schema
+    empty = schema.empty_table().to_pandas()
+    return {
+        'columns': empty.columns.tolist(),
+        'dtypes': empty.dtypes.astype(str).to_dict()
+    }
+
+def save_columnar_copy(df, table_name):
+    """Best-effort columnar copy; analysis falls back to CSV parsing if it fails"""
+    file_path = columnar_path_for(table_name)
+    try:
+        write_columnar_file(df, file_path)
+        print(f"🗄️  [Columnar] Wrote {file_path}")
+        return file_path
+    except Exception as e:
+        print(f"⚠️  [Columnar] Could not write Arrow copy for {table_name}: {e}")
+        if os.path.exists(f"{file_path}.tmp"):
+            os.remove(f"{file_path}.tmp")
+        return None
+
+# ============================================================================
+# DATASET PROFILE
+# ============================================================================
+
+PROFILE_HISTOGRAM_BINS = 20
+PROFILE_TOP_K = 10
+PROFILE_MAX_CORR_COLUMNS = 30
+PROFILE_CORR_SAMPLE_ROWS = int(os.getenv("PROFILE_CORR_SAMPLE_ROWS", "200000"))
+PROFILE_DATETIME_SAMPLE = 200
+
+def json_number(value):
+    """Plain Python number for JSON, with NaN/inf as None"""
+    if value is None or pd.isna(value):
+        return None
+    if isinstance(value, (np.integer, int)):
+        return int(value)
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+def looks_like_datetime(series):
+    """True when a sample of a text column mostly parses as dates (not bare numbers)"""
+    sample = series.dropna().astype(str)
+    sample = sample.iloc[np.linspace(0, len(sample) - 1, min(len(sample), PROFILE_DATETIME_SAMPLE)).astype(int)] if len(sample) else sample
+    if sample.empty or not sample.str.contains(r'[-/:]').mean() > 0.9:
+        return False
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        parsed = pd.to_datetime(sample, errors='coerce', format='mixed')
+    return parsed.notna().mean() >= 0.9
+
+def profile_column(series):
+    """Stats for one column: nulls and cardinality, plus distribution (numeric) or top values"""
+    rows = len(series)
+    nulls = int(series.isna().sum())
+    stats = {
+        'dtype': str(series.dtype),
+        'non_null': rows - nulls,
+        'nulls': nulls,
+        'null_pct': round(100 * nulls / rows, 2) if rows else 0.0,
+        'unique': int(series.nunique(dropna=True))
+    }
+    if pd.api.types.is_bool_dtype(series):
+        stats['kind'] = 'boolean'
+    elif pd.api.types.is_numeric_dtype(series):
+        stats['kind'] = 'numeric'
+        values = series.to_numpy(dtype=float, na_value=np.nan)
+        values = values[np.isfinite(values)]
+        if len(values):
+            p25, median, p75 = np.percentile(values, [25, 50, 75])
+            counts, edges = np.histogram(values, bins=PROFILE_HISTOGRAM_BINS)
+            stats.update({
+                'mean': json_number(values.mean()),
+                'std': json_number(values.std(ddof=1)) if len(values) > 1 else None,
+                'min': json_number(series.min()),
+                'p25': json_number(p25),
+                'median': json_number(median),
+                'p75': json_number(p75),
+                'max': json_number(series.max()),
+                'histogram': {'counts': counts.tolist(), 'edges': [json_number(e) for e in edges]}
+            })
+        return stats
+    elif pd.api.types.is_datetime64_any_dtype(series):
+        stats['kind'] = 'datetime'
+    elif looks_like_datetime(series):
+        stats['kind'] = 'datetime'
+        series = pd.to_datetime(series, errors='coerce', format='mixed')
+    else:
+        stats['kind'] = 'categorical' if stats['unique'] <= CATEGORY_MAX_UNIQUE else 'text'
+
+    if stats['kind'] == 'datetime':
+        stats['min'] = series.min().isoformat() if series.notna().any() else None
+        stats['max'] = series.max().isoformat() if series.notna().any() else None
+    else:
+        top = series.value_counts(dropna=True).head(PROFILE_TOP_K)
+        stats['top_values'] = [[str(value), int(count)] for value, count in top.items()]
+    return stats
+
+def compute_dataset_profile(table):
+    """Profile an Arrow table one column at a time so memory stays near one column's size.
+
+    Correlations use an evenly spaced row sample once the table exceeds
+    PROFILE_CORR_SAMPLE_ROWS rows.
+    """
+    rows = table.num_rows
+    columns = {}
+    numeric_columns = []
+    for name in table.column_names:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            stats = profile_column(table.column(name).to_pandas())
+        columns[name] = stats
+        if stats['kind'] == 'numeric' and stats['unique'] > 1:
+            numeric_columns.append(name)
+
+    correlation = None
+    corr_columns = numeric_columns[:PROFILE_MAX_CORR_COLUMNS]
+    if len(corr_columns) > 1:
+        subset = table.select(corr_columns)
+        sampled = rows > PROFILE_CORR_SAMPLE_ROWS
+        if sampled:
+            subset = subset.take(np.linspace(0, rows - 1, PROFILE_CORR_SAMPLE_ROWS).astype(int))
+        matrix = subset.to_pandas().astype(float).corr()
+        correlation = {
+            'columns': corr_columns,
+            'matrix': [[json_number(round(v, 4)) for v in row] for row in matrix.to_numpy()],
+            'sampled_rows': subset.num_rows if sampled else None
+        }
+
+    return {
+        'rows': rows,
+        'column_count': len(columns),
+        'columns': columns,
+        'correlation': correlation,
+        'datetime_columns': [name for name, stats in columns.items() if stats['kind'] == 'datetime']
+    }
+
+def profile_columnar_file(file_path):
+    source = pa.memory_map(file_path, 'r')
+    return compute_dataset_profile(pa.ipc.open_file(source).read_all())
+
+def get_dataset_profile(csv_record, df=None, db=None):
+    """The upload's stored profile; older uploads are profiled on first use and backfilled when db is given"""
+    if csv_record.profile:
+        return json.loads(csv_record.profile)
+    if csv_record.columnar_path and os.path.exists(csv_record.columnar_path):
+        profile = profile_columnar_file(csv_record.columnar_path)
+    elif df is not None:
+        profile = compute_dataset_profile(pa.Table.from_pandas(df, preserve_index=False))
+    else:
+        return None
+    if db is not None:
+        csv_record.profile = json.dumps(profile)
+        db.commit()
+    return profile
+
+def profile_context(profile, max_columns=40):
+    """Compact per-column summary of a profile for LLM prompts"""
+    lines = []
+    for name, stats in list(profile['columns'].items())[:max_columns]:
+        nulls = f", {stats['nulls']} nulls" if stats['nulls'] else ""
+        if stats['kind'] == 'numeric' and stats.get('mean') is not None:
+            detail = f"range {stats['min']}..{stats['max']}, mean {stats['mean']:.4g}, median {stats['median']:.4g}"
+        elif stats['kind'] == 'datetime':
+            detail = f"dates {stats.get('min')} to {stats.get('max')}"
+        elif stats.get('top_values'):
+            top = ", ".join(f"{value} ({count})" for value, count in stats['top_values'][:5])
+            detail = f"{stats['unique']} unique, top: {top}"
+        else:
+            detail = f"{stats['unique']} unique"
+        lines.append(f"- {name} ({stats['dtype']}, {stats['kind']}): {detail}{nulls}")
+    correlation = profile.get('correlation')
+    if correlation:
+        cols = correlation['columns']
+        pairs = [
+            (abs(r), cols[i], cols[j], r)
+            for i, row in enumerate(correlation['matrix'])
+            for j, r in enumerate(row)
+            if j > i and r is not None
+        ]
+        strongest = sorted(pairs, reverse=True)[:5]
+        if strongest:
+            lines.append("Strongest correlations: " + ", ".join(f"{a}~{b} {r:+.2f}" for _, a, b, r in strongest))
+    if profile.get('datetime_columns'):
+        lines.append(f"Datetime columns: {', '.join(profile['datetime_columns'])}")
+    return "\n".join(lines)
+
+# ============================================================================
+# PARSED DATAFRAME CACHE
+# ============================================================================
+
+DATAFRAME_CACHE_MAX_BYTES = int(os.getenv("DATAFRAME_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+dataframe_cache = BoundedLRUCache(DATAFRAME_CACHE_MAX_BYTES, sizeof=dataframe_nbytes)
+
+def get_csv_dataframe(csv_record, db=None):
+    """Return the parsed DataFrame for an UploadedCSV row.
+
+    Served from the cache when possible, otherwise memory-mapped from the Arrow
+    copy. Uploads that predate the columnar store are parsed from CSV once and,
+    when a db session is given, backfilled with an Arrow copy.
+    """
+    df = dataframe_cache.get(csv_record.id)
+    if df is not None:
+        print(f"📦 [DataFrame Cache] Hit for CSV {csv_record.id}")
+        return df
+    if csv_record.columnar_path and os.path.exists(csv_record.columnar_path):
+        df = read_columnar_file(csv_record.columnar_path)
+    else:
+        dialect = json.loads(csv_record.csv_dialect) if csv_record.csv_dialect else None
+        df = load_csv_file(csv_record.file_path, dialect)
+        if df is not None and db is not None and csv_record.table_name:
+            columnar_path = save_columnar_copy(df, csv_record.table_name)
+            if columnar_path:
+                csv_record.columnar_path = columnar_path
+                db.commit()
+    if df is not None:
+        dataframe_cache.put(csv_record.id, df, tag=(csv_record.user_id, csv_record.session_id))
+    return df
+
+# ============================================================================
+# SHARED DATASET STORE
+# ============================================================================
+
+# Only frames without an Arrow copy are published here
+SHARED_DATASET_MAX_BYTES = int(os.getenv("SHARED_DATASET_MAX_MB", "512")) * 1024 * 1024
+
+_shared_block_counter = itertools.count()
+
+def release_shared_block(csv_id, block):
+    """Close and unlink a block; workers that still have it attached keep their mapping"""
+    try:
+        block.close()
+        block.unlink()
+    except (FileNotFoundError, BufferError):
+        pass
+
+# UploadedCSV.id -> SharedMemory holding an Arrow IPC file of the parsed frame
+shared_datasets = BoundedLRUCache(SHARED_DATASET_MAX_BYTES, sizeof=lambda block: block.size, on_evict=release_shared_block)
+
+def write_shared_dataset(df, csv_id):
+    """Serialize a DataFrame as Arrow IPC directly into a new shared memory block"""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    def write(sink):
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+    measure = pa.MockOutputStream()
+    write(measure)
+    # Short names: macOS caps POSIX shared memory names at 31 characters
+    name = f"nh{os.getpid()}_{csv_id}_{next(_shared_block_counter)}"
+    block = shared_memory.SharedMemory(name=name, create=True, size=max(measure.size(), 1))
+    try:
+        write(pa.FixedSizeBufferWriter(pa.py_buffer(block.buf)))
+    except Exception:
+        release_shared_block(csv_id, block)
+        raise
+    return block
+
+def shared_dataset_ref(csv_record, df):
+    """Dataset reference for an analysis job.
+
+    Uploads with an Arrow copy are passed by path: workers memory-map the file,
+    so every process shares the one copy in the page cache. Only frames without
+    a file are published to shared memory, once per upload, so that concurrent
+    analyses attach one block instead of each receiving a pickled frame.
+    """
+    ref = {'csv_id': csv_record.id}
+    if csv_record.columnar_path and os.path.exists(csv_record.columnar_path):
+        ref['columnar_path'] = os.path.abspath(csv_record.columnar_path)
+        ref['version'] = os.stat(csv_record.columnar_path).st_mtime_ns
+        return ref
+    block = shared_datasets.get(csv_record.id)
+    if block is None:
+        try:
+            block = write_shared_dataset(df, csv_record.id)
+        except Exception as e:
+            print(f"⚠️  [Shared Datasets] Could not publish CSV {csv_record.id}: {e}")
+            block = None
+        if block is not None and shared_datasets.put(csv_record.id, block, tag=(csv_record.user_id, csv_record.session_id)):
+            print(f"🧠 [Shared Datasets] Published CSV {csv_record.id} as {block.name} ({block.size} bytes)")
+        else:
+            block = None
+    if block is not None:
+        ref['shm_name'] = block.name
+    else:
+        ref['frame'] = df
+    return ref
+
+@app.on_event("shutdown")
+def release_shared_datasets():
+    shared_datasets.clear()
+
+# ============================================================================
+# DOCUMENT RETRIEVAL INDEX
+# ============================================================================
+
+EMBED_MODEL = os.getenv("EMBED_MODEL", "nomic-embed-text:latest")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT", "120"))
+# nomic-embed-text expects these task prefixes on documents and queries
+EMBED_DOCUMENT_PREFIX = "search_document: "
+EMBED_QUERY_PREFIX = "search_query: "
+DOC_CHUNK_CHARS = int(os.getenv("DOC_CHUNK_CHARS", "1200"))
+DOC_CHUNK_OVERLAP = int(os.getenv("DOC_CHUNK_OVERLAP", "200"))
+DOC_TOP_K = int(os.getenv("DOC_TOP_K", "6"))
+DOC_INDEX_CACHE_MAX_BYTES = int(os.getenv("DOC_INDEX_CACHE_MAX_MB", "256")) * 1024 * 1024
+# After a failed embedding run, the document is not retried for this long
+DOC_INDEX_RETRY_SECONDS = float(os.getenv("DOC_INDEX_RETRY_SECONDS", "60"))
+WORD_RE = re.compile(r"\w{3,}")
+
+_embed_client = None
+
+def get_embed_client():
+    """Process-wide blocking Ollama client for embeddings, used from sync endpoints"""
+    global _embed_client
+    if _embed_client is None or _embed_client.is_closed:
+        _embed_client = httpx.Client(base_url=OLLAMA_BASE_URL, timeout=ollama_timeout(EMBED_TIMEOUT))
+    return _embed_client
+
+@app.on_event("shutdown")
+def close_embed_client():
+    global _embed_client
+    if _embed_client is not None and not _embed_client.is_closed:
+        _embed_client.close()
+    _embed_client = None
+
+def chunk_document_text(text, size=DOC_CHUNK_CHARS, overlap=DOC_CHUNK_OVERLAP):
+    """Split text into overlapping chunks, breaking at paragraph, sentence or word boundaries"""
+    text = re.sub(r"[ \t]+", " ", text or "").strip()
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            for sep in ("\n\n", ". ", "\n", " "):
+                cut = text.rfind(sep, start + size // 2, end)
+                if cut != -1:
+                    end = cut + len(sep)
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        # Step back for the overlap, then forward to the next word start
+        start = max(end - overlap, start + 1)
+        space = text.find(" ", start, end)
+        if space != -1:
+            start = space + 1
+    return chunks
+
+def embed_texts(texts, prefix):
+    """Embed texts with EMBED_MODEL; returns a float32 matrix of unit-length rows"""
+    client = get_embed_client()
+    vectors = []
+    for i in range(0, len(texts), EMBED_BATCH_SIZE):
+        batch = [prefix + text for text in texts[i:i + EMBED_BATCH_SIZE]]
+        response = client.post("/api/embed", json={"model": EMBED_MODEL, "input": batch})
+        response.raise_for_status()
+        vectors.extend(response.json()["embeddings"])
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+def document_index_nbytes(index):
+    vectors, chunks = index
+    return vectors.nbytes + chunks.nbytes
 
-@app.get("/list-tables")
-def list_uploaded_tables(current_user: User = Depends(get_current_user)):
-    engine = get_database_engine()
-    inspector = inspect(engine)
-    tables = inspector.get_table_names()
-    if not tables:
-        raise HTTPException(status_code=404, detail="No tables found in the database.")
-    return {"tables": tables}
+document_index_cache = BoundedLRUCache(DOC_INDEX_CACHE_MAX_BYTES, sizeof=document_index_nbytes)
+# doc.id -> time of the last failed build, so an unreachable embed model
+# isn't re-tried on every question
+_index_failures = {}
+# doc.id -> Future of the build in progress, shared by concurrent callers
+_index_builds = {}
+_index_lock = threading.Lock()
 
-@app.get("/describe-table")
-def describe_table(
-    table_name: str = Query(..., description="Name of the table to describe"),
-    current_user: User = Depends(get_current_user)
-):
-    engine = get_database_engine()
-    inspector = inspect(engine)
-    columns = inspector.get_columns(table_name)
-    if not columns:
-        raise HTTPException(status_code=404, detail=f"Table '{table_name}' not found.")
-    return {
-        "table": table_name,
-        "columns": [
-            {"name": col["name"], "type": str(col["type"]), "nullable": col["nullable"]}
-            for col in columns
-        ]
-    }
-@app.post("/execute-sql")
-def execute_sql(
-    query: str = Query(..., description="SQL query to execute (SELECT only)"),
-    current_user: User = Depends(get_current_user)
-):
-    if not query.strip().lower().startswith("select"):
-        raise HTTPException(status_code=400, detail="Only SELECT queries are allowed for safety.")
+def build_document_index(doc, db=None):
+    """Chunk and embed a document's text into DOC_INDEX_DIR; returns the index or None.
 
-    engine = get_database_engine()
+    Concurrent calls for the same document share one build. A failed build is
+    remembered for DOC_INDEX_RETRY_SECONDS; until then the document returns
+    None straight away and callers fall back to keyword ranking.
+    """
+    with _index_lock:
+        failed_at = _index_failures.get(doc.id)
+        if failed_at is not None and time.time() - failed_at < DOC_INDEX_RETRY_SECONDS:
+            return None
+        future = _index_builds.get(doc.id)
+        leader = future is None
+        if leader:
+            future = _index_builds[doc.id] = Future()
+    if not leader:
+        try:
+            return future.result(timeout=EMBED_TIMEOUT)
+        except Exception:
+            return None
+    index = None
+    try:
+        index = _build_document_index(doc, db)
+    finally:
+        with _index_lock:
+            _index_builds.pop(doc.id, None)
+        future.set_result(index)
+    return index
+
+def _build_document_index(doc, db):
+    chunks = chunk_document_text(doc.extracted_text)
+    if not chunks:
+        return None
     try:
-        df = pd.read_sql_query(query, engine)
-        records = df.head(50).to_dict(orient="records")  # Limit rows for performance
-        return {"success": True, "row_count": len(df), "columns": list(df.columns), "data": records}
+        started = time.time()
+        vectors = embed_texts(chunks, EMBED_DOCUMENT_PREFIX)
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"SQL execution error: {str(e)}")
-    
+        with _index_lock:
+            _index_failures[doc.id] = time.time()
+        print(f"⚠️ [Doc Index] Could not embed {doc.filename}, retrying in {DOC_INDEX_RETRY_SECONDS:.0f}s: {e}")
+        return None
+    with _index_lock:
+        _index_failures.pop(doc.id, None)
+    index = (vectors, np.array(chunks))
+    index_path = os.path.join(DOC_INDEX_DIR, f"{doc.id}.npz")
+    np.savez(index_path, vectors=vectors, chunks=index[1], model=np.array(EMBED_MODEL))
+    print(f"🧭 [Doc Index] Embedded {len(chunks)} chunks of {doc.filename} in {time.time() - started:.2f}s")
+    if db is not None:
+        doc.index_path = index_path
+        db.commit()
+    document_index_cache.put(doc.id, index, tag=(doc.user_id, doc.session_id))
+    return index
 
-def load_csv_file(file_path):
-    """Load CSV file with multiple fallback methods"""
-    import chardet
-    
-    # Read the file content first to detect encoding
-    with open(file_path, 'rb') as f:
-        raw_content = f.read()
-    
-    # Try to detect encoding
+def get_document_index(doc, db=None):
+    """(vectors, chunks) for a document; documents indexed under another model are rebuilt"""
+    index = document_index_cache.get(doc.id)
+    if index is not None:
+        return index
+    if doc.index_path and os.path.exists(doc.index_path):
+        with np.load(doc.index_path) as stored:
+            if str(stored["model"]) == EMBED_MODEL:
+                index = (stored["vectors"], stored["chunks"])
+        if index is not None:
+            document_index_cache.put(doc.id, index, tag=(doc.user_id, doc.session_id))
+            return index
+    return build_document_index(doc, db)
+
+def index_uploaded_documents(doc_ids):
+    """Background task for /upload: embed newly uploaded documents after the response is sent"""
+    db = SessionLocal()
     try:
-        detected_enc = chardet.detect(raw_content)['encoding']
-        print(f"Detected encoding: {detected_enc}")
-        if detected_enc is None:
-            detected_enc = 'utf-8'
+        for doc in db.query(UploadedDocument).filter(UploadedDocument.id.in_(doc_ids)).all():
+            get_document_index(doc, db)
     except Exception as e:
-        print(f"Error detecting encoding: {str(e)}")
-        detected_enc = 'utf-8'
-    
-    # Try different methods to read the file
-    methods = [
-        (lambda: pd.read_csv(file_path, encoding=detected_enc), f"detected encoding ({detected_enc})"),
-        (lambda: pd.read_csv(file_path, encoding='utf-8'), "utf-8"),
-        (lambda: pd.read_csv(file_path, encoding='latin1'), "latin1"),
-        (lambda: pd.read_csv(file_path, encoding='cp1252'), "cp1252"),
-        (lambda: pd.read_csv(file_path, encoding='iso-8859-1'), "iso-8859-1"),
-        (lambda: pd.read_csv(file_path, sep=';', encoding=detected_enc), f"semicolon separator, {detected_enc}"),
-        (lambda: pd.read_csv(file_path, sep='\t', encoding=detected_enc), f"tab separator, {detected_enc}"),
-        # Additional fallback methods for problematic files
-        (lambda: pd.read_csv(file_path, encoding=detected_enc, on_bad_lines='skip'), f"skip bad lines, {detected_enc}"),
-        (lambda: pd.read_csv(file_path, encoding=detected_enc, engine='python'), f"python engine, {detected_enc}"),
-        (lambda: pd.read_csv(file_path, encoding=detected_enc, delimiter=None), f"auto delimiter, {detected_enc}")
-    ]
-    
-    errors = []
-    for method, description in methods:
-        try:
-            print(f"Trying to read CSV with {description}")
-            df = method()
-            if df is not None and not df.empty:
-                print(f"Successfully read CSV with {description}")
-                print(f"DataFrame shape: {df.shape}")
-                print(f"Columns: {df.columns.tolist()}")
-                
-                # Clean column names
-                df.columns = df.columns.str.strip()
-                for col in df.columns:
-                    try:
-                        df[col] = df[col].replace(',', '', regex=True).astype(float)
-                    except Exception:
-                        pass  # ignore non-numeric columns
+        print(f"⚠️ [Doc Index] Background indexing failed: {e}")
+    finally:
+        db.close()
+
+def keyword_scores(chunks, question):
+    """Share of the question's words found in each chunk, used when embeddings are unavailable"""
+    terms = set(WORD_RE.findall(question.lower()))
+    if not terms:
+        return np.zeros(len(chunks), dtype=np.float32)
+    return np.array([len(terms & set(WORD_RE.findall(str(chunk).lower()))) / len(terms) for chunk in chunks], dtype=np.float32)
 
-                print(f"Converted dtypes:\n{df.dtypes}")
-                return df
+def retrieve_document_excerpts(docs, question, db=None, top_k=DOC_TOP_K):
+    """The top_k chunks across a session's documents most relevant to the question, best first.
 
+    Returns (upload order, chunk position, excerpt text) tuples.
+
+    Chunks are ranked by cosine similarity to the embedded question. Documents
+    uploaded before the index existed are embedded on first use. If embeddings
+    can't be computed, chunks are ranked by keyword overlap instead, so the
+    context stays bounded either way.
+    """
+    started = time.time()
+    indexes = [(doc, get_document_index(doc, db)) for doc in docs if doc.extracted_text]
+    query = None
+    if indexes and all(index is not None for _, index in indexes):
+        try:
+            query = embed_texts([question], EMBED_QUERY_PREFIX)[0]
         except Exception as e:
-            error_msg = f"Method '{description}' failed: {str(e)}"
-            print(error_msg)
-            errors.append(error_msg)
+            print(f"⚠️ [Doc Index] Could not embed question, using keyword ranking: {e}")
+
+    candidates = []  # (score, upload order, chunk position, filename, text)
+    for order, (doc, index) in enumerate(indexes):
+        chunks = index[1] if index is not None else np.array(chunk_document_text(doc.extracted_text))
+        if len(chunks) == 0:
             continue
-    
-    # If we get here, all methods failed
-    error_details = "\n".join(errors)
-    print(f"All methods failed to read the CSV file. Errors:\n{error_details}")
-    return None
+        scores = index[0] @ query if query is not None else keyword_scores(chunks, question)
+        best = np.argsort(scores)[::-1][:top_k]
+        candidates.extend((float(scores[i]), order, int(i), doc.filename, str(chunks[i])) for i in best)
+
+    selected = sorted(candidates, key=lambda c: c[0], reverse=True)[:top_k]
+    excerpts = [
+        (order, position, f"[Excerpt: {filename}, part {position + 1}]\n{text}\n[Excerpt End]\n")
+        for _, order, position, filename, text in selected
+    ]
+    if selected:
+        method = "semantic" if query is not None else "keyword"
+        print(f"🧭 [Doc Index] Picked {len(selected)} of {len(candidates)} candidate chunks from {len(indexes)} documents ({method}, {time.time() - started:.2f}s)")
+    return excerpts
+
+def format_document_excerpts(excerpts):
+    """Join excerpts in reading order so neighbouring chunks stay coherent"""
+    return "".join(text for _, _, text in sorted(excerpts, key=lambda e: (e[0], e[1])))
+
+# ============================================================================
+# PROMPT BUDGET
+# ============================================================================
+
+# Context window requested from Ollama per model; prompts are assembled to fit inside it
+PROMPT_CONTEXT_TOKENS = int(os.getenv("PROMPT_CONTEXT_TOKENS", "4096"))
+MODEL_CONTEXT_TOKENS = {
+    'qwen:0.5b': 2048,
+    'qwen3:0.6b': 2048,
+    'llama3.2:1b': 2048,
+    'deepseek-coder:1.3b': 2048,
+    'anindya/prem1b-sql-ollama-fp116:latest': 2048,
+}
+ASK_MAX_OUTPUT_TOKENS = 256
+PROMPT_OVERHEAD_TOKENS = 64  # Section markers and separators around the context
+MIN_TRUNCATED_ITEM_TOKENS = 48  # Smaller leftovers are dropped rather than cut to a stub
+# Share of the context budget each source is guaranteed, in priority order; unused room goes to the next in line
+PROMPT_SOURCE_SHARES = (("documents", 0.5), ("search", 0.3), ("history", 0.2))
+TOKEN_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+def estimate_tokens(text):
+    """Fast token estimate: one per word or symbol, plus one per extra six letters of long words"""
+    return sum(1 + len(piece) // 6 for piece in TOKEN_PIECE_RE.findall(text))
+
+def model_context_tokens(model):
+    return MODEL_CONTEXT_TOKENS.get(model, PROMPT_CONTEXT_TOKENS)
+
+def truncate_to_tokens(text, max_tokens):
+    """Shorten text to about max_tokens, ending at a sentence or word boundary"""
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    cut = text[:int(len(text) * max_tokens / tokens)]
+    while cut and estimate_tokens(cut) > max_tokens:
+        cut = cut[:int(len(cut) * 0.9)]
+    for sep in (". ", "\n", " "):
+        boundary = cut.rfind(sep, len(cut) // 2)
+        if boundary != -1:
+            cut = cut[:boundary + len(sep)]
+            break
+    return cut.rstrip() + " ...\n"
+
+def fit_items(items, budget):
+    """Keep items in order while they fit; the first one that doesn't is truncated if there is room for it"""
+    kept, used = [], 0
+    for item in items:
+        cost = estimate_tokens(item)
+        if used + cost <= budget:
+            kept.append(item)
+            used += cost
+            continue
+        if budget - used >= MIN_TRUNCATED_ITEM_TOKENS:
+            item = truncate_to_tokens(item, budget - used)
+            kept.append(item)
+            used += estimate_tokens(item)
+        break
+    return kept, used
+
+def budget_prompt_sources(model, instructions, sources, max_output_tokens=ASK_MAX_OUTPUT_TOKENS):
+    """Fit context sources into the model's context window.
+
+    sources maps each name in PROMPT_SOURCE_SHARES to a list of text items,
+    most important first. Returns the kept items per source and a breakdown
+    of the token budget, which is also logged.
+    """
+    context_tokens = model_context_tokens(model)
+    instruction_tokens = estimate_tokens(instructions)
+    available = max(0, context_tokens - max_output_tokens - instruction_tokens - PROMPT_OVERHEAD_TOKENS)
+    needed = {name: sum(estimate_tokens(item) for item in sources.get(name, [])) for name, _ in PROMPT_SOURCE_SHARES}
+
+    allocation = {name: min(needed[name], int(available * share)) for name, share in PROMPT_SOURCE_SHARES}
+    spare = available - sum(allocation.values())
+    for name, _ in PROMPT_SOURCE_SHARES:
+        extra = min(needed[name] - allocation[name], spare)
+        allocation[name] += extra
+        spare -= extra
+
+    kept = {}
+    breakdown = {"model": model, "context": context_tokens, "output": max_output_tokens, "instructions": instruction_tokens, "sources": {}}
+    for name, _ in PROMPT_SOURCE_SHARES:
+        items = sources.get(name, [])
+        kept[name], used = fit_items(items, allocation[name])
+        breakdown["sources"][name] = {"needed": needed[name], "allocated": allocation[name], "used": used, "items": f"{len(kept[name])}/{len(items)}"}
+    breakdown["prompt"] = instruction_tokens + PROMPT_OVERHEAD_TOKENS + sum(src["used"] for src in breakdown["sources"].values())
+
+    parts = ", ".join(f"{name} {src['used']}/{src['needed']} ({src['items']} items)" for name, src in breakdown["sources"].items())
+    print(f"🧮 [Prompt Budget] {model}: ~{breakdown['prompt']} of {context_tokens} tokens ({max_output_tokens} kept for output) - {parts}")
+    return kept, breakdown
 
 # ============================================================================
 # EXISTING ENDPOINTS
@@ -796,29 +3095,131 @@ def debug_api_keys():
         "environment_variable_name": "OPENROUTER_API_KEYS"
     }
 
+# ✅ Cache statistics endpoint
+@app.get("/debug/cache-stats")
+def debug_cache_stats():
+    """Hit/miss counters and memory use of the in-process caches"""
+    return {
+        "dataframe_cache": dataframe_cache.stats(),
+        "sql_result_cache": sql_result_cache.stats(),
+        "worker_sql_cache": worker_sql_cache_stats(),
+        "shared_datasets": shared_datasets.stats(),
+        "analysis_result_cache": analysis_result_cache.stats(),
+        "document_index_cache": document_index_cache.stats(),
+        "searxng_cache": searxng_cache.stats()
+    }
+
+# ✅ Analysis worker pool statistics endpoint
+@app.get("/debug/analysis-workers")
+def debug_analysis_workers():
+    """Job, timeout, crash and CPU counters for the analysis worker pool"""
+    return analysis_pool.stats()
+
+# ✅ CSV parsing statistics endpoint
+@app.get("/debug/csv-stats")
+def debug_csv_stats():
+    """Dialect sniffing and parse-attempt counters for CSV loading"""
+    with _csv_parse_stats_lock:
+        return dict(csv_parse_stats)
+
 # ✅ Main endpoint to send prompt and receive model response
-@app.post("/ask")
-def ask_model(data: PromptInput, db=Depends(get_db), current_user: User = Depends(get_current_user)):
-    # Fetch last 1 message for context (oldest first)
-    history = db.query(ChatHistory)\
-        .filter(ChatHistory.user_id == current_user.id, ChatHistory.session_id == data.session_id)\
-        .order_by(ChatHistory.timestamp.desc())\
-        .limit(1).all()
+# ============================================================================
+# SEARCH RESULT CACHE
+# ============================================================================
+
+SEARXNG_CACHE_TTL = float(os.getenv("SEARXNG_CACHE_TTL", "300"))
+SEARXNG_CACHE_STALE = float(os.getenv("SEARXNG_CACHE_STALE", "1800"))
+SEARXNG_CACHE_MAX_ENTRIES = int(os.getenv("SEARXNG_CACHE_MAX_ENTRIES", "1000"))
+
+SEARXNG_POOL_MAX_CONNECTIONS = int(os.getenv("SEARXNG_POOL_MAX_CONNECTIONS", "20"))
+
+searxng_cache = CoalescingTTLCache(SEARXNG_CACHE_MAX_ENTRIES, SEARXNG_CACHE_TTL, SEARXNG_CACHE_STALE)
+
+_searxng_session = None
+
+def get_searxng_session():
+    """Process-wide requests session, so SearxNG lookups from any thread reuse pooled connections"""
+    global _searxng_session
+    if _searxng_session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=SEARXNG_POOL_MAX_CONNECTIONS)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _searxng_session = session
+    return _searxng_session
+
+@app.on_event("shutdown")
+def close_searxng_session():
+    global _searxng_session
+    if _searxng_session is not None:
+        _searxng_session.close()
+    _searxng_session = None
+
+def normalize_search_query(query):
+    return " ".join(query.lower().split())
+
+def searxng_results(searxng_url, query, timeout):
+    """Raw SearxNG results for a query, shared between identical queries from any user.
+
+    Only the cache key is normalized; SearxNG gets the query as the caller
+    wrote it. Raises on HTTP or parse errors, which are not cached.
+    """
+    def fetch():
+        params = {
+            "q": query,
+            "format": "json",
+            "categories": "general",
+            "engines": "google,bing,duckduckgo",
+            "pageno": 1
+        }
+        response = get_searxng_session().get(searxng_url, params=params, timeout=timeout)
+        response.raise_for_status()
+        return response.json().get("results", [])
+
+    return searxng_cache.get_or_fetch((searxng_url, normalize_search_query(query)), fetch, timeout=timeout)
 
-    context = ""
-    for msg in reversed(history):
-        context += f"User: {msg.prompt}\nAI: {msg.response}\n"
+# ============================================================================
+# ASK CONTEXT GATHERING
+# ============================================================================
+
+# Context sources that haven't answered by then are left out rather than delaying the model
+ASK_CONTEXT_DEADLINE = float(os.getenv("ASK_CONTEXT_DEADLINE", "3"))
+# Context sources get their own threads so slow ones can't starve the default pool
+ASK_CONTEXT_WORKERS = int(os.getenv("ASK_CONTEXT_WORKERS", "12"))
+ask_context_executor = ThreadPoolExecutor(max_workers=ASK_CONTEXT_WORKERS, thread_name_prefix="ask-context")
+
+@app.on_event("shutdown")
+def shutdown_ask_context_executor():
+    ask_context_executor.shutdown(wait=False, cancel_futures=True)
 
-    # Fetch all extracted PDF texts for this session and user (in upload order)
-    docs = db.query(UploadedDocument).filter(UploadedDocument.user_id == current_user.id, UploadedDocument.session_id == data.session_id, UploadedDocument.extracted_text != None).order_by(UploadedDocument.timestamp.asc()).all()
+def load_history_items(user_id, session_id):
+    """Recent chat turns for the session, most recent first so older turns are the first to go when the budget is tight"""
+    db = SessionLocal()
+    try:
+        # Fetch last 1 message for context
+        history = db.query(ChatHistory)\
+            .filter(ChatHistory.user_id == user_id, ChatHistory.session_id == session_id)\
+            .order_by(ChatHistory.timestamp.desc())\
+            .limit(1).all()
+        return [f"User: {msg.prompt}\nAI: {msg.response}\n" for msg in history]
+    finally:
+        db.close()
 
-    pdf_context = ""
-    for idx, doc in enumerate(docs):
-        if doc.extracted_text:
-            pdf_context += f"[PDF {idx+1} Content Start: {doc.filename}]\n{doc.extracted_text}\n[PDF {idx+1} Content End]\n"
+def load_document_excerpts(user_id, session_id, question):
+    """Only the document chunks relevant to this question, so the prompt stays the same size as documents pile up"""
+    db = SessionLocal()
+    try:
+        # Fetch all extracted PDF texts for this session and user (in upload order)
+        docs = db.query(UploadedDocument).filter(UploadedDocument.user_id == user_id, UploadedDocument.session_id == session_id, UploadedDocument.extracted_text != None).order_by(UploadedDocument.timestamp.asc()).all()
+        return retrieve_document_excerpts(docs, question, db)
+    finally:
+        db.close()
 
+def search_context_items(question, timeout=10):
+    """Top SearxNG results for the question as prompt items, plus metadata describing the search"""
     # NEW: Search SearxNG for relevant information with comprehensive validation
     searxng_context = ""
+    search_items = []
     search_metadata = {
         "search_attempted": True,
         "search_successful": False,
@@ -828,89 +3229,72 @@ def ask_model(data: PromptInput, db=Depends(get_db), current_user: User = Depend
     }
     
     try:
-        print(f"🔍 [SearxNG] Attempting search for: {data.prompt[:50]}...")
+        print(f"🔍 [SearxNG] Attempting search for: {question[:50]}...")
         searxng_url = "https://search.hbubli.cc/"  # Using local SearxNG instance
-        params = {
-            "q": data.prompt,
-            "format": "json",
-            "categories": "general",
-            "engines": "google,bing,duckduckgo",
-            "pageno": 1
-        }
+        # Identical queries are answered from the cache, or share one in-flight request
+        search_results = searxng_results(searxng_url, question, timeout=timeout)
+        total_results = len(search_results)
+        print(f"📊 [SearxNG] Found {total_results} total results")
         
-        search_response = requests.get(searxng_url, params=params, timeout=10)
-        
-        # Check HTTP response status
-        if not search_response.ok:
-            error_msg = f"HTTP {search_response.status_code}: {search_response.text[:200]}"
-            print(f"❌ [SearxNG] Request failed: {error_msg}")
-            search_metadata["error"] = error_msg
+        if total_results == 0:
+            print(f"⚠️  [SearxNG] No search results returned for query")
+            search_metadata["error"] = "No results found"
         else:
-            print(f"✅ [SearxNG] Request successful (HTTP {search_response.status_code})")
-            
-            # Parse JSON response
-            try:
-                search_data = search_response.json()
-                print(f"📦 [SearxNG] JSON parsed successfully")
-            except Exception as json_err:
-                error_msg = f"JSON parse error: {str(json_err)}"
-                print(f"❌ [SearxNG] {error_msg}")
-                search_metadata["error"] = error_msg
-                raise
-            
-            # Extract and validate results
-            search_results = search_data.get("results", [])
-            total_results = len(search_results)
-            print(f"📊 [SearxNG] Found {total_results} total results")
-            
-            if total_results == 0:
-                print(f"⚠️  [SearxNG] No search results returned for query")
-                search_metadata["error"] = "No results found"
-            else:
-                # Limit to top 5 results
-                search_results = search_results[:5]
-                search_metadata["results_count"] = len(search_results)
+            # Limit to top 5 results
+            search_results = search_results[:5]
+            search_metadata["results_count"] = len(search_results)
                 
-                # Build context with validation
-                searxng_context = "\n[SEARCH RESULTS START]\n"
-                valid_results = 0
+            # Build context with validation
+            searxng_context = "\n[SEARCH RESULTS START]\n"
+            valid_results = 0
                 
-                for idx, result in enumerate(search_results, 1):
-                    title = result.get("title", "").strip()
-                    content = result.get("content", "").strip()
-                    url = result.get("url", "").strip()
+            for idx, result in enumerate(search_results, 1):
+                title = result.get("title", "").strip()
+                content = result.get("content", "").strip()
+                url = result.get("url", "").strip()
                     
-                    # Validate that we have actual content
-                    if not title and not content:
-                        print(f"⚠️  [SearxNG] Result {idx} has no title or content, skipping")
-                        continue
+                # Validate that we have actual content
+                if not title and not content:
+                    print(f"⚠️  [SearxNG] Result {idx} has no title or content, skipping")
+                    continue
                     
-                    # Use defaults only if specific fields are missing
-                    title = title if title else "No title"
-                    content = content if content else "No content available"
-                    url = url if url else "No URL"
+                # Use defaults only if specific fields are missing
+                title = title if title else "No title"
+                content = content if content else "No content available"
+                url = url if url else "No URL"
                     
-                    searxng_context += f"Source {idx}: {title}\nURL: {url}\nContent: {content}\n\n"
-                    valid_results += 1
+                search_item = f"Source {idx}: {title}\nURL: {url}\nContent: {content}\n\n"
+                searxng_context += search_item
+                search_items.append(search_item)
+                valid_results += 1
                 
-                searxng_context += "[SEARCH RESULTS END]\n\n"
+            searxng_context += "[SEARCH RESULTS END]\n\n"
                 
-                # Validate final context
-                search_metadata["content_length"] = len(searxng_context)
+            # Validate final context
+            search_metadata["content_length"] = len(searxng_context)
                 
-                if valid_results == 0:
-                    print(f"❌ [SearxNG] All results were empty, discarding context")
-                    searxng_context = ""
-                    search_metadata["error"] = "All results empty"
-                elif search_metadata["content_length"] < 100:
-                    print(f"⚠️  [SearxNG] Context very short ({search_metadata['content_length']} chars)")
-                else:
-                    search_metadata["search_successful"] = True
-                    print(f"✅ [SearxNG] Successfully extracted {valid_results} valid results ({search_metadata['content_length']} chars)")
-                    print(f"📝 [SearxNG] Context preview: {searxng_context[:200]}...")
+            if valid_results == 0:
+                print(f"❌ [SearxNG] All results were empty, discarding context")
+                searxng_context = ""
+                search_items = []
+                search_metadata["error"] = "All results empty"
+            elif search_metadata["content_length"] < 100:
+                print(f"⚠️  [SearxNG] Context very short ({search_metadata['content_length']} chars)")
+            else:
+                search_metadata["search_successful"] = True
+                print(f"✅ [SearxNG] Successfully extracted {valid_results} valid results ({search_metadata['content_length']} chars)")
+                print(f"📝 [SearxNG] Context preview: {searxng_context[:200]}...")
                     
+    except requests.exceptions.HTTPError as e:
+        error_msg = f"HTTP {e.response.status_code}: {e.response.text[:200]}"
+        print(f"❌ [SearxNG] Request failed: {error_msg}")
+        search_metadata["error"] = error_msg
+    except ValueError as e:
+        error_msg = f"JSON parse error: {str(e)}"
+        print(f"❌ [SearxNG] {error_msg}")
+        search_metadata["error"] = error_msg
     except requests.exceptions.Timeout:
-        error_msg = "Request timeout (10s exceeded)"
+        error_msg = f"Request timeout ({timeout:g}s exceeded)"
         print(f"❌ [SearxNG] {error_msg}")
         search_metadata["error"] = error_msg
     except requests.exceptions.ConnectionError as e:
@@ -928,48 +3312,113 @@ def ask_model(data: PromptInput, db=Depends(get_db), current_user: User = Depend
     else:
         print(f"⚠️  [SearxNG] Search failed or produced no usable content: {search_metadata}")
 
-    # Combine all contexts with validation logging
-    full_prompt = ""
-    context_sources = []
+    return search_items, search_metadata
+
+async def gather_ask_context(user_id, session_id, question, deadline=ASK_CONTEXT_DEADLINE):
+    """Collect chat history, document excerpts and search results concurrently.
+
+    Sources run on ask_context_executor. Sources still running (or failed)
+    when the deadline passes are reported as None and left out of the prompt.
+    The search request itself times out at the deadline, so it doesn't hold a
+    thread much longer. A late document index build keeps running; if it
+    succeeds, later questions use the stored index, and questions asked while
+    it runs wait on the same build instead of starting another.
+    """
+    started = time.time()
+    loop = asyncio.get_running_loop()
+    tasks = {
+        "history": loop.run_in_executor(ask_context_executor, load_history_items, user_id, session_id),
+        "documents": loop.run_in_executor(ask_context_executor, load_document_excerpts, user_id, session_id, question),
+        "search": loop.run_in_executor(ask_context_executor, search_context_items, question, deadline)
+    }
+    done, _ = await asyncio.wait(tasks.values(), timeout=deadline)
+    results = {}
+    for name, task in tasks.items():
+        if task not in done:
+            task.cancel()
+            print(f"⏱️ [Ask Context] Dropped {name}: not ready within {deadline:.1f}s")
+            results[name] = None
+        elif task.exception() is not None:
+            print(f"❌ [Ask Context] {name} failed: {task.exception()}")
+            results[name] = None
+        else:
+            results[name] = task.result()
+    print(f"⏱️ [Ask Context] Gathered {sum(r is not None for r in results.values())}/{len(tasks)} sources in {time.time() - started:.2f}s")
+    return results
+
+@app.post("/ask")
+def ask_model(data: PromptInput, current_user: User = Depends(get_current_user)):
+    if data.model not in ALLOWED_OLLAMA_MODELS:
+        raise HTTPException(status_code=400, detail=f"Model '{data.model}' is not available on this server.")
+    user_id = current_user.id
+
+    async def stream_ollama():
+        # Open the stream right away; context is gathered while the client is already connected
+        yield json.dumps({
+            "type": "status",
+            "message": "Gathering context...",
+            "done": False
+        }) + "\n"
+
+        gathered = await gather_ask_context(user_id, data.session_id, data.prompt)
+        history_items = gathered["history"] or []
+        doc_excerpts = gathered["documents"] or []
+        search_items = gathered["search"][0] if gathered["search"] else []
+
+        # Fit every source into the model's context window before combining them
+        instructions = f"Based on the above search results and context, please answer the following question: {data.prompt}\nAI:"
+        kept, prompt_budget = budget_prompt_sources(data.model, instructions, {
+            "documents": [text for _, _, text in doc_excerpts],
+            "search": search_items,
+            "history": history_items
+        })
+        pdf_context = format_document_excerpts([
+            (order, position, text) for (order, position, _), text in zip(doc_excerpts, kept["documents"])
+        ])
+        searxng_context = f"\n[SEARCH RESULTS START]\n{''.join(kept['search'])}[SEARCH RESULTS END]\n\n" if kept["search"] else ""
+        context = "".join(reversed(kept["history"]))
+
+        # Combine all contexts with validation logging
+        full_prompt = ""
+        context_sources = []
     
-    if pdf_context:
-        full_prompt += pdf_context
-        context_sources.append(f"PDF ({len(pdf_context)} chars)")
-        print(f"📄 [Context] Added PDF context: {len(pdf_context)} characters")
+        if pdf_context:
+            full_prompt += pdf_context
+            context_sources.append(f"PDF ({len(pdf_context)} chars)")
+            print(f"📄 [Context] Added PDF context: {len(pdf_context)} characters")
     
-    if searxng_context:
-        full_prompt += searxng_context
-        context_sources.append(f"SearxNG ({len(searxng_context)} chars)")
-        print(f"🔍 [Context] Added SearxNG context: {len(searxng_context)} characters")
+        if searxng_context:
+            full_prompt += searxng_context
+            context_sources.append(f"SearxNG ({len(searxng_context)} chars)")
+            print(f"🔍 [Context] Added SearxNG context: {len(searxng_context)} characters")
     
-    if context:
-        context_sources.append(f"Chat History ({len(context)} chars)")
-        print(f"💬 [Context] Added chat history: {len(context)} characters")
+        if context:
+            context_sources.append(f"Chat History ({len(context)} chars)")
+            print(f"💬 [Context] Added chat history: {len(context)} characters")
     
-    full_prompt += context + f"Based on the above search results and context, please answer the following question: {data.prompt}\nAI:"
+        full_prompt += context + instructions
     
-    # Log final prompt stats
-    print(f"📊 [LLM Input] Total prompt length: {len(full_prompt)} characters")
-    print(f"📊 [LLM Input] Context sources: {', '.join(context_sources) if context_sources else 'None'}")
-    print(f"📊 [LLM Input] User question: {data.prompt[:100]}...")
+        # Log final prompt stats
+        print(f"📊 [LLM Input] Total prompt length: {len(full_prompt)} characters")
+        print(f"📊 [LLM Input] Context sources: {', '.join(context_sources) if context_sources else 'None'}")
+        print(f"📊 [LLM Input] User question: {data.prompt[:100]}...")
     
-    if not searxng_context and not pdf_context and not context:
-        print(f"⚠️  [LLM Input] Warning: No context provided, LLM will rely only on training data")
-
-    # Use Ollama local API
-    ollama_url = "http://localhost:11434/api/generate"
-    payload = {
-        "model": data.model,
-        "prompt": full_prompt,
-        "stream": True,
-        "num_predict": 256,  # Increased for more detailed responses
-        "temperature": 0.7,
-    }
+        if not searxng_context and not pdf_context and not context:
+            print(f"⚠️  [LLM Input] Warning: No context provided, LLM will rely only on training data")
 
-    if data.model not in ALLOWED_OLLAMA_MODELS:
-        raise HTTPException(status_code=400, detail=f"Model '{data.model}' is not available on this server.")
+        # Use Ollama local API
+        payload = {
+            "model": data.model,
+            "prompt": full_prompt,
+            "stream": True,
+            # Ollama reads sampling settings only from "options"; top-level keys are ignored
+            "options": {
+                "num_predict": ASK_MAX_OUTPUT_TOKENS,
+                "temperature": 0.7,
+                "num_ctx": prompt_budget["context"]
+            }
+        }
 
-    def stream_ollama():
         # First, yield the search results as a separate message
         if searxng_context:
             yield json.dumps({
@@ -979,24 +3428,14 @@ def ask_model(data: PromptInput, db=Depends(get_db), current_user: User = Depend
             }) + "\n"
         
         try:
-            with requests.post(ollama_url, json=payload, stream=True, timeout=600) as response:
-                response.raise_for_status()
-                for line in response.iter_lines():
-                    if line:
-                        try:
-                            chunk = line.decode()
-                            data_json = json.loads(chunk)
-                            resp = data_json.get("response", "")
-                            done = data_json.get("done", False)
-                            yield json.dumps({
-                                "type": "model_response",
-                                "response": resp, 
-                                "done": done
-                            }) + "\n"
-                            if done:
-                                break
-                        except Exception:
-                            continue
+            async for data_json in stream_ollama_generate(payload):
+                resp = data_json.get("response", "")
+                done = data_json.get("done", False)
+                yield json.dumps({
+                    "type": "model_response",
+                    "response": resp, 
+                    "done": done
+                }) + "\n"
             # Ensure the last chunk is sent
             yield json.dumps({"type": "model_response", "done": True}) + "\n"
         except Exception as e:
@@ -1056,73 +3495,52 @@ async def upload_csv(
     print(f"File size: {file.size if hasattr(file, 'size') else 'unknown'}")
     print(f"Content type: {file.content_type}")
     
-    # Save file
+    # Save file in fixed-size chunks so the request body is never held in memory
     try:
-        print("Reading file content...")
-        content = await file.read()
-        if not content:
-            error_msg = "Uploaded file is empty"
-            print(f"Error: {error_msg}")
-            raise HTTPException(status_code=400, detail=error_msg)
-        
-        print(f"Read {len(content)} bytes, writing to {file_path}")
+        print("Streaming file content to disk...")
         
         # Ensure the directory exists
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
         
+        file_size = 0
         with open(file_path, "wb") as buffer:
-            buffer.write(content)
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                buffer.write(chunk)
+                file_size += len(chunk)
         
-        # Verify file was written
-        if not os.path.exists(file_path):
-            error_msg = f"File was not saved to {file_path}"
-            print(f"Error: {error_msg}")
-            raise HTTPException(status_code=500, detail=error_msg)
-            
-        file_size = os.path.getsize(file_path)
         print(f"File saved successfully. Size: {file_size} bytes")
         
         if file_size == 0:
-            error_msg = "Saved file is empty"
+            error_msg = "Uploaded file is empty"
             print(f"Error: {error_msg}")
             os.remove(file_path)  # Clean up empty file
             raise HTTPException(status_code=400, detail=error_msg)
             
+    except HTTPException:
+        raise
     except Exception as e:
         if os.path.exists(file_path):
             os.remove(file_path)
         raise HTTPException(status_code=500, detail=f"Error saving file: {str(e)}")
     
-    # Try to load and analyze the CSV
+    # Parse the CSV in chunks into SQLite and the columnar store
     try:
-        print(f"Attempting to load CSV file: {file_path}")
-        df = load_csv_file(file_path)
-        if df is None or df.empty:
+        print(f"Attempting to ingest CSV file: {file_path}")
+        table_name = f"data_{current_user.id}_{session_id}_{int(time.time())}"
+        columns_info = await run_in_threadpool(ingest_csv_file, file_path, table_name)
+        if columns_info is None:
             if os.path.exists(file_path):
                 os.remove(file_path)
             raise HTTPException(
                 status_code=400, 
                 detail="Could not read CSV file. The file might have an unsupported format or encoding. Please ensure it's a valid CSV file with UTF-8 or similar encoding."
             )
-        
-        # Get basic info about the dataset
-        try:
-            sample_data = df.head(5).to_dict('records') if len(df) > 0 else {}
-            
-            columns_info = {
-                'columns': df.columns.tolist(),
-                'dtypes': df.dtypes.astype(str).to_dict(),
-                'shape': df.shape,
-                'sample_data': sample_data
-            }
-        except Exception as e:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            raise HTTPException(status_code=400, detail=f"Error processing CSV data: {str(e)}")
-        
-        # Store the CSV data in SQLite
-        table_name = f"data_{current_user.id}_{session_id}_{int(time.time())}"
-        engine = save_to_sql_database(df, table_name)
+        columnar_path = columns_info.pop('columnar_path')
+        dialect = columns_info.pop('dialect')
+        profile = columns_info.pop('profile')
         
         # Store metadata in database
         csv_record = UploadedCSV(
@@ -1131,23 +3549,33 @@ async def upload_csv(
             filename=file.filename,
             file_path=file_path,
             columns_info=json.dumps(columns_info),
-            table_name=table_name
+            table_name=table_name,
+            columnar_path=columnar_path,
+            csv_dialect=json.dumps(dialect),
+            profile=json.dumps(profile)
         )
         db.add(csv_record)
         db.commit()
         db.refresh(csv_record)
         
+        # A new upload supersedes the session's previous frames
+        dataframe_cache.invalidate_tag((current_user.id, session_id))
+        shared_datasets.invalidate_tag((current_user.id, session_id))
+        analysis_result_cache.invalidate_tag((current_user.id, session_id))
+        
         # Create response using the Pydantic model
         response_data = CSVUploadResponse(
             filename=file.filename,
-            shape=df.shape,
-            columns=df.columns.tolist(),
-            dtypes=df.dtypes.astype(str).to_dict(),
-            sample_data=sample_data
+            shape=columns_info['shape'],
+            columns=columns_info['columns'],
+            dtypes=columns_info['dtypes'],
+            sample_data=columns_info['sample_data']
         )
         
         return response_data
         
+    except HTTPException:
+        raise
     except Exception as e:
         # Clean up file if processing failed
         if os.path.exists(file_path):
@@ -1171,29 +3599,87 @@ def data_analysis(
     if not csv_record:
         raise HTTPException(status_code=400, detail="No CSV file uploaded for this session")
     
-    if not os.path.exists(csv_record.file_path):
+    has_columnar = bool(csv_record.columnar_path) and os.path.exists(csv_record.columnar_path)
+    if not has_columnar and not os.path.exists(csv_record.file_path):
         raise HTTPException(status_code=400, detail="CSV file not found. Please re-upload.")
     
-    # Load the CSV
-    try:
-        df = load_csv_file(csv_record.file_path)
-        if df is None:
-            raise HTTPException(status_code=400, detail="Could not load CSV file")
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error loading CSV: {str(e)}")
+    chart_options = chart_render_options(data.chart_format, data.chart_dpi)
     
-    def stream_data_analysis():
+    # A fast-path answer reads at most two columns; when the frame isn't loaded yet,
+    # project those from the Arrow file instead of reading the whole dataset
+    answer = None
+    df = None
+    if data.fast_path and has_columnar and csv_record.id not in dataframe_cache:
+        profile = get_dataset_profile(csv_record, db=db)
         try:
-            # Check if Ollama is available
-            ollama_available = True
-            try:
-                response = requests.get(f"{OLLAMA_BASE_URL}/api/version", timeout=5)
-                if response.status_code != 200:
-                    ollama_available = False
-            except:
-                ollama_available = False
+            projection = fast_path_projection(csv_record, data.prompt, profile)
+            if projection is not None:
+                route, projected = projection
+                answer = fast_path_answer(data.prompt, projected, profile, route=route)
+        except Exception as e:
+            print(f"⚠️ [Fast Path] Projected answer failed, loading the full dataset: {e}")
+    
+    if answer is None:
+        # Load the CSV (served from the parsed-frame cache after the first question)
+        try:
+            df = get_csv_dataframe(csv_record, db)
+            if df is None:
+                raise HTTPException(status_code=400, detail="Could not load CSV file")
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Error loading CSV: {str(e)}")
+        
+        profile = get_dataset_profile(csv_record, df, db)
+    
+    async def stream_data_analysis():
+        nonlocal answer
+        try:
+            # Simple, unambiguous questions are answered without generating or running code
+            if answer is None and data.fast_path:
+                answer = await run_in_threadpool(fast_path_answer, data.prompt, df, profile)
+            if answer:
+                yield json.dumps({
+                    "type": "status",
+                    "message": f"Answered directly from the dataset profile ({answer['intent']}, confidence {answer['confidence']:.2f})",
+                    "done": False
+                }) + "\n"
+                yield json.dumps({
+                    "type": "output",
+                    "content": answer['output'],
+                    "fast_path": True,
+                    "done": False
+                }) + "\n"
+                if answer['chart_spec']:
+                    yield json.dumps({
+                        "type": "chart_spec",
+                        "spec": answer['chart_spec'],
+                        "reduction": None,
+                        "fast_path": True,
+                        "done": False
+                    }) + "\n"
+                yield json.dumps({
+                    "type": "analysis_complete",
+                    "done": True
+                }) + "\n"
+                return
             
-            if ollama_available and data.model in ALLOWED_OLLAMA_MODELS:
+            code = None
+            codegen_key = None
+            code_from_llm = False
+            if data.model in ALLOWED_OLLAMA_MODELS:
+                signature = schema_signature(df)
+                codegen_key = codegen_cache_key(data.model, data.prompt, signature)
+                if data.use_cache:
+                    code = await run_in_threadpool(lookup_generated_code, codegen_key)
+            code_cached = code is not None
+            
+            if code_cached:
+                yield json.dumps({
+                    "type": "status",
+                    "message": "Reusing code generated earlier for this question and dataset schema...",
+                    "done": False
+                }) + "\n"
+            # Check if Ollama is available
+            elif await is_ollama_available() and data.model in ALLOWED_OLLAMA_MODELS:
                 # Generate code using AI
                 yield json.dumps({
                     "type": "status",
@@ -1205,6 +3691,8 @@ def data_analysis(
 Dataset: {df.shape[0]} rows, {df.shape[1]} columns
 Columns: {list(df.columns)}
 Types: {dict(df.dtypes)}
+Column profile:
+{profile_context(profile)}
 
 RULES:
 1. Use 'df' (already loaded)
@@ -1212,50 +3700,73 @@ RULES:
 3. Use print() for results
 4. Keep code concise
 5. Include matplotlib plots when appropriate
+6. 'profile' holds precomputed stats: profile['columns'][col] has mean/median/min/max/nulls/unique/top_values, profile['correlation'] has 'columns' and 'matrix'
 
 Question: {data.prompt}
 Code:"""
                 
-                ai_response = query_ollama_data_analysis(context, model=data.model)
+                code = None
+                async for kind, value in stream_analysis_code(context, model=data.model):
+                    if kind == "delta":
+                        yield json.dumps({
+                            "type": "code_delta",
+                            "content": value,
+                            "done": False
+                        }) + "\n"
+                    elif kind == "code":
+                        code = value
                 
-                if "Error" in ai_response or "TIMEOUT" in ai_response:
+                if code is None:
                     yield json.dumps({
                         "type": "status",
                         "message": "AI unavailable, using fallback code generation...",
                         "done": False
                     }) + "\n"
-                    code = generate_fallback_code(data.prompt, df)
+                    code = generate_fallback_code(data.prompt, df, profile)
                 else:
-                    # Extract code from AI response
-                    if '```python' in ai_response:
-                        code_start = ai_response.find('```python') + 9
-                        code_end = ai_response.find('```', code_start)
-                        code = ai_response[code_start:code_end].strip()
-                    else:
-                        code = ai_response.strip()
+                    code_from_llm = True
             else:
                 yield json.dumps({
                     "type": "status",
                     "message": "Using fallback code generation...",
                     "done": False
                 }) + "\n"
-                code = generate_fallback_code(data.prompt, df)
+                code = generate_fallback_code(data.prompt, df, profile)
             
             # Send the generated code
             yield json.dumps({
                 "type": "code",
                 "content": code,
+                "cached": code_cached,
                 "done": False
             }) + "\n"
             
-            # Execute the code
+            # Replay an earlier run of the same code on the same data, or execute it
+            result_key = analysis_result_key(code, csv_record, chart_options)
+            result = analysis_result_cache.get(result_key) if data.use_cache else None
+            if result is not None and result.get('chart') and not touch_chart_file(result['chart']['name']):
+                # The chart file was pruned since; replaying would link to a 404
+                analysis_result_cache.invalidate(result_key)
+                result = None
+            result_cached = result is not None
             yield json.dumps({
                 "type": "status",
-                "message": "Executing analysis...",
+                "message": "Replaying cached analysis results..." if result_cached else "Executing analysis...",
                 "done": False
             }) + "\n"
             
-            result = execute_data_analysis_code(code, df, csv_record.table_name)
+            if not result_cached:
+                # Workers attach the shared copy; the in-process fallback can use the frame directly
+                dataset = shared_dataset_ref(csv_record, df) if ANALYSIS_WORKERS > 0 else {'frame': df}
+                result = await run_in_threadpool(execute_data_analysis_code, code, dataset, csv_record.table_name, chart_options, profile)
+                if result['success']:
+                    analysis_result_cache.put(result_key, result, tag=(csv_record.user_id, csv_record.session_id))
+            
+            # Only code that ran cleanly is worth reusing
+            if result['success'] and code_from_llm:
+                await run_in_threadpool(store_generated_code, codegen_key, data.model, data.prompt, signature, code)
+            elif not result['success'] and code_cached:
+                await run_in_threadpool(forget_generated_code, codegen_key)
             
             if result['success']:
                 # Send output if any
@@ -1263,14 +3774,39 @@ Code:"""
                     yield json.dumps({
                         "type": "output",
                         "content": result['output'],
+                        "cached": result_cached,
                         "done": False
                     }) + "\n"
                 
-                # Send chart if any
+                # Tell the user when large series were downsampled for plotting
+                for reduction in ((result.get('chart') or {}).get('reduction'), result.get('chart_spec_reduction')):
+                    if reduction:
+                        yield json.dumps({
+                            "type": "status",
+                            "message": describe_chart_reduction(reduction),
+                            "done": False
+                        }) + "\n"
+                
+                # Send a link to the rendered chart; the image itself is fetched from /charts
                 if result.get('chart'):
+                    chart = result['chart']
                     yield json.dumps({
                         "type": "chart",
-                        "content": result['chart'],
+                        "url": f"/charts/{chart['name']}",
+                        "format": chart['format'],
+                        "bytes": chart['bytes'],
+                        "reduction": chart.get('reduction'),
+                        "cached": result_cached,
+                        "done": False
+                    }) + "\n"
+                
+                # Plotly figures are sent as a (decimated) spec the frontend renders interactively
+                if result.get('chart_spec'):
+                    yield json.dumps({
+                        "type": "chart_spec",
+                        "spec": json.loads(result['chart_spec']),
+                        "reduction": result.get('chart_spec_reduction'),
+                        "cached": result_cached,
                         "done": False
                     }) + "\n"
                 
@@ -1304,6 +3840,31 @@ Code:"""
     
     return StreamingResponse(stream_data_analysis(), media_type="application/jsonl")
 
+@app.get("/charts/{name}")
+def get_chart(name: str):
+    """Serve a rendered analysis chart.
+
+    Names are content hashes, so a chart never changes and clients may cache it
+    indefinitely. No auth header is required because <img> tags cannot send one;
+    the unguessable name is the capability.
+    """
+    if not CHART_NAME_RE.match(name):
+        raise HTTPException(status_code=404, detail="Chart not found")
+    file_path = os.path.join(CHART_DIR, name)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="Chart not found")
+    media_type = analysis_worker.CHART_MEDIA_TYPES[name.rsplit('.', 1)[1]]
+    return FileResponse(file_path, media_type=media_type, headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+@app.get("/vendor/plotly.min.js")
+def get_plotly_js():
+    """plotly.js bundled with the Python plotly package, loaded by the frontend for chart_spec events"""
+    import plotly
+    file_path = os.path.join(os.path.dirname(plotly.__file__), 'package_data', 'plotly.min.js')
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="plotly.js is not available")
+    return FileResponse(file_path, media_type="application/javascript", headers={"Cache-Control": "public, max-age=86400"})
+
 @app.get("/csv-info")
 def get_csv_info(
     session_id: str = Query(...),
@@ -1320,12 +3881,16 @@ def get_csv_info(
         return {"has_csv": False}
     
     columns_info = json.loads(csv_record.columns_info) if csv_record.columns_info else {}
+    if not columns_info and csv_record.columnar_path and os.path.exists(csv_record.columnar_path):
+        # Only the file footer is read here, not the data
+        columns_info = read_columnar_schema(csv_record.columnar_path)
     
     return {
         "has_csv": True,
         "filename": csv_record.filename,
         "uploaded_at": csv_record.timestamp.isoformat(),
-        **columns_info
+        **columns_info,
+        "profile": get_dataset_profile(csv_record, db=db)
     }
 
 # ============================================================================
@@ -1337,23 +3902,12 @@ def searxng_search(query: str = Query(..., description="Search query"), max_resu
     """Search using local SearxNG instance."""
     searxng_url = "http://localhost:8888/search"  # Using local SearxNG instance
     
-    params = {
-        "q": query,
-        "format": "json",
-        "categories": "general",
-        "engines": "google,bing,duckduckgo",
-        "pageno": 1
-    }
-    
     try:
-        response = requests.get(searxng_url, params=params, timeout=15)
-        response.raise_for_status()
-        
-        data = response.json()
+        search_results = searxng_results(searxng_url, query, timeout=15)
         
         # Extract and format results
         results = []
-        for result in data.get("results", [])[:max_results]:
+        for result in search_results[:max_results]:
             results.append({
                 "title": result.get("title", ""),
                 "content": result.get("content", ""),
@@ -1368,14 +3922,13 @@ def searxng_search(query: str = Query(..., description="Search query"), max_resu
 
 @app.post("/chain")
 def chain_models(data: ChainRequest):
-    def stream_chain():
+    async def stream_chain():
         current_prompt = data.prompt
         for model_id in data.models:
             if model_id not in ALLOWED_OLLAMA_MODELS:
                 yield json.dumps({"model": model_id, "response": f"Model '{model_id}' is not available on this server.", "done": True}) + "\n"
                 current_prompt = data.prompt
                 continue
-            ollama_url = "http://localhost:11434/api/generate"
             payload = {
                 "model": model_id,
                 "prompt": current_prompt,
@@ -1385,33 +3938,23 @@ def chain_models(data: ChainRequest):
             }
             full_response = ""
             try:
-                with requests.post(ollama_url, json=payload, stream=True, timeout=600) as response:
-                    response.raise_for_status()
-                    for line in response.iter_lines():
-                        if line:
-                            try:
-                                chunk = line.decode()
-                                data_json = json.loads(chunk)
-                                resp = data_json.get("response", "")
-                                done = data_json.get("done", False)
-                                full_response += resp
-                                yield json.dumps({"model": model_id, "response": resp, "done": False}) + "\n"
-                                if done:
-                                    break
-                            except Exception:
-                                continue
-                    # After model is done, send done for this model
-                    yield json.dumps({"model": model_id, "done": True}) + "\n"
-                    # Pass the full output to the next model
-                    current_prompt = full_response
+                async for data_json in stream_ollama_generate(payload):
+                    resp = data_json.get("response", "")
+                    full_response += resp
+                    yield json.dumps({"model": model_id, "response": resp, "done": False}) + "\n"
+                # After model is done, send done for this model
+                yield json.dumps({"model": model_id, "done": True}) + "\n"
+                # Pass the full output to the next model
+                current_prompt = full_response
             except Exception as e:
                 yield json.dumps({"model": model_id, "response": f"Ollama error: {str(e)}", "done": True}) + "\n"
                 current_prompt = data.prompt
     return StreamingResponse(stream_chain(), media_type="application/jsonl")
 
 @app.post("/upload")
-def upload_files(files: List[UploadFile] = File(...), session_id: str = Query(...), db=Depends(get_db), current_user: User = Depends(get_current_user)):
+def upload_files(background_tasks: BackgroundTasks, files: List[UploadFile] = File(...), session_id: str = Query(...), db=Depends(get_db), current_user: User = Depends(get_current_user)):
     saved_files = []
+    index_ids = []
     for file in files:
         if file.filename is None:
             continue
@@ -1457,7 +4000,12 @@ def upload_files(files: List[UploadFile] = File(...), session_id: str = Query(..
         db.add(doc)
         db.commit()
         db.refresh(doc)
-        saved_files.append({"filename": filename, "extracted_text": bool(extracted_text)})
+        if extracted_text:
+            index_ids.append(doc.id)
+        # Embedding runs after the response; "indexing" tells the client it's pending
+        saved_files.append({"filename": filename, "extracted_text": bool(extracted_text), "indexing": bool(extracted_text)})
+    if index_ids:
+        background_tasks.add_task(index_uploaded_documents, index_ids)
     return {"files": saved_files}
 
 # Continue with remaining endpoints...
@@ -1598,6 +4146,205 @@ def tavily_crypto_search(query: str = Query(..., description="Search query"), ma
     except Exception as e:
         return {"error": str(e)}
 
+# ============================================================================
+# UNIFIED SEARCH
+# ============================================================================
+
+SEARCH_PROVIDER_DEADLINE = float(os.getenv("SEARCH_PROVIDER_DEADLINE", "8"))
+SEARCH_POOL_MAX_CONNECTIONS = int(os.getenv("SEARCH_POOL_MAX_CONNECTIONS", "100"))
+SEARCH_RRF_K = 60  # Reciprocal rank fusion constant; keeps one provider's top hit from dominating
+SEARCH_MAX_RESULTS_PER_PROVIDER = int(os.getenv("SEARCH_MAX_RESULTS_PER_PROVIDER", "20"))
+SEARCH_MAX_MERGED_RESULTS = int(os.getenv("SEARCH_MAX_MERGED_RESULTS", "100"))
+SEARCH_CONTENT_MAX_CHARS = 1000  # Page text requested per Exa result
+# Threads for providers with blocking clients, kept apart from the default executor
+SEARCH_THREADS = int(os.getenv("SEARCH_THREADS", "8"))
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_THREADS, thread_name_prefix="search")
+SEARXNG_SEARCH_URL = "http://localhost:8888/search"
+TRACKING_PARAM_PREFIXES = ("utm_", "fbclid", "gclid")
+
+# name -> {"search": async fn(client, query, max_results), "available": fn, "deadline": seconds}
+SEARCH_PROVIDERS = {}
+
+_search_client = None
+
+def get_search_client():
+    """Process-wide async client shared by the /search/all providers"""
+    global _search_client
+    if _search_client is None or _search_client.is_closed:
+        _search_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=SEARCH_POOL_MAX_CONNECTIONS, max_keepalive_connections=20),
+            timeout=httpx.Timeout(SEARCH_PROVIDER_DEADLINE, connect=OLLAMA_CONNECT_TIMEOUT)
+        )
+    return _search_client
+
+@app.on_event("shutdown")
+async def close_search_client():
+    global _search_client
+    if _search_client is not None and not _search_client.is_closed:
+        await _search_client.aclose()
+    _search_client = None
+    search_executor.shutdown(wait=False, cancel_futures=True)
+
+def register_search_provider(name, available=lambda: True, deadline=SEARCH_PROVIDER_DEADLINE):
+    """Decorator that makes an async search(client, query, max_results) function available to /search/all"""
+    def decorator(search):
+        SEARCH_PROVIDERS[name] = {"search": search, "available": available, "deadline": deadline}
+        return search
+    return decorator
+
+def search_result(title, url, content):
+    return {"title": (title or "").strip(), "url": (url or "").strip(), "content": (content or "").strip()}
+
+@register_search_provider("searxng")
+async def searxng_provider(client, query, max_results):
+    # Shares the SearxNG result cache and pooled session with /ask and /search/searxng. A thread
+    # can't be cancelled, so the request timeout (the provider deadline) is what frees it
+    loop = asyncio.get_running_loop()
+    results = await loop.run_in_executor(search_executor, searxng_results, SEARXNG_SEARCH_URL, query, SEARCH_PROVIDER_DEADLINE)
+    return [search_result(r.get("title"), r.get("url"), r.get("content")) for r in results[:max_results]]
+
+@register_search_provider("web", available=lambda: bool(EXA_API_KEY))
+async def exa_provider(client, query, max_results):
+    response = await client.post(
+        "https://api.exa.ai/search",
+        headers={"Accept": "application/json", "Authorization": f"Bearer {EXA_API_KEY}"},
+        # Without "contents" Exa returns titles and URLs only
+        json={"query": query, "numResults": max_results, "contents": {"text": {"maxCharacters": SEARCH_CONTENT_MAX_CHARS}}}
+    )
+    response.raise_for_status()
+    return [search_result(r.get("title"), r.get("url"), r.get("text")) for r in response.json().get("results", [])]
+
+def tavily_provider(search_type):
+    async def search(client, query, max_results):
+        response = await client.post(
+            "https://api.tavily.com/search",
+            headers={"Authorization": f"Bearer {TAVILY_API_KEY}"},
+            json={
+                "query": query,
+                "search_depth": "basic",
+                "include_answer": False,
+                "include_images": False,
+                "include_raw_content": False,
+                "max_results": max_results,
+                "include_sources": True,
+                "search_type": search_type
+            }
+        )
+        response.raise_for_status()
+        return [search_result(r.get("title"), r.get("url"), r.get("content")) for r in response.json().get("results", [])]
+    return search
+
+for vertical in ("youtube", "reddit", "academic", "crypto"):
+    register_search_provider(vertical, available=lambda: bool(TAVILY_API_KEY))(tavily_provider(vertical))
+
+def register_stub_search_provider(name, latency, count=5):
+    """Offline provider with a fixed latency, for load-testing /search/all; even-numbered results are shared by all stubs"""
+    async def search(client, query, max_results):
+        await asyncio.sleep(latency)
+        return [
+            search_result(f"{name} result {i + 1} for {query}", f"https://stub.local/{'shared' if i % 2 == 0 else name}/{i}", f"Stub content {i + 1} from {name}")
+            for i in range(min(count, max_results))
+        ]
+    return register_search_provider(name)(search)
+
+# e.g. SEARCH_STUB_PROVIDERS="stub_fast:0.05,stub_slow:3" adds two stubs with those latencies in seconds
+for stub_spec in filter(None, os.getenv("SEARCH_STUB_PROVIDERS", "").split(",")):
+    stub_name, _, stub_latency = stub_spec.partition(":")
+    register_stub_search_provider(stub_name.strip(), float(stub_latency or 0))
+
+def normalize_result_url(url):
+    """Dedupe key for a result URL: case-folded host without www, no fragment, trailing slash or tracking parameters"""
+    parts = urllib.parse.urlsplit(url)
+    query = [(k, v) for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True) if not k.lower().startswith(TRACKING_PARAM_PREFIXES)]
+    return urllib.parse.urlunsplit((parts.scheme.lower(), parts.netloc.lower().removeprefix("www."), parts.path.rstrip("/"), urllib.parse.urlencode(query), ""))
+
+class SearchResultMerger:
+    """Merges provider result lists, deduplicating by URL and ranking with reciprocal rank fusion"""
+
+    def __init__(self):
+        self._results = {}  # normalized url -> merged result
+
+    def add(self, provider, results):
+        """Merge one provider's results, best first; returns the ones no earlier provider found"""
+        new = []
+        for rank, result in enumerate(results):
+            if not result["url"]:
+                continue
+            key = normalize_result_url(result["url"])
+            merged = self._results.get(key)
+            if merged is None:
+                merged = self._results[key] = {**result, "providers": [], "score": 0.0}
+                new.append(merged)
+            elif len(result["content"]) > len(merged["content"]):
+                merged["content"] = result["content"]
+            if provider not in merged["providers"]:
+                merged["providers"].append(provider)
+                merged["score"] = round(merged["score"] + 1 / (SEARCH_RRF_K + rank + 1), 6)
+        return new
+
+    def ranked(self, limit=None):
+        return sorted(self._results.values(), key=lambda r: r["score"], reverse=True)[:limit]
+
+async def run_search_provider(name, client, query, max_results):
+    """(name, results, error, elapsed_ms) for one provider, bounded by its deadline"""
+    provider = SEARCH_PROVIDERS[name]
+    started = time.time()
+    results, error = None, None
+    if not provider["available"]():
+        error = "not configured"
+    else:
+        try:
+            results = await asyncio.wait_for(provider["search"](client, query, max_results), provider["deadline"])
+        except asyncio.TimeoutError:
+            error = f"no answer within {provider['deadline']:.1f}s"
+        except Exception as e:
+            error = str(e) or type(e).__name__
+    return name, results, error, round((time.time() - started) * 1000, 1)
+
+@app.get("/search/all")
+async def unified_search(
+    query: str = Query(..., description="Search query"),
+    providers: Optional[str] = Query(None, description="Comma-separated provider names; defaults to every configured provider"),
+    max_results: int = Query(5, ge=1, le=SEARCH_MAX_RESULTS_PER_PROVIDER, description="Results requested from each provider"),
+    limit: int = Query(20, ge=1, le=SEARCH_MAX_MERGED_RESULTS, description="Merged results in the final event")
+):
+    """Fan out to several search providers at once and stream their results as they arrive."""
+    if providers:
+        names = list(dict.fromkeys(p.strip() for p in providers.split(",") if p.strip()))
+        unknown = [name for name in names if name not in SEARCH_PROVIDERS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown search providers: {', '.join(unknown)}. Available: {', '.join(SEARCH_PROVIDERS)}")
+    else:
+        names = [name for name, provider in SEARCH_PROVIDERS.items() if provider["available"]()]
+
+    async def stream_search():
+        client = get_search_client()
+        merger = SearchResultMerger()
+        statuses = {}
+        started = time.time()
+        tasks = [asyncio.create_task(run_search_provider(name, client, query, max_results)) for name in names]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                name, results, error, elapsed_ms = await next_done
+                if error:
+                    print(f"⚠️ [Search] {name} failed after {elapsed_ms}ms: {error}")
+                    statuses[name] = {"status": "error", "error": error, "elapsed_ms": elapsed_ms}
+                    yield json.dumps({"type": "provider_error", "provider": name, "error": error, "elapsed_ms": elapsed_ms, "done": False}) + "\n"
+                    continue
+                new = merger.add(name, results)
+                statuses[name] = {"status": "ok", "results": len(results), "new": len(new), "elapsed_ms": elapsed_ms}
+                yield json.dumps({"type": "provider_results", "provider": name, "results": new, "elapsed_ms": elapsed_ms, "done": False}) + "\n"
+        finally:
+            # A client that disconnects mid-stream leaves providers still running; stop them
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+        ranked = merger.ranked(limit)
+        print(f"🔎 [Search] {len(ranked)} merged results from {len(names)} providers in {time.time() - started:.2f}s")
+        yield json.dumps({"type": "search_complete", "results": ranked, "providers": statuses, "done": True}) + "\n"
+
+    return StreamingResponse(stream_search(), media_type="application/jsonl")
+
 # --- Registration Endpoint ---
 @app.post("/register")
 def register_user(data: RegisterRequest, db=Depends(get_db)):
@@ -1762,7 +4509,8 @@ REQUIRED_MODELS = [
     "llama3.1:latest",
     "mistral:latest",
     "anindya/prem1b-sql-ollama-fp116:latest",
-    "deepseek-coder-v2:latest"  # Added for data analysis
+    "deepseek-coder-v2:latest",  # Added for data analysis
+    "nomic-embed-text:latest"  # Document retrieval in /ask
 ]
 
 def ensure_models():
@@ -1774,7 +4522,8 @@ def ensure_models():
             print(f"Failed to pull model {model}: {e}")
 
 # Ensure models are present before starting the server
-ensure_models()
+if not IS_WORKER_PROCESS:
+    ensure_models()
 
 if __name__ == "__main__":
     import uvicorn
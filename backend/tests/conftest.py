@@ -0,0 +1,25 @@
+import os
+import subprocess
+import sys
+from unittest import mock
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="session")
+def main(tmp_path_factory):
+    """backend/main.py imported with its data files in a temp dir, without starting Ollama or pulling models"""
+    data_dir = tmp_path_factory.mktemp("data")
+    cwd = os.getcwd()
+    os.chdir(data_dir)
+    os.environ["DESKTOP_MODE"] = "1"
+    sys.path.insert(0, BACKEND_DIR)
+    try:
+        with mock.patch.object(subprocess, "Popen"), mock.patch.object(subprocess, "run"):
+            import main as main_module
+    finally:
+        os.environ.pop("DESKTOP_MODE", None)
+        os.chdir(cwd)
+    return main_module
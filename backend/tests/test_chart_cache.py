@@ -0,0 +1,39 @@
+import os
+
+
+def test_chart_writes_past_the_budget_prune_the_store(main, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "CHART_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "CHART_CACHE_MAX_BYTES", 250)
+    main.prune_chart_cache(main.CHART_CACHE_MAX_BYTES)
+
+    for i in range(3):
+        path = tmp_path / f"{i:032x}.png"
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (i, i))
+        main.record_chart_write(100)
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == [f"{1:032x}.png", f"{2:032x}.png"]
+    assert main._chart_store_bytes == 200
+
+
+def test_reused_charts_count_as_recently_used(main, tmp_path, monkeypatch):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    monkeypatch.setattr(main, "CHART_DIR", str(tmp_path))
+    options = {**main.chart_render_options("png"), "chart_dir": str(tmp_path)}
+    fig = plt.figure()
+    plt.plot([1, 2, 3])
+    chart = main.analysis_worker.render_chart(fig, options)
+    path = tmp_path / chart["name"]
+    os.utime(path, (0, 0))
+
+    assert main.analysis_worker.render_chart(fig, options)["name"] == chart["name"]
+    assert path.stat().st_mtime > 0
+    os.utime(path, (0, 0))
+    assert main.touch_chart_file(chart["name"]) and path.stat().st_mtime > 0
+
+    path.unlink()
+    assert not main.touch_chart_file(chart["name"])
+    plt.close(fig)
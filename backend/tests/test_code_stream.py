@@ -0,0 +1,30 @@
+def feed_all(main, reply, step=7):
+    block = main.StreamedCodeBlock()
+    deltas = []
+    for i in range(0, len(reply), step):
+        deltas.append(block.feed(reply[i:i + step]))
+        if block.complete:
+            break
+    return block, "".join(deltas)
+
+
+def test_long_preamble_before_the_fence_is_not_taken_as_code(main):
+    preamble = "Sure! Here is an analysis of the dataset that answers your question. " * 4
+    reply = preamble + "\n```python\nprint(df.shape)\n```\nThis prints the shape."
+    block, streamed = feed_all(main, reply)
+    assert block.complete
+    assert block.code == "print(df.shape)"
+    assert streamed.strip() == "print(df.shape)"
+
+
+def test_language_tag_is_matched_case_insensitively(main):
+    block, _ = feed_all(main, "```Python\nresult = df['a'].mean()\n```")
+    assert block.complete
+    assert block.code == "result = df['a'].mean()"
+
+
+def test_unfenced_reply_is_bare_code_once_the_stream_ends(main):
+    reply = "import pandas as pd\n" + "print(df.describe())\n" * 20
+    block, streamed = feed_all(main, reply)
+    assert streamed == "" and not block.complete
+    assert block.code == reply.strip()
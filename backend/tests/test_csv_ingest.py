@@ -0,0 +1,18 @@
+import pandas as pd
+
+
+def test_column_turning_to_text_keeps_earlier_chunk_values(main, tmp_path, monkeypatch):
+    # First chunk of 'code' parses as numbers, later chunks are text
+    monkeypatch.setattr(main, "CSV_CHUNK_ROWS", 4)
+    csv_path = tmp_path / "mixed.csv"
+    rows = [f"{i},{i % 2}" for i in range(4)] + [f"{i},{'ba'[i % 2]}" for i in range(4, 12)]
+    csv_path.write_text("id,code\n" + "\n".join(rows) + "\n")
+
+    dialect = main.sniff_csv_dialect(str(csv_path))
+    plan = main.infer_column_plan(str(csv_path), dialect)
+    chunks = [main.apply_column_plan(chunk, plan, dialect) for chunk in main.iter_csv_chunks(str(csv_path), dialect)]
+    codes = pd.concat(chunks)["code"]
+
+    assert isinstance(codes.dtype, pd.CategoricalDtype)
+    assert codes.isna().sum() == 0
+    assert codes.astype(str).tolist() == [row.split(",")[1] for row in rows]
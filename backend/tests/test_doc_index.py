@@ -0,0 +1,53 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def doc(main, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "DOC_INDEX_DIR", str(tmp_path))
+    main.document_index_cache.clear()
+    main._index_failures.clear()
+    return SimpleNamespace(id=42, user_id=1, session_id="s1", filename="notes.txt",
+                           extracted_text="Revenue grew in the north region. " * 80, index_path=None)
+
+
+def test_concurrent_builds_share_one_embedding_run(main, doc, monkeypatch):
+    calls = []
+
+    def slow_embed(texts, prefix):
+        calls.append(len(texts))
+        time.sleep(0.2)
+        return np.ones((len(texts), 4), dtype=np.float32)
+
+    monkeypatch.setattr(main, "embed_texts", slow_embed)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(main.build_document_index(doc))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(results) == 4 and all(r is results[0] and r is not None for r in results)
+    assert not main._index_builds
+
+
+def test_failed_build_is_not_retried_until_backoff_expires(main, doc, monkeypatch):
+    calls = []
+
+    def failing_embed(texts, prefix):
+        calls.append(len(texts))
+        raise ConnectionError("embed model unreachable")
+
+    monkeypatch.setattr(main, "embed_texts", failing_embed)
+    assert main.build_document_index(doc) is None
+    assert main.build_document_index(doc) is None
+    assert len(calls) == 1
+
+    monkeypatch.setattr(main, "DOC_INDEX_RETRY_SECONDS", 0)
+    assert main.build_document_index(doc) is None
+    assert len(calls) == 2
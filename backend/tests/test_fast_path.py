@@ -0,0 +1,81 @@
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+
+@pytest.fixture
+def bank(main):
+    df = pd.DataFrame({
+        "age": [30, 40, 50, 60],
+        "marital": ["married", "single", "married", "single"],
+        "balance": [100.0, 2.0, 200.0, 2.0],
+    })
+    return df, main.compute_dataset_profile(pa.Table.from_pandas(df, preserve_index=False))
+
+
+@pytest.mark.parametrize("question", [
+    "what is the average balance",
+    "Mean balance by marital",
+    "how many rows are there",
+    "describe the dataset",
+    "What's the mean of balance",
+    "correlation between age and balance",
+])
+def test_plain_questions_take_the_fast_path(main, bank, question):
+    df, profile = bank
+    assert main.fast_path_answer(question, df, profile) is not None
+
+
+@pytest.mark.parametrize("question, intent", [
+    ("What's the mean of Close", "column_stats"),
+    ("correlation between Close and Volume", "correlation_pair"),
+])
+def test_contractions_and_connectives_are_not_leftovers(main, question, intent):
+    df = pd.DataFrame({"Close": [1.0, 2.5, 2.0, 4.0], "Volume": [10, 30, 20, 40]})
+    profile = main.compute_dataset_profile(pa.Table.from_pandas(df, preserve_index=False))
+    route = main.route_question(question, df, profile)
+    assert route["leftover"] == []
+    assert route["intent"] == intent and route["confidence"] >= main.FAST_PATH_MIN_CONFIDENCE
+
+
+@pytest.mark.parametrize("question", [
+    "what is the average balance of married clients",
+    "average balance in 2020",
+    "max balance for single people",
+])
+def test_qualified_questions_skip_the_fast_path(main, bank, question):
+    df, profile = bank
+    route = main.route_question(question, df, profile)
+    assert route["leftover"]
+    assert main.fast_path_answer(question, df, profile) is None
+
+
+def test_fallback_group_by_split_ignores_case(main, bank):
+    df, profile = bank
+    code = main.generate_fallback_code("Show Balance By Age", df, profile)
+    assert "groupby('age_range')['balance']" in code
+
+
+@pytest.mark.parametrize("question", ["average balance", "summary"])
+def test_fallback_summary_keeps_scipy_stats(main, bank, question):
+    df, profile = bank
+    code = main.generate_fallback_code(question, df, profile)
+    namespace = {"pd": pd, "df": df, "profile": profile, "stats": main.stats}
+    exec(code, namespace)
+    assert namespace["stats"] is main.stats
+
+
+@pytest.mark.parametrize("question, columns", [
+    ("Mean balance by marital", ["balance", "marital"]),
+    ("what is the sum of balance", ["balance"]),
+    ("how many rows are there", []),
+])
+def test_fast_path_reads_only_the_columns_it_needs(main, bank, tmp_path, question, columns):
+    from types import SimpleNamespace
+    df, profile = bank
+    path = str(tmp_path / "bank.arrow")
+    main.write_columnar_file(df, path)
+    route, projected = main.fast_path_projection(SimpleNamespace(columnar_path=path), question, profile)
+    assert list(projected.columns) == (columns or list(df.columns))
+    assert len(projected) == (len(df) if columns else 0)
+    assert main.fast_path_answer(question, projected, profile, route=route) == main.fast_path_answer(question, df, profile)
@@ -0,0 +1,56 @@
+import threading
+import time
+
+import pytest
+
+
+def test_interrupted_fetch_does_not_leave_key_in_flight(main):
+    cache = main.CoalescingTTLCache(8, ttl_seconds=60)
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        cache.get_or_fetch("q", interrupted)
+    assert cache.stats()["in_flight"] == 0
+    assert cache.get_or_fetch("q", lambda: "ok") == "ok"
+
+
+def test_waiter_times_out_on_slow_fetch(main):
+    cache = main.CoalescingTTLCache(8, ttl_seconds=60)
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        time.sleep(0.5)
+        return "late"
+
+    leader = threading.Thread(target=cache.get_or_fetch, args=("q", slow))
+    leader.start()
+    started.wait()
+    with pytest.raises(TimeoutError):
+        cache.get_or_fetch("q", slow, timeout=0.05)
+    leader.join()
+    assert cache.get_or_fetch("q", slow, timeout=0.05) == "late"
+
+
+def test_searxng_gets_the_original_query(main, monkeypatch):
+    sent = []
+
+    class Response:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {"results": [{"title": "t"}]}
+
+    class Session:
+        def get(self, url, params, timeout):
+            sent.append(params["q"])
+            return Response()
+
+    main.searxng_cache.clear()
+    monkeypatch.setattr(main, "get_searxng_session", lambda: Session())
+    main.searxng_results("http://searx", "C++  Templates", timeout=1)
+    main.searxng_results("http://searx", "c++ templates", timeout=1)
+    assert sent == ["C++  Templates"]
@@ -0,0 +1,42 @@
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def worker(main, monkeypatch):
+    worker = main.analysis_worker
+    monkeypatch.setattr(worker, "_sql_cache", worker.OrderedDict())
+    monkeypatch.setattr(worker, "_sql_cache_bytes", 0)
+    worker.sql_cache_report()
+    return worker
+
+
+def frame(rows):
+    return pd.DataFrame({"x": range(rows)})
+
+
+def test_cache_is_bounded_by_bytes_in_lru_order(worker, monkeypatch):
+    size = int(frame(100).memory_usage(deep=True).sum())
+    monkeypatch.setattr(worker, "SQL_CACHE_MAX_BYTES", 2 * size)
+    worker.sql_cache_put("a", frame(100))
+    worker.sql_cache_put("b", frame(100))
+    assert worker.sql_cache_get("a") is not None  # "b" is now the least recently used
+    worker.sql_cache_put("c", frame(100))
+
+    assert worker.sql_cache_get("b") is None
+    assert worker.sql_cache_get("a") is not None and worker.sql_cache_get("c") is not None
+    worker.sql_cache_put("huge", frame(1000))
+    assert worker.sql_cache_get("huge") is None
+
+    report = worker.sql_cache_report()
+    assert report["entries"] == 2 and report["bytes"] == 2 * size
+    assert (report["hits"], report["misses"], report["evictions"]) == (3, 2, 1)
+    assert worker.sql_cache_report()["hits"] == 0  # Counters are per report
+
+
+def test_expired_results_are_misses(worker, monkeypatch):
+    monkeypatch.setattr(worker, "SQL_CACHE_TTL", -1)
+    worker.sql_cache_put("a", frame(10))
+    assert worker.sql_cache_get("a") is None
+    report = worker.sql_cache_report()
+    assert report["expirations"] == 1 and report["bytes"] == 0
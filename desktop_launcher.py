@@ -8,6 +8,7 @@ import threading
 import time
 import webview
 import uvicorn
+import multiprocessing
 from multiprocessing import Process
 
 # Add backend to path
@@ -111,4 +112,6 @@ def main():
     print("\n👋 Application closed. Goodbye!")
 
 if __name__ == "__main__":
+    # Analysis worker processes re-launch the frozen executable; let them run their target instead of the app
+    multiprocessing.freeze_support()
     main()
@@ -18,12 +18,13 @@ if os.path.exists(dist_dir):
 
 a = Analysis(
     ['desktop_launcher.py'],  # Use desktop launcher instead of main.py
-    pathex=[project_dir],
+    pathex=[project_dir, os.path.join(project_dir, 'backend')],
     binaries=[],
     datas=frontend_files + [
         ('backend\\requirements.txt', 'backend'),
     ],
     hiddenimports=[
+        'analysis_worker',
         'uvicorn.logging',
         'uvicorn.loops',
         'uvicorn.loops.auto',
@@ -5,6 +5,7 @@ import { Textarea } from '@/components/ui/textarea';
 import { ScrollArea } from '@/components/ui/scroll-area';
 import { ModelSelector } from '@/components/ModelSelector';
 import { CopyButton } from '@/components/CopyButton';
+import { PlotlyChart, PlotlyChartSpec } from '@/components/PlotlyChart';
 import { Badge } from '@/components/ui/badge';
 import { Input } from '@/components/ui/input';
 import { Alert, AlertDescription } from '@/components/ui/alert';
@@ -114,6 +115,7 @@ interface Message {
   analysisCode?: string;
   analysisOutput?: string;
   analysisChart?: string;
+  analysisChartSpec?: PlotlyChartSpec;
   analysisExplanation?: string;
 }
 
@@ -583,6 +585,15 @@ export const ChatInterface = ({ chatId, onLogout }: ChatInterfaceProps) => {
                   : msg
               )
             );
+          } else if (chunk.type === 'code_delta') {
+            // Show generated code as it streams in
+            setMessages(prev => 
+              prev.map(msg => 
+                msg.id === assistantMessage.id 
+                  ? { ...msg, analysisCode: (msg.analysisCode || '') + chunk.content }
+                  : msg
+              )
+            );
           } else if (chunk.type === 'code') {
             // Show generated code
             setMessages(prev => 
@@ -602,11 +613,20 @@ export const ChatInterface = ({ chatId, onLogout }: ChatInterfaceProps) => {
               )
             );
           } else if (chunk.type === 'chart') {
-            // Show generated chart
+            // Show generated chart (served from /charts, not inlined in the stream)
             setMessages(prev => 
               prev.map(msg => 
                 msg.id === assistantMessage.id 
-                  ? { ...msg, analysisChart: chunk.content }
+                  ? { ...msg, analysisChart: chunk.url }
+                  : msg
+              )
+            );
+          } else if (chunk.type === 'chart_spec') {
+            // Interactive Plotly chart
+            setMessages(prev => 
+              prev.map(msg => 
+                msg.id === assistantMessage.id 
+                  ? { ...msg, analysisChartSpec: chunk.spec }
                   : msg
               )
             );
@@ -1086,13 +1106,27 @@ export const ChatInterface = ({ chatId, onLogout }: ChatInterfaceProps) => {
                             Generated Visualization
                           </div>
                           <img 
-                            src={`data:image/png;base64,${message.analysisChart}`} 
+                            src={message.analysisChart.startsWith('/')
+                              ? `${API_BASE_URL}${message.analysisChart}`
+                              : `data:image/png;base64,${message.analysisChart}`} 
                             alt="Data Analysis Chart"
+                            loading="lazy"
                             className="max-w-full h-auto rounded border"
                           />
                         </div>
                       )}
 
+                      {/* Interactive Plotly Chart Display */}
+                      {message.analysisChartSpec && (
+                        <div className="mb-4 p-4 bg-green-50 rounded-lg border border-green-200">
+                          <div className="flex items-center gap-2 text-sm font-bold text-green-800 mb-3">
+                            <BarChart3 className="w-4 h-4" />
+                            Interactive Visualization
+                          </div>
+                          <PlotlyChart spec={message.analysisChartSpec} />
+                        </div>
+                      )}
+
                       {/* Copy button for bot/assistant only */}
                       {!message.isUser && (
                         <div className="absolute bottom-2 right-2 z-10">
@@ -0,0 +1,73 @@
+import { useEffect, useRef, useState } from 'react';
+import { API_BASE_URL } from '@/lib/api';
+
+declare global {
+  interface Window {
+    Plotly?: any;
+  }
+}
+
+export interface PlotlyChartSpec {
+  data: any[];
+  layout?: Record<string, any>;
+}
+
+interface PlotlyChartProps {
+  spec: PlotlyChartSpec;
+}
+
+let plotlyLoader: Promise<any> | null = null;
+
+// plotly.js is served by the backend (from the Python plotly package) and only fetched once a chart needs it
+const loadPlotly = (): Promise<any> => {
+  if (window.Plotly) return Promise.resolve(window.Plotly);
+  if (!plotlyLoader) {
+    plotlyLoader = new Promise((resolve, reject) => {
+      const script = document.createElement('script');
+      script.src = `${API_BASE_URL}/vendor/plotly.min.js`;
+      script.async = true;
+      script.onload = () => resolve(window.Plotly);
+      script.onerror = () => {
+        plotlyLoader = null;
+        reject(new Error('Failed to load the chart library'));
+      };
+      document.head.appendChild(script);
+    });
+  }
+  return plotlyLoader;
+};
+
+export const PlotlyChart = ({ spec }: PlotlyChartProps) => {
+  const containerRef = useRef<HTMLDivElement>(null);
+  const [error, setError] = useState<string | null>(null);
+
+  useEffect(() => {
+    let cancelled = false;
+    const container = containerRef.current;
+
+    loadPlotly()
+      .then((Plotly) => {
+        if (cancelled || !container) return;
+        Plotly.react(
+          container,
+          spec.data,
+          { ...spec.layout, autosize: true },
+          { responsive: true, displaylogo: false }
+        );
+      })
+      .catch((err) => {
+        if (!cancelled) setError(err.message);
+      });
+
+    return () => {
+      cancelled = true;
+      if (container && window.Plotly) window.Plotly.purge(container);
+    };
+  }, [spec]);
+
+  if (error) {
+    return <div className="text-sm text-red-600">{error}</div>;
+  }
+
+  return <div ref={containerRef} className="w-full min-h-[400px]" />;
+};